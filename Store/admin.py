@@ -9,4 +9,13 @@ admin.site.register(PaymentMethod)
 admin.site.register(Location)
 admin.site.register(Order)
 admin.site.register(OrderItem)
-admin.site.register(CanteenSettings)
\ No newline at end of file
+
+
+@admin.register(CanteenSettings)
+class CanteenSettingsAdmin(admin.ModelAdmin):
+    # there is only the one row
+    def has_add_permission(self, request):
+        return not CanteenSettings.objects.exists()
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -1,7 +1,12 @@
-from .models import CanteenSettings
+from .models import CanteenSettings, canteen_settings
 
 class Settings:
     @staticmethod
     def app_settings():
-        settings = CanteenSettings.objects.get(name='canteen')
-        return settings
+        """The canteen settings, from a copy shared by the process. Saving
+        them drops it at once in this worker and within
+        STORE_LOOKUP_CHECK_INTERVAL seconds in the others. Don't modify it."""
+        try:
+            return canteen_settings.get_by_id(CanteenSettings.SINGLETON_PK)
+        except CanteenSettings.DoesNotExist:
+            return CanteenSettings.load()
@@ -3,4 +3,8 @@ from django.apps import AppConfig
 
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'store'
+    name = 'Store'
+
+    def ready(self):
+        # registers the system checks
+        from . import checks
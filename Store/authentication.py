@@ -0,0 +1,209 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.db.models import signals
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import gettext_lazy as _
+from rest_framework import permissions
+from rest_framework.authentication import SessionAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .catalogue import get_version
+from .models import RevokedToken, revoked_tokens
+
+USERS_VERSION = 'auth:users'
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+class TTLCache:
+    """Least recently used map of at most STORE_AUTH_CACHE_SIZE entries,
+    each kept for STORE_AUTH_CACHE_TTL seconds or the shorter ttl it was set
+    with. Other caches name their own size and ttl settings.
+
+    With a version_name every process drops its entries when the version
+    counter moves, checked at most every STORE_LOOKUP_CHECK_INTERVAL
+    seconds, like LookupTable.
+    """
+
+    def __init__(self, version_name=None, size_setting='STORE_AUTH_CACHE_SIZE',
+                 ttl_setting='STORE_AUTH_CACHE_TTL'):
+        self.version_name = version_name
+        self.size_setting = size_setting
+        self.ttl_setting = ttl_setting
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self._checked = 0
+
+    def _check_version(self, now):
+        if self.version_name is None:
+            return
+        if now - self._checked < getattr(settings, 'STORE_LOOKUP_CHECK_INTERVAL', 5):
+            return
+        version = get_version(self.version_name)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._checked = now
+
+    def get(self, key):
+        now = time.monotonic()
+        self._check_version(now)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        default_ttl = getattr(settings, self.ttl_setting, 60)
+        ttl = default_ttl if ttl is None else min(ttl, default_ttl)
+        if ttl <= 0:
+            return value
+        size = getattr(settings, self.size_setting, 10000)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._checked = 0
+
+
+verified_tokens = TTLCache()
+users = TTLCache(version_name=USERS_VERSION)
+
+
+def forget_users(sender, **kwargs):
+    transaction.on_commit(users.clear)
+
+
+# this process once the change commits, Store.models.user_changed tells the others
+signals.post_save.connect(forget_users, sender=settings.AUTH_USER_MODEL, weak=False)
+signals.post_delete.connect(forget_users, sender=settings.AUTH_USER_MODEL, weak=False)
+
+
+def seconds_left(token):
+    return token['exp'] - time.time()
+
+
+def is_revoked(jti):
+    try:
+        revoked_tokens.get(jti)
+    except RevokedToken.DoesNotExist:
+        return False
+    return True
+
+
+def get_user(pk):
+    """The user with this primary key, or None. Users are cached and handed
+    out as copies, so a request can't change another request's user."""
+    user = users.get(pk)
+    if user is None:
+        try:
+            user = users.set(pk, get_user_model()._default_manager.get(pk=pk))
+        except get_user_model().DoesNotExist:
+            return None
+    return copy.copy(user)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that verifies each token once and loads each user
+    once per STORE_AUTH_CACHE_TTL, and refuses revoked tokens. Tokens
+    revoked by another worker are refused once this one notices, within
+    STORE_LOOKUP_CHECK_INTERVAL seconds."""
+
+    def get_validated_token(self, raw_token):
+        token = verified_tokens.get(raw_token)
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            # never outlives the token itself
+            verified_tokens.set(raw_token, token, ttl=seconds_left(token))
+        if is_revoked(token.get(jwt_settings.JTI_CLAIM)):
+            raise InvalidToken(_('Token is revoked'))
+        return token
+
+    def get_user(self, validated_token):
+        if jwt_settings.USER_ID_FIELD != get_user_model()._meta.pk.name:
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = get_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+class CachedSessionAuthentication(SessionAuthentication):
+    """SessionAuthentication with the user taken from the user cache instead
+    of AuthenticationMiddleware's query. Sessions logged in through another
+    backend than ModelBackend go the usual way."""
+
+    def authenticate(self, request):
+        session = request._request.session
+        try:
+            user_id = get_user_model()._meta.pk.to_python(session[SESSION_KEY])
+            backend = session[BACKEND_SESSION_KEY]
+        except KeyError:
+            return None
+        if backend != MODEL_BACKEND or backend not in settings.AUTHENTICATION_BACKENDS:
+            return super().authenticate(request)
+
+        user = get_user(user_id)
+        if user is None or not user.is_active:
+            return None
+        # same check as django.contrib.auth.get_user, a password change ends the session
+        session_hash = session.get(HASH_SESSION_KEY)
+        if not session_hash or not constant_time_compare(session_hash, user.get_session_auth_hash()):
+            session.flush()
+            return None
+
+        self.enforce_csrf(request)
+        return user, None
+
+
+READ_OPEN_PERMISSIONS = (permissions.AllowAny, permissions.IsAuthenticatedOrReadOnly)
+
+
+def has_credentials(request):
+    return 'HTTP_AUTHORIZATION' in request.META or settings.SESSION_COOKIE_NAME in request.COOKIES
+
+
+class AnonymousReadMixin:
+    """Reads without credentials from views anyone may read skip the
+    authentication classes, the user is anonymous either way"""
+
+    def perform_authentication(self, request):
+        if request.method in permissions.SAFE_METHODS and not has_credentials(request) and all(
+                isinstance(permission, type) and issubclass(permission, READ_OPEN_PERMISSIONS)
+                for permission in self.permission_classes):
+            request.user = AnonymousUser()
+            request.auth = None
+            return
+        super().perform_authentication(request)
@@ -0,0 +1,184 @@
+import json
+import platform
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .catalogue import store_cache
+from .models import *
+
+USERNAME = 'benchmark'
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = round(percent / 100 * (len(values) - 1))
+    return values[index]
+
+
+def measure(request, count, concurrency, prepare=None):
+    """Runs `request` count times over `concurrency` threads, with a client
+    per thread, and summarises latency and queries.
+    """
+    local = threading.local()
+
+    def run(i):
+        if not hasattr(local, 'client'):
+            local.client = logged_in_client()
+        client = local.client
+        if prepare:
+            prepare()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = request(client, i)
+            elapsed = time.perf_counter() - started
+        close_old_connections()
+        return elapsed, len(queries), response.status_code
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(run, range(count)))
+    else:
+        results = [run(i) for i in range(count)]
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed * 1000 for elapsed, _, _ in results]
+    queries = [count for _, count, _ in results]
+    return {
+        'requests': count,
+        'errors': sum(status >= 400 for _, _, status in results),
+        'mean_ms': round(statistics.mean(latencies), 3),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p90_ms': round(percentile(latencies, 90), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(max(latencies), 3),
+        'throughput_rps': round(count / wall, 1),
+        'queries_mean': round(statistics.mean(queries), 2),
+        'queries_max': max(queries),
+    }
+
+
+def logged_in_client():
+    # requests have to pass the ALLOWED_HOSTS check
+    host = next((host for host in settings.ALLOWED_HOSTS if host[0] not in '.*'), 'localhost')
+    client = Client(SERVER_NAME=host)
+    client.force_login(User.objects.get(username=USERNAME))
+    return client
+
+
+def order_placement():
+    menu_ids = list(Menu.objects.values_list('pk', flat=True)[:50])
+    day = timezone.localdate() + timedelta(days=1)
+    noon = timezone.make_aware(datetime(day.year, day.month, day.day, 12))
+
+    def place_order(client, i):
+        return client.post('/api/v1/orders/place/', {
+            'fullname': f'Benchmark {i}', 'phone_number': '0820000000',
+            'scheduled_for': (noon + timedelta(minutes=i % 120)).isoformat(),
+            'items': [{'menu': menu_ids[i % len(menu_ids)], 'qty': 1}],
+        }, content_type='application/json')
+    return place_order
+
+
+def jwt_requests():
+    """Menus with a bearer token, anonymously, and token refreshes. The
+    menu list comes from the catalogue cache, so whatever queries these
+    make are spent on authentication.
+    """
+    refresh = RefreshToken.for_user(User.objects.get(username=USERNAME))
+    bearer = f'Bearer {refresh.access_token}'
+    return {
+        # an empty cookie header drops the session cookie of the client
+        'menus (anonymous)': lambda client, i: client.get('/api/v1/menus/', HTTP_COOKIE=''),
+        'menus (jwt)': lambda client, i: client.get('/api/v1/menus/', HTTP_COOKIE='',
+                                                    HTTP_AUTHORIZATION=bearer),
+        'orders (jwt)': lambda client, i: client.get('/api/v1/orders/', HTTP_COOKIE='',
+                                                     HTTP_AUTHORIZATION=bearer),
+        'token refresh': lambda client, i: client.post('/api/token/refresh/', {'refresh': str(refresh)},
+                                                       HTTP_COOKIE='', content_type='application/json'),
+    }
+
+
+def search_requests():
+    """Typeahead for growing prefixes of menu and category words, and a
+    full search, as a customer would type them"""
+    words = [word for name in Menu.objects.values_list('name', flat=True)[:200] for word in name.split()]
+    queries = [word[:length] for word in words for length in (1, 2, 3, len(word))] or ['a']
+    return {
+        'typeahead': lambda client, i: client.get('/api/v1/menus/typeahead/', {'q': queries[i % len(queries)]}),
+        'menu search': lambda client, i: client.get('/api/v1/menus/search/', {'q': queries[i % len(queries)]}),
+    }
+
+
+def scenarios():
+    location = locations.all()[0]
+    return {
+        'menus': (lambda client, i: client.get('/api/v1/menus/'), None),
+        **{name: (request, None) for name, request in jwt_requests().items()},
+        **{name: (request, None) for name, request in search_requests().items()},
+        'menus (cold cache)': (lambda client, i: client.get('/api/v1/menus/'), store_cache().clear),
+        'categories': (lambda client, i: client.get('/api/v1/categories/'), None),
+        'locations': (lambda client, i: client.get('/api/v1/locations/'), None),
+        'orders': (lambda client, i: client.get('/api/v1/orders/'), None),
+        'orders by location': (lambda client, i: client.get(f'/api/v1/orders/?location={location.pk}'), None),
+        'place order': (order_placement(), None),
+    }
+
+
+def run_benchmarks(count=200, concurrency=1, only=None):
+    """Measures every scenario and returns the report"""
+    if not User.objects.filter(username=USERNAME).exists():
+        User.objects.create_user(USERNAME)
+    results = {}
+    for name, (request, prepare) in scenarios().items():
+        if only and name not in only:
+            continue
+        # one unmeasured request to warm caches and imports
+        request(logged_in_client(), 0)
+        results[name] = measure(request, count, concurrency, prepare)
+
+    return {
+        'created': timezone.now().isoformat(),
+        'environment': {
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'concurrency': concurrency,
+        },
+        'dataset': {model._meta.model_name: model.objects.count()
+                    for model in (Category, Menu, Location, Order, OrderItem)},
+        'results': results,
+    }
+
+
+def compare(report, baseline):
+    """Relative change per scenario of the latency percentiles and
+    throughput against an earlier report, in percent
+    """
+    changes = {}
+    for name, result in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        changes[name] = {
+            key: round((result[key] - previous[key]) / previous[key] * 100, 1) if previous[key] else None
+            for key in ('p50_ms', 'p99_ms', 'throughput_rps', 'queries_mean')
+        }
+    return changes
+
+
+def dump(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,81 @@
+import pickle
+
+import redis
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+class RedisCache(BaseCache):
+    """Minimal Redis cache backend, Django 3.1 ships without one.
+
+    LOCATION is a redis url, e.g. redis://127.0.0.1:6379/0
+    """
+
+    def __init__(self, server, params):
+        super().__init__(params)
+        self._client = redis.Redis.from_url(server)
+
+    def _ttl(self, timeout):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return None
+        # redis rejects a zero expiry, keep it at the smallest allowed value
+        return max(int(timeout), 1)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return bool(self._client.set(self._key(key, version), pickle.dumps(value),
+                                     ex=self._ttl(timeout), nx=True))
+
+    def get(self, key, default=None, version=None):
+        value = self._client.get(self._key(key, version))
+        if value is None:
+            return default
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._client.set(self._key(key, version), pickle.dumps(value), ex=self._ttl(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        ttl = self._ttl(timeout)
+        if ttl is None:
+            return bool(self._client.persist(key))
+        return bool(self._client.expire(key, ttl))
+
+    def delete(self, key, version=None):
+        return bool(self._client.delete(self._key(key, version)))
+
+    def has_key(self, key, version=None):
+        return bool(self._client.exists(self._key(key, version)))
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = self._client.mget([self._key(key, version) for key in keys])
+        return {key: pickle.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        # counters are stored pickled like every other value, so do the
+        # read-modify-write inside a transaction
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    value = pipe.get(key)
+                    if value is None:
+                        raise ValueError("Key '%s' not found" % key)
+                    value = pickle.loads(value) + delta
+                    pipe.multi()
+                    pipe.set(key, pickle.dumps(value), keepttl=True)
+                    pipe.execute()
+                    return value
+                except redis.WatchError:
+                    continue
+
+    def clear(self):
+        self._client.flushdb()
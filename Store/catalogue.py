@@ -0,0 +1,137 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+
+from .databases import primary
+
+VERSION_KEY = 'store:version:{}'
+MODIFIED_KEY = 'store:modified:{}'
+MENU_CATALOGUE_KEY = 'store:menu-catalogue:{version}:{base}:{format}'
+
+
+def store_cache():
+    return caches[getattr(settings, 'STORE_CACHE', 'default')]
+
+
+def versions_in_database():
+    """Whether the change counters are kept in the database, STORE_VERSIONS.
+    The cache only works for them when every worker shares it."""
+    return getattr(settings, 'STORE_VERSIONS', 'database') == 'database'
+
+
+def database_stamp(name):
+    from .models import CacheVersion
+
+    with primary():
+        stamp = CacheVersion.objects.filter(name=name).values_list('version', 'modified').first()
+    if stamp is None:
+        counter = CacheVersion.objects.get_or_create(name=name, defaults={'modified': time.time()})[0]
+        stamp = (counter.version, counter.modified)
+    return stamp
+
+
+def get_version(name):
+    if versions_in_database():
+        return database_stamp(name)[0]
+    cache = store_cache()
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(MODIFIED_KEY.format(name), time.time(), timeout=None)
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def get_stamp(name):
+    """Returns (version, modified timestamp) for a model's change counter"""
+    if versions_in_database():
+        return database_stamp(name)
+    cache = store_cache()
+    keys = [VERSION_KEY.format(name), MODIFIED_KEY.format(name)]
+    stamp = cache.get_many(keys)
+    if len(stamp) < 2:
+        version = get_version(name)
+        cache.add(keys[1], time.time(), timeout=None)
+        return version, cache.get(keys[1])
+    return stamp[keys[0]], stamp[keys[1]]
+
+
+# name -> (stamp, when it was checked), see cached_stamp
+stamps = {}
+
+
+def fresh_stamp(name):
+    """The stamp cached_stamp() keeps while it needs no check, else None"""
+    entry = stamps.get(name)
+    if entry is not None and time.monotonic() - entry[1] < getattr(settings, 'STORE_LOOKUP_CHECK_INTERVAL', 5):
+        return entry[0]
+    return None
+
+
+def cached_stamp(name):
+    """get_stamp() kept in process and checked again at most every
+    STORE_LOOKUP_CHECK_INTERVAL seconds, like LookupTable, for the reads
+    answered on the event loop. Bumps made by this process are seen at
+    once."""
+    stamp = fresh_stamp(name)
+    if stamp is None:
+        stamp = get_stamp(name)
+        stamps[name] = (stamp, time.monotonic())
+    return stamp
+
+
+def request_stamp(name):
+    """The stamp for checks made on every request, straight from a shared
+    cache but through cached_stamp() from the database"""
+    return cached_stamp(name) if versions_in_database() else get_stamp(name)
+
+
+def bump_version(name):
+    stamps.pop(name, None)
+    if versions_in_database():
+        from .models import CacheVersion
+
+        with transaction.atomic():
+            CacheVersion.objects.get_or_create(name=name, defaults={'modified': time.time()})
+            CacheVersion.objects.filter(name=name).update(version=F('version') + 1, modified=time.time())
+            return CacheVersion.objects.filter(name=name).values_list('version', flat=True).get()
+    cache = store_cache()
+    key = VERSION_KEY.format(name)
+    cache.set(MODIFIED_KEY.format(name), time.time(), timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # nobody has read the version yet, anything above the default will do
+        cache.set(key, 2, timeout=None)
+        return 2
+
+
+def bump_on_commit(*names):
+    """Bumps the versions once the current transaction commits, at once
+    outside of one. Bumped any earlier, a reader could cache the rows from
+    before the change under the new version."""
+    def bump():
+        for name in names:
+            bump_version(name)
+    transaction.on_commit(bump)
+
+
+def menu_catalogue(request, build, format=None):
+    """Serialized menu keyed by id, built once per catalogue version.
+
+    The serialized rows contain absolute urls, so the entry is also keyed by
+    the host the request came in on and the format suffix (menus.json links
+    to menus/1.json).
+    """
+    cache = store_cache()
+    key = MENU_CATALOGUE_KEY.format(version=request_stamp('menu')[0],
+                                    base=request.build_absolute_uri('/'), format=format or '')
+    catalogue = cache.get(key)
+    if catalogue is None:
+        catalogue = {item['id']: item for item in build()}
+        cache.set(key, catalogue, timeout=getattr(settings, 'STORE_CATALOGUE_TIMEOUT', None))
+    return catalogue
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# caches each worker keeps to itself
+PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_versions(app_configs, **kwargs):
+    """Version counters in a cache the workers don't share would leave
+    revoked tokens and changed rows cached in every other worker"""
+    versions = getattr(settings, 'STORE_VERSIONS', 'database')
+    if versions not in ('cache', 'database'):
+        return [Error(f"STORE_VERSIONS must be 'cache' or 'database', not {versions!r}.", id='Store.E001')]
+    cache = settings.CACHES.get(getattr(settings, 'STORE_CACHE', 'default'), {})
+    if versions == 'cache' and cache.get('BACKEND') in PROCESS_CACHES:
+        return [Error("STORE_VERSIONS = 'cache' needs a cache every worker shares.",
+                      hint=f"STORE_CACHE is a {cache['BACKEND'].rsplit('.', 1)[-1]}, which each worker keeps to "
+                           "itself. Set REDIS_URL or keep the counters in the database.",
+                      id='Store.E002')]
+    return []
@@ -0,0 +1,102 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework import permissions
+
+PRIMARY_COOKIE = 'store_primary'
+
+use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+def replica_alias():
+    """STORE_REPLICA_DATABASE when it's configured in DATABASES"""
+    alias = getattr(settings, 'STORE_REPLICA_DATABASE', None)
+    return alias if alias and alias in connections.databases else None
+
+
+@contextmanager
+def primary():
+    """Reads in the block go to the primary, for results that are cached
+    past the request and mustn't lag behind"""
+    token = use_replica.set(False)
+    try:
+        yield
+    finally:
+        use_replica.reset(token)
+
+
+class ReplicaRouter:
+    """Sends the reads of replica routed requests to STORE_REPLICA_DATABASE,
+    everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        return replica_alias() if use_replica.get() else None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        return True
+
+
+class ReplicaReadMixin:
+    """Runs the `replica_actions` of a viewset against the replica.
+
+    A successful write sets a cookie that keeps the client on the primary
+    for STORE_REPLICA_PIN_SECONDS, so it reads its own writes while the
+    replica catches up.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def dispatch(self, request, *args, **kwargs):
+        token = use_replica.set(False)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            use_replica.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.replica_actions and request.method in permissions.SAFE_METHODS \
+                and PRIMARY_COOKIE not in request.COOKIES:
+            use_replica.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in permissions.SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(PRIMARY_COOKIE, '1', samesite='Lax',
+                                max_age=getattr(settings, 'STORE_REPLICA_PIN_SECONDS', 5))
+        return response
+
+
+class ConnectionHealthMiddleware:
+    """Pings the persistent connections a request reuses after they sat idle
+    for STORE_DB_HEALTH_CHECK_IDLE seconds and closes the ones the server
+    dropped meanwhile, so the request opens a fresh one instead of failing
+    on its first query. Connections in steady use aren't pinged, as with
+    Django 4.1's CONN_HEALTH_CHECKS."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'STORE_DB_HEALTH_CHECKS', True):
+            return self.get_response(request)
+        idle = getattr(settings, 'STORE_DB_HEALTH_CHECK_IDLE', 10)
+        now = time.monotonic()
+        for connection in connections.all():
+            last_used = getattr(connection, 'store_last_used', None)
+            if connection.connection is not None and not connection.in_atomic_block \
+                    and (last_used is None or now - last_used >= idle) and not connection.is_usable():
+                connection.close()
+        try:
+            return self.get_response(request)
+        finally:
+            now = time.monotonic()
+            for connection in connections.all():
+                if connection.connection is not None:
+                    connection.store_last_used = now
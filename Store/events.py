@@ -0,0 +1,189 @@
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SECONDS = 15
+# the listener waits this long before reconnecting, doubling up to the maximum
+RECONNECT_SECONDS = 1
+MAX_RECONNECT_SECONDS = 30
+
+
+class Subscription:
+    def __init__(self, channels, maxsize=100):
+        self.channels = channels
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def deliver(self, event):
+        # a client that stops reading only loses its own events
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+
+class InMemoryHub:
+    """Fans events out to the subscribers in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels)
+        with self._lock:
+            for channel in channels:
+                self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions[channel].discard(subscription)
+                if not self._subscriptions[channel]:
+                    del self._subscriptions[channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            # publishers are sync django code, not the event loop thread
+            subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+
+
+class RedisHub(InMemoryHub):
+    """Publishes through redis pub/sub so subscribers on every worker get
+    the event. Each process runs one listener thread that feeds its local
+    subscribers, and reconnects when the connection drops; the events
+    published meanwhile are lost.
+    """
+    prefix = 'store:events:'
+
+    def __init__(self, url=None):
+        super().__init__()
+        self._client = redis.Redis.from_url(url or settings.STORE_EVENTS_REDIS_URL)
+        self._listener = None
+
+    def subscribe(self, channels):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, daemon=True)
+                self._listener.start()
+        return super().subscribe(channels)
+
+    def publish(self, channel, event):
+        # events are published once the change commits, failing the request
+        # then wouldn't undo it
+        try:
+            self._client.publish(self.prefix + channel, json.dumps(event))
+        except redis.RedisError:
+            logger.exception("Couldn't publish an event on %s", channel)
+
+    def _listen(self):
+        delay = RECONNECT_SECONDS
+        try:
+            while True:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                try:
+                    pubsub.psubscribe(self.prefix + '*')
+                    delay = RECONNECT_SECONDS
+                    for message in pubsub.listen():
+                        channel = message['channel'].decode()[len(self.prefix):]
+                        super().publish(channel, json.loads(message['data']))
+                except redis.RedisError:
+                    logger.warning('Lost the event subscription, reconnecting in %s seconds', delay, exc_info=True)
+                finally:
+                    pubsub.close()
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_SECONDS)
+        finally:
+            # the next subscriber starts another one
+            with self._lock:
+                self._listener = None
+
+
+@lru_cache(maxsize=None)
+def get_hub():
+    return import_string(getattr(settings, 'STORE_EVENTS_BACKEND', 'Store.events.InMemoryHub'))()
+
+
+def order_event(order_id, location_id, status_name, scheduled_for):
+    return {
+        'order': order_id,
+        'location': location_id,
+        'status': status_name,
+        'scheduled_for': scheduled_for.isoformat() if scheduled_for else None,
+    }
+
+
+def publish_order_status(order, status_name):
+    event = order_event(order.pk, order.location_id, status_name, order.scheduled_for)
+    hub = get_hub()
+    hub.publish(f'order:{order.pk}', event)
+    if order.location_id is not None:
+        hub.publish(f'location:{order.location_id}', event)
+
+
+EVENTS_PATH = re.compile(r'^/api/v1/events/(?P<kind>orders|locations)/(?P<pk>\d+)/$')
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream_events(scope, receive, send, channel):
+    """Server-Sent Events stream of the order status changes on a channel"""
+    hub = get_hub()
+    subscription = hub.subscribe([channel])
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        while True:
+            event = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait({event, disconnected}, timeout=KEEPALIVE_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                event.cancel()
+                break
+            if event in done:
+                body = f'event: status\ndata: {json.dumps(event.result())}\n\n'
+            else:
+                event.cancel()
+                body = ': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+    finally:
+        disconnected.cancel()
+        hub.unsubscribe(subscription)
+
+
+def events_application(application):
+    """Serves /api/v1/events/orders/<id>/ and /api/v1/events/locations/<id>/
+    straight from the ASGI server and hands everything else to django.
+    """
+    async def app(scope, receive, send):
+        match = EVENTS_PATH.match(scope.get('path', '')) if scope['type'] == 'http' else None
+        if match is None or scope['method'] != 'GET':
+            return await application(scope, receive, send)
+        channel = f"{match['kind'][:-1]}:{match['pk']}"
+        await stream_events(scope, receive, send, channel)
+    return app
@@ -0,0 +1,209 @@
+import csv
+import io
+import json
+import re
+
+from asgiref.wsgi import WsgiToAsgi
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.http import StreamingHttpResponse
+from rest_framework import serializers
+from rest_framework.renderers import BaseRenderer
+
+from .models import *
+from .renderers import orjson
+from .values import decimal_field
+
+EXPORTS_PATH = re.compile(r'^/api/v1/exports/')
+
+
+def pages(queryset, size=None):
+    """The rows of a .values() queryset including 'id', in id order and in
+    lists of at most `size`.
+
+    Each page is its own query, continuing after the last id of the one
+    before, so no cursor stays open while the rows are written out (MySQL's
+    driver would read a whole .iterator() result into memory anyway) and
+    the last page costs as much as the first.
+    """
+    size = size or getattr(settings, 'STORE_EXPORT_CHUNK_SIZE', 2000)
+    queryset = queryset.order_by('id')
+    last = None
+    while True:
+        rows = list((queryset if last is None else queryset.filter(id__gt=last))[:size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]['id']
+
+
+class Export:
+    """Records of one model for CSV and NDJSON files, as dicts of strings,
+    numbers, booleans and None. Decimals and datetimes are written as the
+    API writes them."""
+    columns = ()
+
+    def __init__(self, queryset=None):
+        self.queryset = self.model.objects.all() if queryset is None else queryset
+
+    def pages(self):
+        raise NotImplementedError
+
+    def csv_rows(self, record):
+        yield [record[column] for column in self.columns]
+
+
+class CategoryExport(Export):
+    model = Category
+    columns = ('id', 'description')
+
+    def pages(self):
+        return pages(self.queryset.values(*self.columns))
+
+
+class MenuExport(Export):
+    model = Menu
+    columns = ('id', 'name', 'description', 'category', 'price', 'is_special')
+    price_field = decimal_field(Menu, 'price')
+
+    def pages(self):
+        for rows in pages(self.queryset.values('id', 'name', 'description', 'category__description',
+                                               'price', 'is_special')):
+            yield [{
+                'id': row['id'],
+                'name': row['name'],
+                'description': row['description'],
+                'category': row['category__description'],
+                'price': self.price_field.to_representation(row['price']),
+                'is_special': row['is_special'],
+            } for row in rows]
+
+
+class OrderExport(Export):
+    """Orders with their line items. NDJSON nests the items, CSV has a
+    line per item with the order's columns repeated, or a single line with
+    empty item columns for an order without any."""
+    model = Order
+    columns = ('id', 'fullname', 'phone_number', 'location', 'status', 'payment', 'scheduled_for',
+               'total', 'item_count', 'item_menu_id', 'item_menu', 'item_qty', 'item_unit_price')
+    datetime_field = serializers.DateTimeField()
+    total_field = decimal_field(Order, 'total')
+    unit_price_field = decimal_field(OrderItem, 'unit_price')
+
+    def pages(self):
+        for rows in pages(self.queryset.values('id', 'fullname', 'phone_number', 'location__name',
+                                               'status__name', 'payment__name', 'scheduled_for', 'total',
+                                               'item_count')):
+            items = {}
+            for item in OrderItem.objects.filter(order_id__in=[row['id'] for row in rows]) \
+                    .values('order_id', 'menu_id', 'menu__name', 'qty', 'unit_price').order_by('order_id', 'id'):
+                items.setdefault(item['order_id'], []).append({
+                    'menu_id': item['menu_id'],
+                    'menu': item['menu__name'],
+                    'qty': item['qty'],
+                    'unit_price': self.unit_price_field.to_representation(item['unit_price'])
+                        if item['unit_price'] is not None else None,
+                })
+            yield [{
+                'id': row['id'],
+                'fullname': row['fullname'],
+                'phone_number': row['phone_number'],
+                'location': row['location__name'],
+                'status': row['status__name'],
+                'payment': row['payment__name'],
+                'scheduled_for': self.datetime_field.to_representation(row['scheduled_for']),
+                'total': self.total_field.to_representation(row['total']),
+                'item_count': row['item_count'],
+                'items': items.get(row['id'], []),
+            } for row in rows]
+
+    def csv_rows(self, record):
+        order = [record[column] for column in self.columns[:9]]
+        for item in record['items'] or [dict.fromkeys(('menu_id', 'menu', 'qty', 'unit_price'))]:
+            yield order + [item['menu_id'], item['menu'], item['qty'], item['unit_price']]
+
+
+EXPORTS = {
+    'categories': CategoryExport,
+    'menus': MenuExport,
+    'orders': OrderExport,
+}
+
+
+def write_csv(export):
+    """The export as CSV, a chunk of bytes per page"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export.columns)
+    for records in export.pages():
+        for record in records:
+            writer.writerows(export.csv_rows(record))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def json_line(record):
+    if orjson is not None:
+        return orjson.dumps(record) + b'\n'
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+
+
+def write_ndjson(export):
+    """The export as a JSON object per line, a chunk of bytes per page"""
+    for records in export.pages():
+        yield b''.join(json_line(record) for record in records)
+
+
+WRITERS = {
+    'csv': (write_csv, 'text/csv; charset=utf-8'),
+    'ndjson': (write_ndjson, 'application/x-ndjson'),
+}
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Picks the NDJSON export, and renders its error responses"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b'' if data is None else json_line(data)
+
+
+class CSVRenderer(BaseRenderer):
+    """Picks the CSV export, and renders its error responses as name,
+    message lines"""
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        buffer = io.StringIO()
+        if isinstance(data, dict):
+            csv.writer(buffer).writerows(data.items())
+        return buffer.getvalue().encode()
+
+
+def export_response(export, file_format, filename):
+    write, content_type = WRITERS[file_format]
+    response = StreamingHttpResponse(write(export), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{file_format}"'
+    return response
+
+
+def exports_application(application):
+    """Runs /api/v1/exports/ through django's WSGI handler in a thread.
+
+    Django's ASGI handler iterates a streaming response on the event loop,
+    where the export's queries aren't allowed. The WSGI handler iterates it
+    in the thread that runs the view.
+    """
+    exports = WsgiToAsgi(get_wsgi_application())
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'http' and EXPORTS_PATH.match(scope['path']):
+            return await exports(scope, receive, send)
+        return await application(scope, receive, send)
+    return app
@@ -0,0 +1,47 @@
+from django_filters import rest_framework as filters
+from rest_framework import serializers
+
+from .models import *
+
+
+class IdOrNameInFilter(filters.BaseInFilter, filters.CharFilter):
+    pass
+
+
+class OrderFilter(filters.FilterSet):
+    """Kitchen queue filters, e.g.
+    ?location=Office&status=Created,Ready for collection&scheduled_for_before=...
+
+    Locations, statuses and payment methods can be given by id or name.
+    Names are translated to ids from the lookup tables so the filter stays
+    on the order table's indexes, a name that doesn't exist is refused.
+    """
+    location = IdOrNameInFilter(method='filter_lookup')
+    status = IdOrNameInFilter(method='filter_lookup')
+    payment = IdOrNameInFilter(method='filter_lookup')
+    scheduled_for = filters.IsoDateTimeFromToRangeFilter()
+
+    lookup_tables = {
+        'location': locations,
+        'status': order_statuses,
+        'payment': payment_methods,
+    }
+
+    class Meta:
+        model = Order
+        fields = ('location', 'status', 'payment', 'scheduled_for')
+
+    def filter_lookup(self, queryset, name, value):
+        table = self.lookup_tables[name]
+        ids, missing = [], []
+        for key in value:
+            if key.isdigit():
+                ids.append(int(key))
+                continue
+            try:
+                ids.append(table.get(key).pk)
+            except table.model.DoesNotExist:
+                missing.append(f'"{key}" does not exist.')
+        if missing:
+            raise serializers.ValidationError({name: missing})
+        return queryset.filter(**{f'{name}__in': ids})
@@ -0,0 +1,289 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, models, transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# sent with the model class and the instance once new variants are stored
+variants_ready = Signal()
+
+CENTRING = {
+    'top': 0, 'middle': 0.5, 'bottom': 1,
+    'left': 0, 'center': 0.5, 'right': 1,
+}
+
+
+class ProcessedImageField(models.ImageField):
+    """Image field that stores the upload as is and renders the resized
+    copies in the background once the record is committed.
+
+    Besides the `size` copy used where a single picture is linked, every
+    width in `widths` is rendered as JPEG and WebP with the aspect ratio of
+    `size`. The rendered files are recorded in the JSON field named by
+    `variants_field`, together with the original they were made from.
+    """
+
+    formats = (
+        ('jpeg', 'JPEG', 'jpg'),
+        ('webp', 'WEBP', 'webp'),
+    )
+
+    def __init__(self, verbose_name=None, name=None, size=(300, 200), crop=('middle', 'center'),
+                 widths=(320, 640, 1280), quality=80, variants_field=None, **kwargs):
+        self.size = list(size)
+        self.crop = list(crop)
+        self.widths = list(widths)
+        self.quality = quality
+        self.variants_field = variants_field
+        super().__init__(verbose_name, name, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs.update(size=self.size, crop=self.crop, widths=self.widths, quality=self.quality,
+                      variants_field=self.variants_field)
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super().contribute_to_class(cls, name, **kwargs)
+        if self.variants_field is None:
+            self.variants_field = f'{name}_variants'
+        if not cls._meta.abstract:
+            models.signals.post_init.connect(self._remember_files, sender=cls, weak=False)
+            models.signals.post_save.connect(self._saved, sender=cls, weak=False)
+            models.signals.pre_delete.connect(self._deleting, sender=cls, weak=False)
+            models.signals.post_delete.connect(self._deleted, sender=cls, weak=False)
+
+    def stored_files(self, name, variants):
+        """Every file in storage that belongs to an upload"""
+        if not name:
+            return []
+        return [name, *variant_files(variants or {})]
+
+    def _current_files(self, instance):
+        # read from __dict__ so deferred loads don't query for them
+        file = instance.__dict__.get(self.attname)
+        return getattr(file, 'name', file), instance.__dict__.get(self.variants_field)
+
+    def _remember_files(self, sender, instance, **kwargs):
+        instance.__dict__.setdefault('_saved_files', {})[self.name] = self._current_files(instance)
+
+    def _refresh_variants(self, instance):
+        """Re-reads the variants when the ones in memory predate the worker,
+        so saving the record doesn't write them back over the new ones.
+        """
+        saved = instance.__dict__.setdefault('_saved_files', {})
+        name, variants = saved.get(self.name, (None, None))
+        if instance.pk is None or not name or (variants or {}).get('source') == name:
+            return
+        variants = type(instance)._base_manager.filter(pk=instance.pk) \
+            .values_list(self.variants_field, flat=True).first()
+        saved[self.name] = (name, variants)
+        if self._current_files(instance)[0] == name:
+            setattr(instance, self.variants_field, variants)
+
+    def pre_save(self, model_instance, add):
+        if not add:
+            self._refresh_variants(model_instance)
+        return super().pre_save(model_instance, add)
+
+    def _saved(self, sender, instance, **kwargs):
+        saved = instance.__dict__.setdefault('_saved_files', {})
+        name, variants = saved.get(self.name, (None, None))
+        saved[self.name] = self._current_files(instance)
+
+        # the replaced upload and its variants go once the new one is committed
+        if name and name != saved[self.name][0]:
+            files = self.stored_files(name, variants)
+            transaction.on_commit(lambda: release_files(sender, self, files))
+        # new uploads, and anything a worker didn't get to
+        if getattr(instance, self.attname) and not self.get_variants(instance):
+            transaction.on_commit(lambda: submit(sender, instance.pk, self.name))
+
+    def _deleting(self, sender, instance, **kwargs):
+        self._refresh_variants(instance)
+
+    def _deleted(self, sender, instance, **kwargs):
+        name, variants = instance.__dict__.get('_saved_files', {}).get(self.name, (None, None))
+        files = self.stored_files(name, variants)
+        if files:
+            transaction.on_commit(lambda: release_files(sender, self, files))
+
+    def get_variants(self, instance):
+        """Variants made from the current file, empty while they are pending"""
+        file = getattr(instance, self.attname)
+        variants = getattr(instance, self.variants_field) or {}
+        if not file or variants.get('source') != file.name:
+            return {}
+        return variants
+
+    def variant_name(self, file, label, extension):
+        # originals are named after their content, so the variants can
+        # share that name and never change once written
+        stem = os.path.splitext(file.name)[0]
+        return f'{stem}_{label}.{extension}'
+
+    def _save_variant(self, name, image, size, format):
+        # names are deterministic, a rerun only renders what is missing
+        if self.storage.exists(name):
+            return name
+        content = encode_image(image, size, self.crop, format, self.quality)
+        return self.storage.save(name, ContentFile(content))
+
+    def render(self, instance, file):
+        """Writes the variants for `file` to storage and returns them"""
+        with file.open('rb') as f:
+            image = Image.open(f)
+            image.load()
+        image = prepare_image(image)
+
+        variants = {
+            'source': file.name,
+            'default': self._save_variant(
+                self.variant_name(file, 'x'.join(map(str, self.size)), 'jpg'), image, self.size, 'JPEG'),
+            'srcset': {},
+        }
+        # no upscaling, but always keep the smallest width
+        widths = [width for width in sorted(self.widths) if width <= image.width] or sorted(self.widths)[:1]
+        for key, format, extension in self.formats:
+            variants['srcset'][key] = {}
+            for width in widths:
+                size = (width, round(width * self.size[1] / self.size[0]))
+                variants['srcset'][key][str(width)] = self._save_variant(
+                    self.variant_name(file, f'{width}w', extension), image, size, format)
+        return variants
+
+
+def variant_files(variants):
+    if variants.get('default'):
+        yield variants['default']
+    for names in variants.get('srcset', {}).values():
+        yield from names.values()
+
+
+def release_files(model, field, names):
+    """Deletes files a record no longer uses, unless another record of the
+    same model has picked them up, as its upload or one of the variants
+    stored with it. Variants are named after their upload, so `names` has
+    to include the upload they were made from.
+    """
+    names = [name for name in names if name]
+    in_use = set()
+    for row in model.objects.filter(**{f'{field.attname}__in': names}) \
+            .values_list(field.attname, field.variants_field):
+        in_use.update(field.stored_files(*row))
+    for name in names:
+        if name not in in_use:
+            field.storage.delete(name)
+
+
+def content_hash_name(directory, file, filename):
+    """upload_to helper naming a file after a hash of its content"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    extension = os.path.splitext(filename)[1].lower()
+    return f'{directory}/{digest.hexdigest()[:20]}{extension}'
+
+
+def prepare_image(image):
+    image = ImageOps.exif_transpose(image)
+    # discard the alpha channel by painting the image on white
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, '#fff')
+        background.paste(image, mask=image.split()[-1])
+        return background
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def encode_image(image, size, crop, format, quality):
+    image = ImageOps.fit(image, tuple(size), Image.LANCZOS,
+                         centering=(CENTRING[crop[1]], CENTRING[crop[0]]))
+    output = BytesIO()
+    image.save(output, format=format, quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def process_image(model, pk, field_name):
+    field = model._meta.get_field(field_name)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return
+    file = getattr(instance, field.attname)
+    if not file or field.get_variants(instance):
+        return
+
+    previous = getattr(instance, field.variants_field) or {}
+    variants = field.render(instance, file)
+    # only record the variants if the image wasn't replaced meanwhile
+    updated = model.objects.filter(pk=pk, **{field.attname: file.name}) \
+        .update(**{field.variants_field: variants})
+    # records with the same upload share its variants
+    if updated:
+        stale = set(variant_files(previous)) - set(variant_files(variants))
+        if stale:
+            release_files(model, field, [previous.get('source'), *stale])
+    else:
+        release_files(model, field, [file.name, *variant_files(variants)])
+    if updated:
+        setattr(instance, field.variants_field, variants)
+        variants_ready.send(sender=model, instance=instance, field=field)
+
+
+def process_logged(model, pk, field_name):
+    close_old_connections()
+    try:
+        process_image(model, pk, field_name)
+    except Exception:
+        logger.exception(f'Processing {model._meta.label} {pk} {field_name} failed')
+    finally:
+        close_old_connections()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'STORE_IMAGE_WORKERS', 2),
+                                           thread_name_prefix='store-images')
+        return _executor
+
+
+def submit(model, pk, field_name):
+    """Queues the variants of one image, or renders them right away when
+    STORE_IMAGE_PROCESSING is 'sync'.
+    """
+    if getattr(settings, 'STORE_IMAGE_PROCESSING', 'thread') == 'sync':
+        process_image(model, pk, field_name)
+    else:
+        get_executor().submit(process_logged, model, pk, field_name)
+
+
+def pending_images():
+    """(model, pk, field name) of every image without current variants"""
+    for model in apps.get_app_config('Store').get_models():
+        for field in model._meta.fields:
+            if not isinstance(field, ProcessedImageField):
+                continue
+            queryset = model.objects.exclude(**{field.attname: ''}) \
+                .exclude(**{field.attname: None}).only('pk', field.attname, field.variants_field)
+            for instance in queryset.iterator():
+                if not field.get_variants(instance):
+                    yield model, instance.pk, field.name
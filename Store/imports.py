@@ -0,0 +1,243 @@
+import csv
+import itertools
+import json
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils.text import slugify
+from rest_framework import serializers
+
+from .catalogue import bump_on_commit
+from .models import *
+from .renderers import orjson
+
+FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+}
+
+
+def not_utf8():
+    return serializers.ValidationError({'non_field_errors': ['The line is not valid UTF-8.']})
+
+
+def decode_lines(lines):
+    """The byte lines of a UTF-8 file as text, None for the lines that
+    aren't UTF-8. A byte order mark at the start is dropped."""
+    for number, line in enumerate(lines, start=1):
+        try:
+            yield line.decode('utf-8-sig' if number == 1 else 'utf-8')
+        except UnicodeDecodeError:
+            yield None
+
+
+def read_records(lines, file_format):
+    """(line number, record) pairs from the byte lines of a CSV file with a
+    header, or of an NDJSON file. Empty CSV cells are left out of the
+    record, lines that aren't JSON come through as they are and fail
+    validation. Lines that aren't UTF-8 come through as a ValidationError."""
+    lines = decode_lines(lines)
+    if file_format == 'csv':
+        undecodable = []
+
+        def text_lines():
+            for number, line in enumerate(lines, start=1):
+                if line is None:
+                    # read as an empty line, which the reader skips
+                    undecodable.append(number)
+                    line = '\n'
+                yield line
+
+        def skipped():
+            while undecodable:
+                yield undecodable.pop(0), not_utf8()
+
+        reader = csv.DictReader(text_lines())
+        for row in reader:
+            yield from skipped()
+            yield reader.line_num, {name: value for name, value in row.items()
+                                    if name is not None and value not in ('', None)}
+        yield from skipped()
+        return
+    loads = orjson.loads if orjson is not None else json.loads
+    for number, line in enumerate(lines, start=1):
+        if line is None:
+            yield number, not_utf8()
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield number, loads(line)
+        except ValueError:
+            yield number, line
+
+
+def reset_sequences(*models):
+    """Moves the id sequences past explicitly assigned primary keys, where
+    the database has them"""
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+
+
+class CategoryImportSerializer(serializers.Serializer):
+    id = serializers.IntegerField(min_value=1, required=False)
+    description = serializers.CharField(max_length=240)
+
+
+class MenuImportSerializer(serializers.Serializer):
+    id = serializers.IntegerField(min_value=1, required=False)
+    name = serializers.CharField(max_length=240)
+    description = serializers.CharField(max_length=240, required=False, allow_blank=True, allow_null=True)
+    # by description, as the exports write it
+    category = serializers.CharField(required=False, allow_null=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    is_special = serializers.BooleanField(required=False, default=False)
+
+
+class Import:
+    """Creates or updates rows from (line number, record) pairs, in a
+    transaction per STORE_IMPORT_BATCH_SIZE records.
+
+    A record with the id of an existing row updates it, any other is
+    created, with its id when it has one. Records that fail validation are
+    skipped and reported by line, the first STORE_IMPORT_MAX_ERRORS of them.
+    Bulk writes send no signals, so the caches and the search index are
+    invalidated once at the end.
+    """
+    serializer_class = None
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or getattr(settings, 'STORE_IMPORT_BATCH_SIZE', 1000)
+        self.max_errors = getattr(settings, 'STORE_IMPORT_MAX_ERRORS', 100)
+        self.result = {'created': 0, 'updated': 0, 'failed': 0, 'errors': []}
+
+    def error(self, line, errors):
+        self.result['failed'] += 1
+        if len(self.result['errors']) < self.max_errors:
+            self.result['errors'].append({'line': line, 'errors': errors})
+
+    def run(self, records):
+        self.prepare()
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, self.batch_size))
+            if not batch:
+                break
+            rows = []
+            for line, record in batch:
+                if isinstance(record, serializers.ValidationError):
+                    self.error(line, record.detail)
+                    continue
+                serializer = self.serializer_class(data=record)
+                if serializer.is_valid():
+                    rows.append((line, serializer.validated_data))
+                else:
+                    self.error(line, serializer.errors)
+            with transaction.atomic():
+                self.write(rows)
+        self.finish()
+        self.result['errors'].sort(key=lambda error: error['line'])
+        return self.result
+
+    def prepare(self):
+        pass
+
+    def write(self, rows):
+        raise NotImplementedError
+
+    def finish(self):
+        menu_index.invalidate()
+
+
+class CategoryImport(Import):
+    """Categories by id, or by their unique description when the record has
+    no id"""
+    serializer_class = CategoryImportSerializer
+
+    def prepare(self):
+        # categories are few, their descriptions are checked in memory
+        self.descriptions = dict(Category.objects.values_list('id', 'description'))
+        self.owners = {description: pk for pk, description in self.descriptions.items()}
+
+    def write(self, rows):
+        created, updated = [], {}
+        for line, data in rows:
+            pk, description = data.get('id'), data['description']
+            if description in self.owners and pk is None:
+                # nothing to change
+                self.result['updated'] += 1
+                continue
+            if description in self.owners and self.owners[description] != pk:
+                self.error(line, {'description': ['category with this description already exists.']})
+                continue
+
+            if pk in self.descriptions:
+                self.owners.pop(self.descriptions[pk], None)
+                updated[pk] = Category(pk=pk, description=description, slug=slugify(description))
+                self.result['updated'] += 1
+            else:
+                created.append(Category(pk=pk, description=description))
+                self.result['created'] += 1
+            if pk is not None:
+                self.descriptions[pk] = description
+            self.owners[description] = pk
+
+        Category.objects.bulk_update(updated.values(), ['description', 'slug'])
+        Category.objects.bulk_create(created)
+        if any(category.pk is not None for category in created):
+            reset_sequences(Category)
+
+    def finish(self):
+        bump_on_commit('category', 'menu')
+        super().finish()
+
+
+class MenuImport(Import):
+    """Menus by id. Categories are given by description and have to exist."""
+    serializer_class = MenuImportSerializer
+    fields = ('name', 'description', 'category_id', 'price', 'is_special')
+
+    def prepare(self):
+        self.categories = dict(Category.objects.values_list('description', 'id'))
+
+    def write(self, rows):
+        menus = []
+        for line, data in rows:
+            category = data.get('category')
+            if category is not None and category not in self.categories:
+                self.error(line, {'category': [f'"{category}" does not exist.']})
+                continue
+            menus.append(Menu(pk=data.get('id'), name=data['name'], description=data.get('description'),
+                              category_id=self.categories.get(category), price=data['price'],
+                              is_special=data['is_special']))
+
+        existing = set(Menu.objects.filter(pk__in=[menu.pk for menu in menus if menu.pk is not None])
+                       .values_list('pk', flat=True))
+        # a later record for the same id wins
+        updated, created, numbered = {}, [], {}
+        for menu in menus:
+            if menu.pk in existing:
+                updated[menu.pk] = menu
+            elif menu.pk is not None:
+                numbered[menu.pk] = menu
+            else:
+                created.append(menu)
+        self.result['updated'] += len(updated)
+        self.result['created'] += len(created) + len(numbered)
+
+        Menu.objects.bulk_update(updated.values(), self.fields)
+        Menu.objects.bulk_create([*numbered.values(), *created])
+        if numbered:
+            reset_sequences(Menu)
+
+    def finish(self):
+        bump_on_commit('menu')
+        super().finish()
+
+
+IMPORTS = {
+    'categories': CategoryImport,
+    'menus': MenuImport,
+}
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import signals
+
+from .catalogue import bump_version, get_version
+from .databases import primary
+
+
+class LookupTable:
+    """In-process copy of a small reference table, looked up by name or id.
+
+    The rows are loaded once and dropped again when a save or delete of a
+    row commits. Other processes notice the change through its version
+    counter in the database or the shared cache (STORE_VERSIONS), which is
+    checked at most every STORE_LOOKUP_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self, model, field_name='name'):
+        self.model = model
+        self.field_name = field_name
+        self.version_name = f'lookup:{model._meta.label_lower}'
+        self._lock = threading.Lock()
+        self._rows = None
+        signals.post_save.connect(self._changed, sender=model, weak=False)
+        signals.post_delete.connect(self._changed, sender=model, weak=False)
+
+    def _changed(self, **kwargs):
+        self.invalidate()
+
+    def invalidate(self):
+        """Drops the rows here and in every other process once the
+        transaction commits, for changes made without save() or delete().
+        Dropped before the commit, a reload could keep rows that are rolled
+        back."""
+        transaction.on_commit(self._invalidate)
+
+    def _invalidate(self):
+        self.clear()
+        bump_version(self.version_name)
+
+    def clear(self):
+        self._rows = None
+
+    def _load(self):
+        rows = self._rows
+        interval = getattr(settings, 'STORE_LOOKUP_CHECK_INTERVAL', 5)
+        if rows is not None and time.monotonic() - rows['checked'] < interval:
+            return rows
+        with self._lock:
+            if rows is not None and rows is self._rows:
+                if get_version(self.version_name) == rows['version']:
+                    rows['checked'] = time.monotonic()
+                    return rows
+            elif self._rows is not None:
+                # another thread reloaded while we waited for the lock
+                return self._rows
+            version = get_version(self.version_name)
+            with primary():
+                instances = list(self.model.objects.all())
+            self._rows = {
+                'version': version,
+                'checked': time.monotonic(),
+                'by_id': {instance.pk: instance for instance in instances},
+                'by_name': {getattr(instance, self.field_name): instance for instance in instances},
+            }
+            return self._rows
+
+    def _lookup(self, index, key):
+        try:
+            return self._load()[index][key]
+        except KeyError:
+            raise self.model.DoesNotExist(
+                f'{self.model._meta.object_name} matching {key!r} does not exist.')
+
+    def get(self, name):
+        return self._lookup('by_name', name)
+
+    def get_by_id(self, pk):
+        return self._lookup('by_id', pk)
+
+    def all(self):
+        return list(self._load()['by_id'].values())
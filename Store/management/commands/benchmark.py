@@ -0,0 +1,52 @@
+import json
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from Store import benchmarks
+
+
+class Command(BaseCommand):
+    help = "measure latency, throughput and queries of the Store API endpoints."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--populate', action='store_true',
+            help="replace the data with a seeded dataset of this size before measuring")
+        parser.add_argument('--menu-items', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=1000000)
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=200, help="requests per endpoint")
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument('--only', action='append', help="scenario to run, repeatable")
+        parser.add_argument('--output', help="write the JSON report to this file")
+        parser.add_argument('--compare', help="earlier JSON report to compare with")
+        parser.add_argument('--force', action='store_true', help="run with DEBUG off too")
+
+    def handle(self, *args, **options):
+        # writes a user and orders, and --populate replaces all the data
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("benchmark writes to the database, run it with DEBUG on or give --force.")
+        if options['populate']:
+            call_command('seed', mode='refresh', menu_items=options['menu_items'], orders=options['orders'],
+                days=options['days'], seed=options['seed'], force=True, stdout=self.stdout)
+        if not benchmarks.locations.all():
+            raise CommandError('No data to measure, run seed first.')
+
+        self.stdout.write('measuring...')
+        report = benchmarks.run_benchmarks(options['requests'], options['concurrency'], options['only'])
+        for name, result in report['results'].items():
+            self.stdout.write(f"{name:<20} p50 {result['p50_ms']:>9.2f}ms  p99 {result['p99_ms']:>9.2f}ms  "
+                              f"{result['throughput_rps']:>8.1f}/s  {result['queries_mean']:>6.2f} queries  "
+                              f"{result['errors']} errors")
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                report['compared_to'] = benchmarks.compare(report, json.load(f))
+            for name, change in report['compared_to'].items():
+                self.stdout.write(f"{name:<20} " + '  '.join(
+                    f'{key} {value:+.1f}%' for key, value in change.items() if value is not None))
+        if options['output']:
+            benchmarks.dump(report, options['output'])
+            self.stdout.write(f"report written to {options['output']}.")
@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import models
+from django.utils import timezone
+
+from Store.images import ProcessedImageField
+
+
+def referenced_files():
+    """Names of every file a record points at, including image variants"""
+    names = set()
+    for model in apps.get_models():
+        for field in model._meta.fields:
+            if not isinstance(field, models.FileField):
+                continue
+            columns = [field.attname]
+            if isinstance(field, ProcessedImageField):
+                columns.append(field.variants_field)
+            rows = model._base_manager.exclude(**{field.attname: ''}) \
+                .exclude(**{field.attname: None}).values_list(*columns)
+            for row in rows.iterator(chunk_size=2000):
+                if isinstance(field, ProcessedImageField):
+                    names.update(field.stored_files(*row))
+                else:
+                    names.add(row[0])
+    return names
+
+
+def walk(storage, directory=''):
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield f'{directory}/{name}' if directory else name
+    for name in directories:
+        yield from walk(storage, f'{directory}/{name}' if directory else name)
+
+
+class Command(BaseCommand):
+    help = "delete media files that no record refers to."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+            help="files to delete before reporting progress")
+        parser.add_argument('--min-age', type=int, default=24,
+            help="hours a file must be untouched for, so uploads in flight are kept")
+        parser.add_argument('--dry-run', action='store_true', help="only list the orphans")
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        referenced = referenced_files()
+        cutoff = timezone.now() - timedelta(hours=options['min_age'])
+
+        batch, deleted = [], 0
+        for name in walk(storage):
+            if name in referenced or storage.get_modified_time(name) > cutoff:
+                continue
+            batch.append(name)
+            if len(batch) >= options['batch_size']:
+                deleted += self.collect(storage, batch, options['dry_run'])
+                batch = []
+        deleted += self.collect(storage, batch, options['dry_run'])
+        self.stdout.write(f"{deleted} orphaned files {'found' if options['dry_run'] else 'deleted'}.")
+
+    def collect(self, storage, batch, dry_run):
+        for name in batch:
+            if dry_run:
+                self.stdout.write(name)
+            else:
+                storage.delete(name)
+        if batch and not dry_run:
+            self.stdout.write(f'deleted {len(batch)} files')
+        return len(batch)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Store.exports import EXPORTS, WRITERS
+from Store.filters import OrderFilter
+from Store.models import Order
+
+
+class Command(BaseCommand):
+    help = "stream categories, menus or orders with their items to CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--format', choices=list(WRITERS), default='csv')
+        parser.add_argument('--output', help="file to write, standard output by default")
+        parser.add_argument('--status', help="orders with these statuses, comma separated names or ids")
+        parser.add_argument('--location', help="orders for these locations, comma separated names or ids")
+        parser.add_argument('--after', help="orders scheduled from this ISO 8601 date and time on")
+        parser.add_argument('--before', help="orders scheduled before this ISO 8601 date and time")
+
+    def handle(self, *args, **options):
+        queryset = None
+        if options['kind'] == 'orders':
+            data = {name: options[option] for name, option in (
+                ('status', 'status'), ('location', 'location'),
+                ('scheduled_for_after', 'after'), ('scheduled_for_before', 'before')) if options[option]}
+            filterset = OrderFilter(data, queryset=Order.objects.all())
+            if not filterset.is_valid():
+                raise CommandError(filterset.errors.as_text())
+            queryset = filterset.qs
+
+        write = WRITERS[options['format']][0]
+        chunks = write(EXPORTS[options['kind']](queryset))
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
+            return
+        with open(options['output'], 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(f"{options['kind']} exported to {options['output']}.")
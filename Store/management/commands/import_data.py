@@ -0,0 +1,29 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Store.imports import IMPORTS, read_records
+
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+class Command(BaseCommand):
+    help = "create and update categories or menus from a CSV or NDJSON export."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(IMPORTS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(set(EXTENSIONS.values())),
+            help="csv or ndjson, from the file's extension by default")
+        parser.add_argument('--batch-size', type=int, help="records per transaction")
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or EXTENSIONS.get(os.path.splitext(options['path'])[1].lower())
+        if file_format is None:
+            raise CommandError("unknown file type, give its --format.")
+        with open(options['path'], 'rb') as lines:
+            result = IMPORTS[options['kind']](options['batch_size']).run(read_records(lines, file_format))
+        for error in result['errors']:
+            self.stderr.write(f"line {error['line']}: {error['errors']}")
+        self.stdout.write(f"{result['created']} created, {result['updated']} updated, "
+                          f"{result['failed']} skipped.")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from Store.images import pending_images, process_image
+
+
+class Command(BaseCommand):
+    help = "render the variants of every picture that doesn't have current ones."
+
+    def handle(self, *args, **options):
+        count = 0
+        for model, pk, field_name in pending_images():
+            self.stdout.write(f'{model._meta.label} {pk}: {field_name}')
+            process_image(model, pk, field_name)
+            count += 1
+        self.stdout.write(f'{count} images processed.')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from Store import rollups
+from Store.models import SalesRollup
+
+
+class Command(BaseCommand):
+    help = "recompute the sales rollups from all orders."
+
+    def handle(self, *args, **options):
+        self.stdout.write('rebuilding sales rollups...')
+        rollups.rebuild()
+        self.stdout.write(f'{SalesRollup.objects.count()} rollup rows.')
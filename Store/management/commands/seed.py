@@ -1,16 +1,24 @@
 # <project>/<app>/management/commands/seed.py
-from django.core.exceptions import ObjectDoesNotExist
-from django.core.management.base import BaseCommand
-from django.db.utils import Error, IntegrityError
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.utils import IntegrityError
 from django.contrib.auth.models import Group, User
+from django.utils import timezone
+import itertools
 import logging
 import random
 
+from Store import rollups
+from Store.catalogue import bump_on_commit
+from Store.imports import reset_sequences
 from Store.models import *
 
 logger = logging.getLogger(__name__)
 
-# python manage.py seed --mode=refresh
+# python manage.py seed --mode=refresh --orders=1000000 --menu-items=10000 --days=365 --seed=1
 
 """ Clear all data and creates addresses """
 MODE_REFRESH = 'refresh'
@@ -18,99 +26,100 @@ MODE_REFRESH = 'refresh'
 """ Clear all data and do not create any object """
 MODE_CLEAR = 'clear'
 
+BATCH_SIZE = 5000
+
+# the tables seed fills, the canteen settings, revoked tokens and cache
+# versions are left alone
+SAMPLE_MODELS = (Category, Menu, OrderStatus, PaymentMethod, Location, Order, OrderItem, OrderSlot, SalesRollup)
+
 class Command(BaseCommand):
     help = "seed database for testing and development."
 
     def add_arguments(self, parser):
         parser.add_argument('--mode', type=str, help="Mode")
+        parser.add_argument('--orders', type=int, default=1000, help="orders in the history")
+        parser.add_argument('--menu-items', type=int, default=23, help="menu items, the first 23 are named")
+        parser.add_argument('--days', type=int, default=30, help="days of order history up to now")
+        parser.add_argument('--seed', type=int, help="random seed, for the same data every run")
+        parser.add_argument('--force', action='store_true', help="run with DEBUG off too")
 
     def handle(self, *args, **options):
+        # every user and order goes, don't let it happen to production by accident
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("seed deletes all users and store data, run it with DEBUG on or give --force.")
         self.stdout.write('seeding data...')
-        run_seed(self, options['mode'])
+        run_seed(self, options['mode'], orders=options['orders'], menu_items=options['menu_items'],
+            days=options['days'], seed=options['seed'])
         self.stdout.write('done.')
 
 
 def clear_data():
-    """Deletes all the table data"""
-    logger.info("Delete Address instances")
+    """Deletes the sample data and users"""
+    logger.info("Truncating store tables")
+    # the store tables are emptied with TRUNCATE (DELETE on sqlite) rather
+    # than by loading every row for the delete signals
+    tables = [model._meta.db_table for model in SAMPLE_MODELS]
+    connection.ops.execute_sql_flush(
+        connection.ops.sql_flush(no_style(), tables, reset_sequences=True))
     User.objects.all().delete()
     Group.objects.all().delete()
-    Order.objects.all().delete()
-    Category.objects.all().delete()
-    Menu.objects.all().delete()
-    PaymentMethod.objects.all().delete()
-    Location.objects.all().delete()
-    OrderStatus.objects.all().delete()
+    reset_caches()
+
+
+def reset_caches():
+    """Bulk inserts and truncation send no signals, so the cached lookups
+    and catalogue are invalidated here
+    """
+    for table in (order_statuses, payment_methods, locations):
+        table.invalidate()
+    bump_on_commit('menu', 'category', 'location')
+    menu_index.invalidate()
 
 
 def create_constant_data():
-    """Creates an address object combining different elements from the list"""
-    
+    """Creates the payment methods, locations and order statuses"""
+
     payment_options = ['Cash', 'Account']
     locations = ['Office', 'New canteen', 'Old canteen']
     order_statuses = ['Completed', 'Cancelled', 'Created', 'Uncollected', 'Ready for collection']
 
-    logger.info("Creating payment options...")
-    for option in payment_options:
-        model = PaymentMethod(name=option)
-        try:
-            model.save()
-            logger.info("{} payment method created.".format(model))
-        except:
-            logger.warning(f"{model} payment method already exists.")
-    logger.info("Finished adding payment options.")
-
-    logger.info("Creating locations...")
-    for location in locations:
-        model = Location(name=location)
-        try:
-            model.save()
-            logger.info("{} location created.".format(model))
-        except:
-            logger.warning(f"{model} location already exists.")
-    logger.info("Finished adding locations.")
-    
-    logger.info("Creating order status'...")
-    for status in order_statuses:
-        model = OrderStatus(name=status)
-        try:
-            model.save()
-            logger.info("{} status created.".format(model))
-        except:
-            logger.warning(f"{model} status already exists.")
-    logger.info("Finished adding locations.")
+    logger.info("Creating payment options, locations and order status'...")
+    PaymentMethod.objects.bulk_create([PaymentMethod(name=name) for name in payment_options])
+    Location.objects.bulk_create([Location(name=name) for name in locations])
+    OrderStatus.objects.bulk_create([OrderStatus(name=name) for name in order_statuses])
+    reset_caches()
 
 
 class CanteenContants:
     def __init__(self):
-        self.location_office = Location.objects.get(name='Office')
-        self.location_new = Location.objects.get(name='New canteen')
-        self.location_old = Location.objects.get(name='Old canteen')
+        self.location_office = locations.get('Office')
+        self.location_new = locations.get('New canteen')
+        self.location_old = locations.get('Old canteen')
 
-        self.payment_account = PaymentMethod.objects.get(name='Account')
-        self.payment_cash = PaymentMethod.objects.get(name='Cash')
+        self.payment_account = payment_methods.get('Account')
+        self.payment_cash = payment_methods.get('Cash')
 
-        self.status_completed = OrderStatus.objects.get(name='Completed')
-        self.status_cancelled = OrderStatus.objects.get(name='Cancelled')
-        self.status_created = OrderStatus.objects.get(name='Created')
-        self.status_uncollected = OrderStatus.objects.get(name='Uncollected')
-        self.status_ready = OrderStatus.objects.get(name='Ready for collection')
+        self.status_completed = order_statuses.get('Completed')
+        self.status_cancelled = order_statuses.get('Cancelled')
+        self.status_created = order_statuses.get('Created')
+        self.status_uncollected = order_statuses.get('Uncollected')
+        self.status_ready = order_statuses.get('Ready for collection')
 
-def category_price_generator(items):
+def category_price_generator(items, rand=random):
     for item in items:
         d = item.category.description
         if d == 'Starters':
-            item.price = random.randint(10, 30)
+            item.price = rand.randint(10, 30)
         elif d == 'Main':
-            item.price = random.randint(25, 60)
+            item.price = rand.randint(25, 60)
         elif d == 'Sweets':
-            item.price = random.randint(5, 20)
+            item.price = rand.randint(5, 20)
         elif d == 'Beverages':
-            item.price = random.randint(5, 20)
+            item.price = rand.randint(5, 20)
         elif d == 'Fruit':
-            item.price = random.randint(2, 10)
+            item.price = rand.randint(2, 10)
 
-def create_sample_data():
+def create_sample_data(menu_items=23, rand=random):
     categories = [
         Category(description='Starters'),
         Category(description='Main'),
@@ -131,40 +140,129 @@ def create_sample_data():
         Menu(category=categories[4], name='Pears', description='Juicy pears that will make your drool.'),
         Menu(category=categories[4], name='Oranges', description='Sweet oranges that are pleasant to eat and squeeze.'),
         Menu(category=categories[4], name='Peaches', description='Oh so sweet.'),
-        
+
         Menu(category=categories[3], name='Valpre water', description='Stiller than quiet...'),
         Menu(category=categories[3], name='Coke', description='Not the white stuff.'),
         Menu(category=categories[3], name='Fanta', description='Is this the real life, or is this just "Fanta-see'),
         Menu(category=categories[3], name='Iron Brew', description='In order to pump those irons, you have got to try this... Mah bru'),
         Menu(category=categories[3], name='Orange juice', description='Squeezed from our own sweet oranges.'),
-        
+
         Menu(category=categories[2], name='Gummy bears', description='Bouncing here and there and everywhere...'),
         Menu(category=categories[2], name='Wine gums', description='Now with 0% alchohol'),
         Menu(category=categories[2], name='Marshmellows', description='How many can you put in your mouth?'),
         Menu(category=categories[2], name='Kit kat', description='Have a break - have a KitKat'),
         Menu(category=categories[2], name="m%m's", description='Back to reality, oh there goes cavities'),
-        
+
         Menu(category=categories[1], name='Fish and chips', description='Hot dish consisting of fried fish in batter, served with chips dressed in vinegar.'),
         Menu(category=categories[1], name='Hamburger', description="Seeded bun with juicy beef patty, onions, tomatoes and our secret burger sauce."),
         Menu(category=categories[1], name='Mayo sandwitch', description='Chichen and mayo sammy'),
         Menu(category=categories[1], name='Bunny chow', description='Half loaf filled with chicken and the hottest curry sauce. Guaranteed to fill that void!'),
         Menu(category=categories[1], name='Hotdog', description='Rol with not one, but TWO weenies and tomato sauce! What generosity!'),
-        
+
         Menu(category=categories[0], name='Garlic bread', description='Guaranteed to keep Count Dracula away...'),
         Menu(category=categories[0], name='Chicken wings', description='Will clear up the sinuses.'),
         Menu(category=categories[0], name='Slap chips', description='Lekker slap chips dressed in vinegar.'),
-    ]
+    ][:menu_items]
+
+    # variations of the named items make up the rest
+    for number in range(len(items), menu_items):
+        category = rand.choice(categories)
+        items.append(Menu(category=category, name=f'{category.description} {number + 1}',
+            description=f'Another one from the {category.description.lower()} counter.'))
+
+    category_price_generator(items, rand)
+
+    logger.info(f"Creating {len(items)} menu items...")
+    # primary keys are assigned here as MySQL doesn't return them from bulk_create
+    for pk, item in enumerate(items, start=1):
+        item.pk = pk
+    Menu.objects.bulk_create(items, batch_size=BATCH_SIZE)
+    reset_sequences(Menu)
+    # the category saves bumped the versions before these menus existed
+    reset_caches()
+    return items
+
+
+# share of the day's orders per hour, the lunch rush peaks at 12:00
+ORDER_HOURS = {7: 4, 8: 6, 9: 4, 10: 6, 11: 18, 12: 30, 13: 18, 14: 6, 15: 5, 16: 3}
+FIRST_NAMES = ['Thabo', 'Lerato', 'Johan', 'Anele', 'Pieter', 'Zanele', 'Sipho', 'Annelie',
+               'Kagiso', 'Naledi', 'Ruan', 'Ayanda', 'Chantel', 'Mpho', 'Riaan', 'Palesa']
+LAST_NAMES = ['Mokoena', 'van der Merwe', 'Dlamini', 'Botha', 'Nkosi', 'Pretorius', 'Khumalo',
+              'Naidoo', 'Smith', 'Mahlangu', 'Venter', 'Zulu']
+
+
+def order_days(orders, days, rand):
+    """Number of orders on each of the `days` days up to yesterday, quiet
+    on weekends"""
+    today = timezone.localdate()
+    dates = [today - timedelta(days=offset) for offset in range(days, 0, -1)]
+    weights = [0.1 if date.weekday() >= 5 else rand.uniform(0.8, 1.2) for date in dates]
+    total = sum(weights)
+    counts = [int(orders * weight / total) for weight in weights]
+    for index in rand.sample(range(days), orders - sum(counts)):
+        counts[index] += 1
+    return zip(dates, counts)
+
+
+def order_times(date, count, rand):
+    hours = rand.choices(list(ORDER_HOURS), weights=list(ORDER_HOURS.values()), k=count)
+    for hour, minute in sorted((hour, rand.randrange(60)) for hour in hours):
+        yield timezone.make_aware(datetime.combine(date, time(hour, minute)))
+
+
+def create_orders(orders, days, rand=random):
+    """Creates an order history with its items, `orders` spread over the
+    last `days` days, in batched bulk inserts
+    """
+    if not orders or not days:
+        return
+    constants = CanteenContants()
+    menus = list(Menu.objects.values_list('pk', 'price'))
+    # a few favourites account for most of the sales
+    popularity = list(itertools.accumulate(1 / (rank + 1) ** 0.8 for rank in range(len(menus))))
+    rand.shuffle(menus)
+    statuses = [constants.status_completed, constants.status_cancelled, constants.status_uncollected]
+    order_locations = [constants.location_office, constants.location_new, constants.location_old]
+    payments = [constants.payment_cash, constants.payment_account]
+
+    def generate():
+        pk = 0
+        for date, count in order_days(orders, days, rand):
+            for scheduled_for in order_times(date, count, rand):
+                pk += 1
+                order = Order(pk=pk, fullname=f'{rand.choice(FIRST_NAMES)} {rand.choice(LAST_NAMES)}',
+                    phone_number=f'08{rand.randrange(10 ** 8):08d}', scheduled_for=scheduled_for,
+                    status=rand.choices(statuses, weights=[85, 7, 8])[0],
+                    location=rand.choices(order_locations, weights=[50, 30, 20])[0],
+                    payment=rand.choices(payments, weights=[60, 40])[0])
+                picked = {menus[index] for index in rand.choices(
+                    range(len(menus)), cum_weights=popularity, k=rand.choices([1, 2, 3, 4], weights=[50, 30, 15, 5])[0])}
+                items = [OrderItem(order_id=pk, menu_id=menu_id, unit_price=price,
+                                   qty=rand.choices([1, 2, 3], weights=[80, 15, 5])[0])
+                         for menu_id, price in picked]
+                order.total = sum(item.qty * item.unit_price for item in items)
+                order.item_count = sum(item.qty for item in items)
+                yield order, items
+
+    generated = generate()
+    created = 0
+    while True:
+        batch = list(itertools.islice(generated, BATCH_SIZE))
+        if not batch:
+            break
+        with transaction.atomic():
+            Order.objects.bulk_create([order for order, _ in batch])
+            OrderItem.objects.bulk_create([item for _, items in batch for item in items], batch_size=BATCH_SIZE)
+        created += len(batch)
+        logger.info(f"{created} of {orders} orders created.")
+    reset_sequences(Order, OrderItem)
+
+    logger.info("Rebuilding sales rollups...")
+    rollups.rebuild()
 
-    category_price_generator(items)
 
-    for item in items:
-        try:
-            item.save()
-        except Error as e:
-            logger.warning(e)
-    
 def create_users():
-    """Creates an address object combining different elements from the list"""
+    """Creates the admin group and users"""
     logger.info("Creating group")
     group = ["Practice Manager"]
 
@@ -185,7 +283,7 @@ def create_users():
             username = 'jethro',
             is_staff = 1,
             is_active = 1,
-            date_joined = datetime.now(),
+            date_joined = timezone.now(),
             password = 'pbkdf2_sha256$216000$FEotATLzY5Qv$XV+l0jS4OHzglPJgHyBRVFDExn/9PcYvQ/j7rnoKo7E='
         ),
         User(
@@ -193,11 +291,11 @@ def create_users():
             username = 'rudolf@a-i-solutions.co.za',
             is_staff = 1,
             is_active = 1,
-            date_joined = datetime.now(),
+            date_joined = timezone.now(),
             password = 'pbkdf2_sha256$216000$SHEx5hzQ603u$Z9WcLNA39aqHXlFDYC0cYmIOFvAg19t86d20jrPwrSE='
         )
     ]
-    
+
     for user in users:
         try:
             user.save()
@@ -211,16 +309,18 @@ def create_users():
     logger.info("{} group created.".format(group))
     return group
 
-def run_seed(self, mode):
+def run_seed(self, mode, orders=1000, menu_items=23, days=30, seed=None):
     """ Seed database based on mode
 
-    :param mode: refresh / clear 
+    :param mode: refresh / clear
     :return:
     """
+    rand = random.Random(seed)
     # Clear data from tables
     clear_data()
     if mode == MODE_CLEAR:
         return
     create_users()
     create_constant_data()
-    create_sample_data()
\ No newline at end of file
+    create_sample_data(menu_items, rand)
+    create_orders(orders, days, rand)
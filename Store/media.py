@@ -0,0 +1,124 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+# uploads and their variants are named after a hash of their content
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{20}(_[^/]*)?\.[a-z0-9]+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def cache_control(path):
+    if HASHED_NAME.search(path):
+        return IMMUTABLE
+    return f"public, max-age={getattr(settings, 'STORE_MEDIA_MAX_AGE', 3600)}"
+
+
+def parse_range(header, size):
+    """(start, end) of a single byte range, None to send the whole file.
+    Raises ValueError when the range can't be satisfied.
+    """
+    match = RANGE.match(header.strip())
+    if match is None:
+        # multiple ranges or another unit, the whole file is a valid answer
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    """Serves MEDIA_ROOT with long lived caching headers, conditional and
+    range requests.
+
+    With STORE_MEDIA_SENDFILE set to 'x-accel-redirect' (nginx) or
+    'x-sendfile' (apache, lighttpd) the bytes are sent by the front-end
+    server, otherwise the file is handed to the wsgi server's file wrapper.
+    """
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except ValueError:
+        raise Http404
+    try:
+        stat = os.stat(fullpath)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+
+    etag = quote_etag(f'{int(stat.st_mtime):x}-{stat.st_size:x}')
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = file_response(request, fullpath, path, stat.st_size, etag)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = cache_control(path)
+    return response
+
+
+def file_response(request, fullpath, path, size, etag):
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+
+    sendfile = getattr(settings, 'STORE_MEDIA_SENDFILE', None)
+    if sendfile == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(settings.STORE_MEDIA_ACCEL_PREFIX + path)
+        return response
+    if sendfile == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = fullpath
+        return response
+
+    byte_range = None
+    # a stale If-Range means the client wants the whole, current file
+    if 'HTTP_RANGE' in request.META and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(fullpath, start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,222 @@
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger('Store.slow_requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760)
+# statements kept per request for the slow request log
+MAX_LOGGED_QUERIES = 50
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Histograms of this process by metric name and labels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def observe(self, name, labels, value, buckets, help=''):
+        with self._lock:
+            metric = self._metrics.setdefault(name, {'help': help, 'buckets': buckets, 'series': {}})
+            series = metric['series'].get(labels)
+            if series is None:
+                series = metric['series'][labels] = Histogram(buckets)
+            series.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def render(self):
+        """Prometheus text exposition of every histogram"""
+        lines = []
+        with self._lock:
+            for name, metric in sorted(self._metrics.items()):
+                lines.append(f'# HELP {name} {metric["help"]}')
+                lines.append(f'# TYPE {name} histogram')
+                for labels, series in sorted(metric['series'].items()):
+                    label_text = ','.join(f'{key}="{escape(value)}"' for key, value in labels)
+                    prefix = f'{label_text},' if label_text else ''
+                    cumulative = 0
+                    for bound, count in zip((*series.buckets, '+Inf'), series.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                    label_text = f'{{{label_text}}}' if label_text else ''
+                    lines.append(f'{name}_sum{label_text} {series.sum}')
+                    lines.append(f'{name}_count{label_text} {series.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+class Sample:
+    """What one sampled request spent its time on"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = []
+        self.timings = {}
+        self._active = set()
+
+    def record_query(self, sql, elapsed):
+        self.queries += 1
+        self.db_time += elapsed
+        if len(self.statements) < MAX_LOGGED_QUERIES:
+            self.statements.append({'sql': sql, 'ms': round(elapsed * 1000, 3)})
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_query(sql, time.perf_counter() - started)
+
+
+current_sample = contextvars.ContextVar('current_sample', default=None)
+
+
+@contextmanager
+def timed(name):
+    """Adds the time spent in the block to the current request's `name`
+    timing. Nested blocks of the same name are counted once.
+    """
+    sample = current_sample.get()
+    if sample is None or name in sample._active:
+        yield
+        return
+    sample._active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample._active.discard(name)
+        sample.timings[name] = sample.timings.get(name, 0) + time.perf_counter() - started
+
+
+def response_size(response):
+    if response.streaming:
+        return int(response['Content-Length']) if response.has_header('Content-Length') else None
+    return len(response.content)
+
+
+class MetricsMiddleware:
+    """Records latency and response size of every request, and for a
+    STORE_METRICS_SAMPLE_RATE share of them the number of queries, the
+    database time and the time spent in serializers.
+
+    Requests slower than STORE_SLOW_REQUEST_SECONDS are logged to the
+    Store.slow_requests logger, with their SQL when they were sampled.
+    The histograms are per process and served by `metrics_view`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'STORE_METRICS_ENABLED', True):
+            return self.get_response(request)
+
+        sample = Sample() if random.random() < getattr(settings, 'STORE_METRICS_SAMPLE_RATE', 1.0) else None
+        token = current_sample.set(sample)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                if sample is not None:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(sample))
+                response = self.get_response(request)
+        finally:
+            current_sample.reset(token)
+        elapsed = time.perf_counter() - started
+
+        try:
+            self.record(request, response, elapsed, sample)
+        except Exception:
+            logger.exception('Recording request metrics failed')
+        return response
+
+    def record(self, request, response, elapsed, sample):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        labels = (('view', view), ('method', request.method), ('status', str(response.status_code)))
+        view_labels = (('view', view), )
+        registry.observe('store_request_duration_seconds', labels, elapsed, LATENCY_BUCKETS,
+                         'Time from the request reaching the middleware to the response.')
+        size = response_size(response)
+        if size is not None:
+            registry.observe('store_response_size_bytes', view_labels, size, SIZE_BUCKETS,
+                             'Size of the response body.')
+        if sample is not None:
+            registry.observe('store_request_db_queries', view_labels, sample.queries, QUERY_BUCKETS,
+                             'Database queries per sampled request.')
+            registry.observe('store_request_db_seconds', view_labels, sample.db_time, LATENCY_BUCKETS,
+                             'Database time per sampled request.')
+            registry.observe('store_request_serializer_seconds', view_labels,
+                             sample.timings.get('serializer', 0), LATENCY_BUCKETS,
+                             'Serializer time per sampled request.')
+
+        if elapsed >= getattr(settings, 'STORE_SLOW_REQUEST_SECONDS', 1.0):
+            record = {
+                'view': view,
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'ms': round(elapsed * 1000, 3),
+                'size': size,
+            }
+            if sample is not None:
+                record.update(queries=sample.queries, db_ms=round(sample.db_time * 1000, 3),
+                              serializer_ms=round(sample.timings.get('serializer', 0) * 1000, 3),
+                              sql=sample.statements)
+            slow_logger.warning(json.dumps(record), extra={'request_metrics': record})
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, for staff users and scrapers that send
+    STORE_METRICS_TOKEN as a bearer token. The client address isn't
+    checked, behind a proxy every request comes from the proxy's."""
+    token = getattr(settings, 'STORE_METRICS_TOKEN', None)
+    authorized = token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
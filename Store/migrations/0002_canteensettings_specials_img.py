@@ -0,0 +1,19 @@
+# Generated by Django 3.1.7 on 2026-10-18 14:04
+
+from django.db import migrations
+import django_resized.forms
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='canteensettings',
+            name='specials_img',
+            field=django_resized.forms.ResizedImageField(blank=True, crop=['bottom', 'center'], force_format=None, keep_meta=True, null=True, quality=100, size=[300, 200], upload_to=''),
+        ),
+    ]
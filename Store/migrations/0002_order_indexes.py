@@ -0,0 +1,25 @@
+# Generated by Django 3.1.7 on 2026-10-18 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Store', '0002_canteensettings_specials_img'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['location', 'status', 'scheduled_for'], name='order_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'scheduled_for'], name='order_status_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['scheduled_for', 'id'], name='order_schedule_idx'),
+        ),
+    ]
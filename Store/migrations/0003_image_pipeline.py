@@ -0,0 +1,45 @@
+# Generated by Django 3.1.7 on 2026-10-18 14:07
+
+import Store.images
+import Store.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Store', '0002_order_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='canteensettings',
+            name='specials_img_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='category_pic_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='menu',
+            name='food_pic_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='canteensettings',
+            name='specials_img',
+            field=Store.images.ProcessedImageField(blank=True, crop=['bottom', 'center'], null=True, quality=85, size=[300, 200], upload_to='specials', variants_field='specials_img_variants'),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='category_pic',
+            field=Store.images.ProcessedImageField(blank=True, crop=['middle', 'center'], null=True, quality=85, size=[300, 200], upload_to=Store.models.category_pic_file_name, variants_field='category_pic_variants'),
+        ),
+        migrations.AlterField(
+            model_name='menu',
+            name='food_pic',
+            field=Store.images.ProcessedImageField(blank=True, crop=['middle', 'center'], null=True, quality=85, size=[300, 200], upload_to=Store.models.food_pic_file_name, variants_field='food_pic_variants'),
+        ),
+    ]
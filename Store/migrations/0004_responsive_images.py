@@ -0,0 +1,30 @@
+# Generated by Django 3.1.7 on 2026-10-18 14:08
+
+import Store.images
+import Store.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Store', '0003_image_pipeline'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='canteensettings',
+            name='specials_img',
+            field=Store.images.ProcessedImageField(blank=True, crop=['bottom', 'center'], null=True, quality=80, size=[300, 200], upload_to=Store.models.specials_img_file_name, variants_field='specials_img_variants', widths=[320, 640, 1280]),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='category_pic',
+            field=Store.images.ProcessedImageField(blank=True, crop=['middle', 'center'], null=True, quality=80, size=[300, 200], upload_to=Store.models.category_pic_file_name, variants_field='category_pic_variants', widths=[320, 640, 1280]),
+        ),
+        migrations.AlterField(
+            model_name='menu',
+            name='food_pic',
+            field=Store.images.ProcessedImageField(blank=True, crop=['middle', 'center'], null=True, quality=80, size=[300, 200], upload_to=Store.models.food_pic_file_name, variants_field='food_pic_variants', widths=[320, 640, 1280]),
+        ),
+    ]
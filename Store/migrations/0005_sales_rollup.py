@@ -0,0 +1,74 @@
+# Generated by Django 3.1.7 on 2026-10-18 14:11
+
+from collections import defaultdict
+from datetime import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def build_rollups(apps, schema_editor):
+    """Counts the existing orders, bucketed as Store.rollups.order_bucket
+    did when this migration was written; later changes to it mustn't change
+    what the migration counts. Items have no price of their own yet, they
+    are counted at the menu price, which 0006 copies onto them."""
+    OrderItem = apps.get_model('Store', 'OrderItem')
+    SalesRollup = apps.get_model('Store', 'SalesRollup')
+    tz = timezone.get_current_timezone()
+    slot_minutes = getattr(settings, 'STORE_ROLLUP_SLOT_MINUTES', 30)
+    deltas = defaultdict(lambda: [0, Decimal(0)])
+    rows = OrderItem.objects.values_list(
+        'order__status_id', 'order__location_id', 'order__scheduled_for',
+        'menu_id', 'menu__category_id', 'qty', 'menu__price')
+    for status_id, location_id, scheduled_for, menu_id, category_id, qty, price in rows.iterator(chunk_size=5000):
+        if scheduled_for is None or not qty:
+            continue
+        if timezone.is_aware(scheduled_for):
+            scheduled_for = timezone.localtime(scheduled_for, tz)
+        minutes = scheduled_for.hour * 60 + scheduled_for.minute
+        minutes -= minutes % slot_minutes
+        delta = deltas[(scheduled_for.date(), time(minutes // 60, minutes % 60), location_id or 0,
+                        status_id or 0, menu_id, category_id or 0)]
+        delta[0] += qty
+        delta[1] += qty * Decimal(price or 0)
+    SalesRollup.objects.bulk_create(
+        [SalesRollup(day=day, slot=slot, location_id=location_id, status_id=status_id,
+                     menu_id=menu_id, category_id=category_id, qty=qty, revenue=revenue)
+         for (day, slot, location_id, status_id, menu_id, category_id), (qty, revenue)
+         in deltas.items() if qty or revenue],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Store', '0004_responsive_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('slot', models.TimeField()),
+                ('location_id', models.IntegerField(default=0)),
+                ('status_id', models.IntegerField(default=0)),
+                ('menu_id', models.IntegerField()),
+                ('category_id', models.IntegerField(default=0)),
+                ('qty', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='salesrollup',
+            index=models.Index(fields=['status_id', 'day'], name='rollup_status_day_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='salesrollup',
+            unique_together={('day', 'slot', 'location_id', 'status_id', 'menu_id', 'category_id')},
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
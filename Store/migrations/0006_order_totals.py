@@ -0,0 +1,51 @@
+# Generated by Django 3.1.7 on 2026-10-18 14:12
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+
+
+def snapshot_prices(apps, schema_editor):
+    """Existing items get the current menu price, and orders their totals"""
+    Menu = apps.get_model('Store', 'Menu')
+    Order = apps.get_model('Store', 'Order')
+    OrderItem = apps.get_model('Store', 'OrderItem')
+
+    OrderItem.objects.filter(unit_price__isnull=True).update(
+        unit_price=Subquery(Menu.objects.filter(pk=OuterRef('menu_id')).values('price')[:1]))
+
+    line_total = ExpressionWrapper(F('qty') * F('unit_price'), output_field=DecimalField())
+    totals = OrderItem.objects.values('order_id').order_by('order_id') \
+        .annotate(total=Sum(line_total), count=Sum('qty'))
+    batch = []
+    for row in totals.iterator():
+        batch.append(Order(pk=row['order_id'], total=row['total'] or 0, item_count=row['count']))
+        if len(batch) == 1000:
+            Order.objects.bulk_update(batch, ['total', 'item_count'])
+            batch = []
+    Order.objects.bulk_update(batch, ['total', 'item_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Store', '0005_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(snapshot_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 3.1.7 on 2026-10-18 14:15
+
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def slot_start(location, when):
+    """Store.slots.slot_start as of this migration, later changes to it
+    mustn't change what the migration books"""
+    if timezone.is_aware(when):
+        when = timezone.localtime(when)
+    opens = location.opens_at or time(0)
+    origin = opens.hour * 60 + opens.minute
+    minutes = when.hour * 60 + when.minute
+    minutes -= (minutes - origin) % location.slot_minutes
+    # early enough, the slot started the day before
+    start = datetime.combine(when.date(), time(0)) + timedelta(minutes=minutes)
+    return timezone.make_aware(start) if settings.USE_TZ else start
+
+
+def book_upcoming_orders(apps, schema_editor):
+    Location = apps.get_model('Store', 'Location')
+    Order = apps.get_model('Store', 'Order')
+    OrderSlot = apps.get_model('Store', 'OrderSlot')
+    locations = Location.objects.in_bulk()
+    counts = Counter()
+    orders = Order.objects.filter(location__isnull=False, scheduled_for__gte=timezone.now()) \
+        .values_list('location_id', 'scheduled_for')
+    for location_id, scheduled_for in orders.iterator():
+        counts[location_id, slot_start(locations[location_id], scheduled_for)] += 1
+    OrderSlot.objects.bulk_create(
+        [OrderSlot(location_id=location_id, starts_at=starts_at, reserved=reserved)
+         for (location_id, starts_at), reserved in counts.items()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Store', '0006_order_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='closes_at',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='opens_at',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='slot_capacity',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='slot_minutes',
+            field=models.PositiveIntegerField(default=15),
+        ),
+        migrations.CreateModel(
+            name='OrderSlot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('starts_at', models.DateTimeField()),
+                ('reserved', models.PositiveIntegerField(default=0)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Store.location')),
+            ],
+            options={
+                'unique_together': {('location', 'starts_at')},
+            },
+        ),
+        migrations.RunPython(book_upcoming_orders, migrations.RunPython.noop),
+    ]
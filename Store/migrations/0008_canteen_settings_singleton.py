@@ -0,0 +1,45 @@
+# Generated by Django 3.1.7 on 2026-10-18 14:26
+
+import datetime
+from django.db import migrations, models
+
+
+def keep_single_row(apps, schema_editor):
+    CanteenSettings = apps.get_model('Store', 'CanteenSettings')
+    rows = CanteenSettings.objects.order_by('pk')
+    first = rows.first()
+    if first is None:
+        return
+    rows.exclude(pk=first.pk).delete()
+    if first.pk != 1:
+        rows.filter(pk=first.pk).update(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Store', '0007_order_slots'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='canteensettings',
+            options={'verbose_name_plural': 'canteen settings'},
+        ),
+        migrations.AddField(
+            model_name='canteensettings',
+            name='closes_at',
+            field=models.TimeField(default=datetime.time(16, 0)),
+        ),
+        migrations.AddField(
+            model_name='canteensettings',
+            name='opens_at',
+            field=models.TimeField(default=datetime.time(7, 0)),
+        ),
+        migrations.AddField(
+            model_name='canteensettings',
+            name='order_cutoff',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(keep_single_row, migrations.RunPython.noop),
+    ]
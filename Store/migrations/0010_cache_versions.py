@@ -0,0 +1,21 @@
+# Generated by Django 3.1.7 on 2026-10-18 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Store', '0009_revoked_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=1)),
+                ('modified', models.FloatField()),
+            ],
+        ),
+    ]
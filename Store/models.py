@@ -1,51 +1,47 @@
-from datetime import datetime
+from datetime import datetime, time as time_of_day
 import os
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
 from django.db.models.deletion import CASCADE, SET_NULL
 from django.db.models.fields import BLANK_CHOICE_DASH
 from django.urls import reverse
 from django.dispatch import receiver
-from django_resized import ResizedImageField
 from django.utils.text import slugify
 from django_extensions.db.fields import AutoSlugField
-from django.core.files.base import ContentFile
-from PIL import Image
-from io import BytesIO
+from .catalogue import bump_on_commit
+from .lookups import LookupTable
+from .events import publish_order_status
+from .images import ProcessedImageField, content_hash_name, variants_ready
+from . import rollups, slots
+from .search import menu_index
 # from rest_framework import serializers
 
 
 def food_pic_file_name(instance, filename):
-    return "/".join(["food_pictures", str(instance.id), filename])
+    return content_hash_name("food_pictures", instance.food_pic, filename)
 
 
 def category_pic_file_name(instance, filename):
-    return "/".join(["category_pictures", str(instance.id), filename])
+    return content_hash_name("category_pictures", instance.category_pic, filename)
+
+
+def specials_img_file_name(instance, filename):
+    return content_hash_name("specials", instance.specials_img, filename)
 
 
 class Category(models.Model):
     description = models.CharField(max_length=240, unique=True)
     slug = AutoSlugField(populate_from='description')
-    category_pic = ResizedImageField(size=[300,200], quality=100, crop=['middle', 'center'],
+    category_pic = ProcessedImageField(size=[300,200], crop=['middle', 'center'],
         upload_to=category_pic_file_name, null=True, blank=True
     )
+    category_pic_variants = models.JSONField(default=dict, blank=True, editable=False)
 
-    def save(self, file_changed=False, *args, **kwargs):
+    def save(self, *args, **kwargs):
         self.slug = slugify(self.description)
-
-        if self.pk is None:
-            saved_image = self.category_pic
-            self.category_pic = None
-            super().save(*args, **kwargs)
-            self.category_pic = saved_image
-            kwargs.pop("force_insert", None)
-
-        dir = f"media/category_pictures/{self.pk}"
-        # Remove all files if image was updated
-        if file_changed and os.path.exists(dir):
-            for file in os.scandir(dir):
-                os.remove(file.path)
-
         super().save(*args, **kwargs)
+        bump_on_commit('category', 'menu')
 
     def __str__(self):
         return self.description
@@ -56,24 +52,14 @@ class Menu(models.Model):
     description = models.TextField(max_length=240, blank=True, null=True)
     category = models.ForeignKey(Category, models.SET_NULL, blank=True, null=True)
     price = models.DecimalField(decimal_places=2, max_digits=10)
-    food_pic = ResizedImageField(size=[300,200], quality=100, crop=['middle', 'center'],
+    food_pic = ProcessedImageField(size=[300,200], crop=['middle', 'center'],
         upload_to=food_pic_file_name, null=True, blank=True)
+    food_pic_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_special = models.BooleanField(default=False)
 
-    def save(self, file_changed=False, *args, **kwargs):
-        if self.pk is None:
-            saved_image = self.food_pic
-            self.food_pic = None
-            super().save(*args, **kwargs)
-            self.food_pic = saved_image
-            kwargs.pop("force_insert", None)
-
-        dir = f"media/food_pictures/{self.pk}"
-        # Remove all files if image was updated
-        if file_changed and os.path.exists(dir):
-            for file in os.scandir(dir):
-                os.remove(file.path)
+    def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
+        bump_on_commit('menu')
 
     def __str__(self):
         return self.name
@@ -95,19 +81,30 @@ class PaymentMethod(models.Model):
 
 class Location(models.Model):
     name = models.CharField(max_length=250, unique=True)
-    
+    # orders are spread over slots of slot_minutes between the opening and
+    # closing time, at most slot_capacity per slot; empty means no limit
+    slot_minutes = models.PositiveIntegerField(default=15)
+    slot_capacity = models.PositiveIntegerField(null=True, blank=True)
+    opens_at = models.TimeField(null=True, blank=True)
+    closes_at = models.TimeField(null=True, blank=True)
+
     def __str__(self):
         return self.name
 
 
+order_statuses = LookupTable(OrderStatus)
+payment_methods = LookupTable(PaymentMethod)
+locations = LookupTable(Location)
+
+
 def default_status():
-    return OrderStatus.objects.get(name="Created")
+    return order_statuses.get("Created")
 
 def default_payment():
-    return PaymentMethod.objects.get(name="Cash")
+    return payment_methods.get("Cash")
 
 def default_location():
-    return Location.objects.get(name="Office")
+    return locations.get("Office")
 
 
 class Order(models.Model):
@@ -118,6 +115,26 @@ class Order(models.Model):
     status = models.ForeignKey(OrderStatus, on_delete=SET_NULL, null=True)
     payment = models.ForeignKey(PaymentMethod, on_delete=SET_NULL, null=True)
     menu_items = models.ManyToManyField(Menu, through='OrderItem')
+    # maintained by the order items, sum of qty * unit_price and of qty
+    total = models.DecimalField(decimal_places=2, max_digits=12, default=0, editable=False)
+    item_count = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # kitchen queues: orders for a location and status in a time window
+            models.Index(fields=['location', 'status', 'scheduled_for'], name='order_queue_idx'),
+            models.Index(fields=['status', 'scheduled_for'], name='order_status_time_idx'),
+            # cursor pagination order
+            models.Index(fields=['scheduled_for', 'id'], name='order_schedule_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # the totals are updated in the database as items change, so an
+        # instance loaded earlier must not write its copy back
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('total', 'item_count')]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f'Order: {self.fullname}, {self.phone_number}'
@@ -127,36 +144,271 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=CASCADE)
     menu = models.ForeignKey(Menu, on_delete=CASCADE)
     qty = models.IntegerField(default=1)
+    # menu price when the item was ordered
+    unit_price = models.DecimalField(decimal_places=2, max_digits=10, null=True, blank=True)
 
     class Meta:
         unique_together = [['order', 'menu']]
 
+    def save(self, *args, **kwargs):
+        if self.unit_price is None:
+            self.unit_price = self.menu.price
+        super().save(*args, **kwargs)
+
+
+class OrderSlot(models.Model):
+    """Number of orders booked into a location's time slot"""
+    location = models.ForeignKey(Location, on_delete=CASCADE)
+    starts_at = models.DateTimeField()
+    reserved = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [['location', 'starts_at']]
+
+
+class SalesRollup(models.Model):
+    """Quantity and revenue per menu item, location, order status and time
+    slot, kept up to date as orders change.
+
+    Ids are plain integers so the history outlives deleted menus, 0 stands
+    for none.
+    """
+    day = models.DateField()
+    slot = models.TimeField()
+    location_id = models.IntegerField(default=0)
+    status_id = models.IntegerField(default=0)
+    menu_id = models.IntegerField()
+    category_id = models.IntegerField(default=0)
+    qty = models.IntegerField(default=0)
+    revenue = models.DecimalField(decimal_places=2, max_digits=14, default=0)
+
+    class Meta:
+        unique_together = [['day', 'slot', 'location_id', 'status_id', 'menu_id', 'category_id']]
+        indexes = [
+            models.Index(fields=['status_id', 'day'], name='rollup_status_day_idx'),
+        ]
+
 
 class CanteenSettings(models.Model):
-    specials_img = ResizedImageField(size=[300,200], quality=100, crop=['bottom', 'center'], 
-        null=True, blank=True)
+    """Site wide settings, a single row read through Settings.app_settings()"""
+    SINGLETON_PK = 1
+
+    # transparent uploads are flattened on white when the variants are made
+    specials_img = ProcessedImageField(size=[300,200], crop=['bottom', 'center'],
+        upload_to=specials_img_file_name, null=True, blank=True)
+    specials_img_variants = models.JSONField(default=dict, blank=True, editable=False)
+    opens_at = models.TimeField(default=time_of_day(7))
+    closes_at = models.TimeField(default=time_of_day(16))
+    # orders for the day are taken until then, empty for no cut-off
+    order_cutoff = models.TimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'canteen settings'
 
     def save(self, *args, **kwargs):
-      if self.specials_img:
-         image = Image.open(self.specials_img).convert('RGB')
-         # for PNG images discarding the alpha channel and fill it with some color
-         if image.mode in ('RGBA', 'LA'):
-            background = Image.new(image.mode[:-1], image.size, '#fff')
-            background.paste(image, image.split()[-1])
-            image = background
-         image_io = BytesIO()
-         image.save(image_io, format='JPEG', quality=100)
+        self.pk = self.SINGLETON_PK
+        super().save(*args, **kwargs)
 
-         # change the image field value to be the newly modified image value
-         self.specials_img.save('specials.jpg', ContentFile(image_io.getvalue()), save=False)
+    @classmethod
+    def load(cls):
+        return cls.objects.get_or_create(pk=cls.SINGLETON_PK)[0]
+
+    def __str__(self):
+        return 'Canteen settings'
 
-      super().save(*args, **kwargs)
 
+canteen_settings = LookupTable(CanteenSettings, field_name='pk')
+
+
+class RevokedToken(models.Model):
+    """A JWT refused before it expires, checked in memory through
+    revoked_tokens. Rows are purged once the token has expired."""
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.jti
+
+
+revoked_tokens = LookupTable(RevokedToken, field_name='jti')
+
+
+class CacheVersion(models.Model):
+    """Change counter of rows kept in memory or in the cache, see
+    Store.catalogue. Only used with STORE_VERSIONS = 'database'."""
+    name = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=1)
+    # time.time() of the last change
+    modified = models.FloatField()
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
 
 
+
+@receiver(models.signals.post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(models.signals.post_delete, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # drops the users cached by Store.authentication, a login only moves last_login
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        bump_on_commit('auth:users')
+
+
+# pictures are removed by their ProcessedImageField once the delete commits
 @receiver(models.signals.post_delete, sender=Menu)
-def auto_delete_file_on_delete(sender, instance, **kwargs):
+def menu_deleted(sender, instance, **kwargs):
+    bump_on_commit('menu')
+
+
+@receiver(variants_ready, sender=CanteenSettings)
+def canteen_settings_images_ready(sender, instance, **kwargs):
+    # the variants are stored with an update, which the lookup doesn't see
+    canteen_settings.invalidate()
+
+
+@receiver(variants_ready, sender=Menu)
+@receiver(variants_ready, sender=Category)
+def catalogue_images_ready(sender, instance, **kwargs):
+    if sender is Category:
+        bump_on_commit('category', 'menu')
+    else:
+        bump_on_commit('menu')
+
+
+@receiver(models.signals.post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    # menus embed their category, and lose it through SET_NULL without a save
+    bump_on_commit('category', 'menu')
+
+
+@receiver(models.signals.post_save, sender=Menu)
+def menu_search_saved(sender, instance, **kwargs):
+    menu_index.menu_saved(instance)
+
+
+@receiver(models.signals.post_delete, sender=Menu)
+def menu_search_deleted(sender, instance, **kwargs):
+    menu_index.menu_deleted(instance.pk)
+
+
+@receiver(models.signals.post_save, sender=Category)
+def category_search_saved(sender, instance, **kwargs):
+    menu_index.category_saved(instance.pk, instance.description)
+
+
+@receiver(models.signals.post_delete, sender=Category)
+def category_search_deleted(sender, instance, **kwargs):
+    menu_index.category_deleted(instance.pk)
+
+
+@receiver(models.signals.post_save, sender=Location)
+@receiver(models.signals.post_delete, sender=Location)
+def location_changed(sender, instance, **kwargs):
+    bump_on_commit('location')
+
+
+@receiver(models.signals.post_init, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    # read from __dict__ so deferred loads don't query for it
+    instance._saved_status_id = instance.__dict__.get('status_id')
+
+
+@receiver(models.signals.post_save, sender=Order)
+def order_status_changed(sender, instance, created, **kwargs):
+    if not created and instance.status_id == instance._saved_status_id:
+        return
+    instance._saved_status_id = instance.status_id
+
+    try:
+        status = order_statuses.get_by_id(instance.status_id).name if instance.status_id else None
+    except OrderStatus.DoesNotExist:
+        status = instance.status.name
+    transaction.on_commit(lambda: publish_order_status(instance, status))
+
+
+def order_rollup_bucket(order):
+    return rollups.order_bucket(order.__dict__.get('status_id'), order.__dict__.get('location_id'),
+        order.__dict__.get('scheduled_for'))
+
+
+@receiver(models.signals.post_init, sender=Order)
+def remember_order_bucket(sender, instance, **kwargs):
+    instance._rollup_bucket = order_rollup_bucket(instance)
+
+
+@receiver(models.signals.post_save, sender=Order)
+def order_bucket_changed(sender, instance, created, **kwargs):
+    bucket = order_rollup_bucket(instance)
+    if not created and bucket != instance._rollup_bucket:
+        rollups.move_order(instance.pk, instance._rollup_bucket, bucket)
+    instance._rollup_bucket = bucket
+
+
+def order_slot(order):
+    location_id, scheduled_for = order.__dict__.get('location_id'), order.__dict__.get('scheduled_for')
+    if location_id is None or scheduled_for is None:
+        return None
+    try:
+        location = locations.get_by_id(location_id)
+    except Location.DoesNotExist:
+        return None
+    return location_id, slots.slot_start(location, scheduled_for)
+
+
+@receiver(models.signals.post_init, sender=Order)
+def remember_order_slot(sender, instance, **kwargs):
+    instance._saved_slot = order_slot(instance)
+
+
+@receiver(models.signals.post_save, sender=Order)
+def order_slot_changed(sender, instance, created, **kwargs):
+    # orders placed through place_orders come with their slot reserved,
+    # anything else is booked in regardless of the capacity
+    saved = instance.__dict__.pop('_reserved_slot', None) if created else instance._saved_slot
+    slot = order_slot(instance)
+    if slot != saved:
+        if saved is not None:
+            slots.release(*saved)
+        if slot is not None:
+            slots.reserve(locations.get_by_id(slot[0]), slot[1], force=True)
+    instance._saved_slot = slot
+
+
+@receiver(models.signals.post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    if instance._saved_slot is not None:
+        slots.release(*instance._saved_slot)
+
+
+@receiver(models.signals.post_init, sender=OrderItem)
+def remember_order_item(sender, instance, **kwargs):
+    instance._saved_item = (instance.__dict__.get('menu_id'), instance.__dict__.get('qty') or 0,
+        instance.__dict__.get('unit_price') or 0)
+
 
-    if instance.food_pic:
-        if os.path.isfile(instance.food_pic.path):
-            os.remove(instance.food_pic.path)
+@receiver(models.signals.post_save, sender=OrderItem)
+@receiver(models.signals.post_delete, sender=OrderItem)
+def order_item_changed(sender, instance, **kwargs):
+    old_menu_id, old_qty, old_price = (None, 0, 0) if kwargs.get('created') else instance._saved_item
+    if kwargs.get('signal') is models.signals.post_delete:
+        new_menu_id, new_qty, new_price = None, 0, 0
+    else:
+        new_menu_id, new_qty, new_price = instance.menu_id, instance.qty, instance.unit_price or 0
+    instance._saved_item = (new_menu_id, new_qty, new_price)
+    if (old_menu_id, old_qty, old_price) == (new_menu_id, new_qty, new_price):
+        return
+
+    Order.objects.filter(pk=instance.order_id).update(
+        total=F('total') + new_qty * new_price - old_qty * old_price,
+        item_count=F('item_count') + new_qty - old_qty)
+
+    bucket = order_rollup_bucket(Order.objects.only('status', 'location', 'scheduled_for')
+        .get(pk=instance.order_id))
+    categories = dict(Menu.objects.filter(pk__in={old_menu_id, new_menu_id} - {None})
+        .values_list('pk', 'category_id'))
+    deltas = rollups.RollupDeltas()
+    if old_menu_id in categories:
+        deltas.add(bucket, old_menu_id, categories[old_menu_id], old_qty, old_price, sign=-1)
+    if new_menu_id in categories:
+        deltas.add(bucket, new_menu_id, categories[new_menu_id], new_qty, new_price)
+    deltas.apply()
@@ -0,0 +1,89 @@
+from django.db import transaction
+from rest_framework import serializers
+
+from .models import *
+from .rollups import RollupDeltas, order_bucket
+from .slots import take_slot
+
+
+def resolve_references(orders):
+    """Looks up every menu, location and payment method the orders refer to,
+    menus with a single query and the rest from the lookup tables, and
+    returns the lookups with per order errors.
+    """
+    menu_ids = {item['menu'] for order in orders for item in order['items']}
+    menus = Menu.objects.in_bulk(menu_ids)
+    order_locations = {location.pk: location for location in locations.all()}
+    order_payments = {payment.name: payment for payment in payment_methods.all()}
+
+    errors = []
+    for order in orders:
+        error = {}
+        missing = sorted({item['menu'] for item in order['items']} - menus.keys())
+        if missing:
+            error['items'] = [f'Menu item {pk} does not exist.' for pk in missing]
+        if 'location' in order and order['location'] not in order_locations:
+            error['location'] = [f'Location {order["location"]} does not exist.']
+        if 'payment' in order and order['payment'] not in order_payments:
+            error['payment'] = [f'Payment method "{order["payment"]}" does not exist.']
+        errors.append(error)
+    return menus, order_locations, order_payments, errors
+
+
+def place_orders(orders):
+    """Creates orders with their line items in a single transaction.
+
+    Orders are validated up front and each one takes a place in its
+    location's time slot, so either all of them are created or a
+    ValidationError listing the problems per order is raised.
+    """
+    menus, order_locations, order_payments, errors = resolve_references(orders)
+    if any(errors):
+        raise serializers.ValidationError(errors)
+
+    status = default_status()
+    payment = default_payment() if any('payment' not in order for order in orders) else None
+    location = default_location() if any('location' not in order for order in orders) else None
+
+    created = []
+    with transaction.atomic():
+        items = []
+        for index, data in enumerate(orders):
+            order = Order(fullname=data['fullname'], phone_number=data['phone_number'],
+                scheduled_for=data['scheduled_for'], status=status,
+                location=order_locations[data['location']] if 'location' in data else location,
+                payment=order_payments[data['payment']] if 'payment' in data else payment)
+            quantities = {}
+            for item in data['items']:
+                quantities[item['menu']] = quantities.get(item['menu'], 0) + item['qty']
+            order_items = [OrderItem(order=order, menu=menus[pk], qty=qty, unit_price=menus[pk].price)
+                for pk, qty in quantities.items()]
+            order.total = sum(item.qty * item.unit_price for item in order_items)
+            order.item_count = sum(item.qty for item in order_items)
+            if order.location is not None:
+                error = take_slot(order, order.location)
+                if error:
+                    errors[index]['scheduled_for'] = [error]
+                    continue
+
+            # the primary key is needed for the items, and MySQL doesn't
+            # return it from bulk_create
+            order.save()
+            created.append(order)
+            for item in order_items:
+                item.order = order
+            items += order_items
+
+        # raising rolls back the orders and slots taken so far
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        # bulk_create sends no signals, so the rollups are updated here
+        OrderItem.objects.bulk_create(items)
+        deltas = RollupDeltas()
+        for item in items:
+            order = item.order
+            deltas.add(order_bucket(order.status_id, order.location_id, order.scheduled_for),
+                item.menu_id, item.menu.category_id, item.qty, item.unit_price)
+        deltas.apply()
+    return created
@@ -0,0 +1,100 @@
+from base64 import b64decode, b64encode
+from collections import namedtuple
+from urllib import parse
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+Position = namedtuple('Position', ['reverse', 'scheduled_for', 'id'])
+
+
+class OrderCursorPagination(CursorPagination):
+    """Keyset pagination on (scheduled_for, id). The cursor holds both values
+    of the row it continues from, so each page is a range scan of
+    order_schedule_idx however many orders share a scheduled_for.
+
+    DRF's CursorPagination only keys on the first ordering field and falls
+    back to offsets on ties, this replaces its cursor handling and keeps its
+    page size and link building.
+    """
+    ordering = ('scheduled_for', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+
+        if reverse:
+            queryset = queryset.order_by('-scheduled_for', '-id')
+        else:
+            queryset = queryset.order_by('scheduled_for', 'id')
+        if self.cursor is not None:
+            after = 'lt' if reverse else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'scheduled_for__{after}': self.cursor.scheduled_for})
+                | Q(scheduled_for=self.cursor.scheduled_for, **{f'id__{after}': self.cursor.id}))
+
+        # one extra row tells whether there is another page in this direction
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # paged back past the first order or forward past the last
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.position(self.page[-1], reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.position(self.page[0], reverse=True))
+
+    @staticmethod
+    def position(row, reverse):
+        if isinstance(row, dict):
+            return Position(reverse, row['scheduled_for'], row['id'])
+        return Position(reverse, row.scheduled_for, row.id)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            tokens = parse.parse_qs(b64decode(encoded.encode('ascii')).decode('ascii'))
+            scheduled_for = parse_datetime(tokens['p'][0])
+            if scheduled_for is None:
+                raise ValueError
+            return Position(bool(int(tokens.get('r', ['0'])[0])), scheduled_for, int(tokens['i'][0]))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        tokens = {'p': position.scheduled_for.isoformat(), 'i': str(position.id)}
+        if position.reverse:
+            tokens['r'] = '1'
+        encoded = b64encode(parse.urlencode(tokens).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
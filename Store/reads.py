@@ -0,0 +1,141 @@
+import re
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http.cookie import parse_cookie
+
+from .authentication import TTLCache
+from .catalogue import cached_stamp, fresh_stamp
+from .metrics import LATENCY_BUCKETS, registry
+
+# (path, view name, change counter the response follows), without a counter
+# responses are kept for STORE_ORDER_STATUS_TTL seconds
+READ_PATHS = (
+    (re.compile(r'^/api/v1/menus/$'), 'menu-list', 'menu'),
+    (re.compile(r'^/api/v1/menus/\d+/$'), 'menu-detail', 'menu'),
+    (re.compile(r'^/api/v1/categories/$'), 'category-list', 'category'),
+    (re.compile(r'^/api/v1/categories/\d+/$'), 'category-detail', 'category'),
+    (re.compile(r'^/api/v1/locations/$'), 'location-list', 'location'),
+    (re.compile(r'^/api/v1/locations/\d+/$'), 'location-detail', 'location'),
+    (re.compile(r'^/api/v1/orders/\d+/status/$'), 'order-status', None),
+)
+JSON_ACCEPTS = {b'', b'*/*', b'application/json'}
+# set per response, the rest is replayed as django sent it. Django keeps
+# the case of header names, so they're compared lowercased
+NOT_MODIFIED_DROPS = {b'content-type', b'content-length'}
+
+responses = TTLCache(size_setting='STORE_READ_CACHE_SIZE', ttl_setting='STORE_READ_CACHE_TTL')
+
+
+def match_read(scope):
+    """(view name, version name) of a read the fast path may answer"""
+    if scope['type'] != 'http' or scope['method'] != 'GET' or scope.get('query_string'):
+        return None
+    for pattern, view, version_name in READ_PATHS:
+        if pattern.match(scope['path']):
+            return view, version_name
+    return None
+
+
+def read_key(scope, headers):
+    """Everything the response depends on besides the path, or None when
+    the request has to go through django. Credentials can turn a public
+    read into a 401, so they always do."""
+    if b'authorization' in headers or headers.get(b'accept', b'') not in JSON_ACCEPTS:
+        return None
+    if b'if-modified-since' in headers:
+        return None
+    cookie = headers.get(b'cookie')
+    if cookie and settings.SESSION_COOKIE_NAME in parse_cookie(cookie.decode('latin-1')):
+        return None
+    return (scope['path'], scope.get('scheme', 'http'), headers.get(b'host'), headers.get(b'origin'),
+            headers.get(b'accept'))
+
+
+def record(view, status, started):
+    if getattr(settings, 'STORE_METRICS_ENABLED', True):
+        labels = (('view', view), ('method', 'GET'), ('status', str(status)))
+        registry.observe('store_request_duration_seconds', labels, time.perf_counter() - started,
+                         LATENCY_BUCKETS, 'Time from the request reaching the middleware to the response.')
+
+
+async def read_stamp(name):
+    """cached_stamp() for the event loop. Checking the stamp again blocks on
+    the database or the cache, so that runs in django's sync thread like a
+    view would."""
+    stamp = fresh_stamp(name)
+    if stamp is None:
+        stamp = await sync_to_async(cached_stamp)(name)
+    return stamp
+
+
+async def replay(send, entry, headers):
+    status, response_headers, body = entry
+    etag = next((value for name, value in response_headers if name.lower() == b'etag'), None)
+    if etag is not None and headers.get(b'if-none-match') == etag:
+        status, body = 304, b''
+        response_headers = [(name, value) for name, value in response_headers
+                            if name.lower() not in NOT_MODIFIED_DROPS]
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body})
+    return status
+
+
+async def forward(application, scope, receive, send, store):
+    """Runs the request through django and keeps a copy of a cacheable
+    response"""
+    start, body = None, []
+
+    async def capture(message):
+        nonlocal start
+        if message['type'] == 'http.response.start':
+            start = message
+        elif message['type'] == 'http.response.body':
+            body.append(message.get('body', b''))
+            if not message.get('more_body') and start['status'] == 200 \
+                    and not any(name.lower() == b'set-cookie' for name, _ in start['headers']):
+                store((200, list(start['headers']), b''.join(body)))
+        await send(message)
+
+    await application(scope, receive, capture)
+
+
+def read_application(application):
+    """Answers the public reads of menus, categories, locations and order
+    status on the event loop, from responses django made earlier.
+
+    This is a response cache in front of django's handler rather than async
+    views: DRF views and django 3.1's ORM are sync only, so a miss still
+    goes through the view in django's thread, and only a hit stays on the
+    event loop.
+
+    Catalogue responses are kept until their model's change counter moves,
+    which this process sees at once and other processes' within
+    STORE_LOOKUP_CHECK_INTERVAL seconds, order statuses for
+    STORE_ORDER_STATUS_TTL seconds. A miss, a request
+    with credentials or a query string goes through django like any other,
+    the WSGI application doesn't use any of this.
+    """
+    async def app(scope, receive, send):
+        read = match_read(scope)
+        headers = dict(scope['headers']) if read else None
+        key = read_key(scope, headers) if read else None
+        if key is None:
+            return await application(scope, receive, send)
+
+        started = time.perf_counter()
+        view, version_name = read
+        stamp = await read_stamp(version_name) if version_name else None
+        cached = responses.get(key)
+        if cached is not None and cached[0] == stamp:
+            record(view, await replay(send, cached[1], headers), started)
+            return
+
+        if version_name:
+            store = lambda entry: responses.set(key, (stamp, entry))
+        else:
+            ttl = getattr(settings, 'STORE_ORDER_STATUS_TTL', 2)
+            store = lambda entry: responses.set(key, (stamp, entry), ttl=ttl)
+        await forward(application, scope, receive, send, store)
+    return app
@@ -0,0 +1,34 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# DRF escapes the line and paragraph separators so the output is valid
+# javascript as well
+SEPARATORS = (('\u2028'.encode(), b'\\u2028'), ('\u2029'.encode(), b'\\u2029'))
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with orjson when it is installed.
+
+    The output is the same as JSONRenderer's for str, int, bool, None,
+    list and dict data, which is what the values serializers produce.
+    Anything else (decimals, dates, lazy strings) and indented output go
+    through JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            # orjson writes dates and dataclasses its own way, those go
+            # through DRF's encoder
+            ret = orjson.dumps(data, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        for separator, escaped in SEPARATORS:
+            if separator in ret:
+                ret = ret.replace(separator, escaped)
+        return ret
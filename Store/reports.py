@@ -0,0 +1,74 @@
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Sum
+from rest_framework import serializers
+
+from .models import *
+
+GROUPINGS = {
+    'menu': ('menu_id', ),
+    'category': ('category_id', ),
+    'location': ('location_id', ),
+    'status': ('status_id', ),
+    'day': ('day', ),
+    'slot': ('slot', ),
+}
+
+
+class SalesReportQuerySerializer(serializers.Serializer):
+    group_by = serializers.MultipleChoiceField(choices=list(GROUPINGS), required=False)
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    status = serializers.CharField(required=False)
+    location = serializers.CharField(required=False)
+
+    def validate(self, data):
+        for name, table in (('status', order_statuses), ('location', locations)):
+            if name not in data:
+                continue
+            ids = []
+            for key in data[name].split(','):
+                try:
+                    ids.append(int(key) if key.isdigit() else table.get(key).pk)
+                except table.model.DoesNotExist:
+                    raise serializers.ValidationError({name: f'"{key}" does not exist.'})
+            data[name] = ids
+        return data
+
+
+def sales_report(group_by=('menu', ), start=None, end=None, status=None, location=None):
+    """Quantity and revenue summed over the rollup rows, grouped by any of
+    menu, category, location, status, day and slot.
+    """
+    group_by = group_by or ('menu', )
+    rows = SalesRollup.objects.all()
+    if start:
+        rows = rows.filter(day__gte=start)
+    if end:
+        rows = rows.filter(day__lte=end)
+    if status:
+        rows = rows.filter(status_id__in=status)
+    if location:
+        rows = rows.filter(location_id__in=location)
+
+    columns = [column for name in GROUPINGS if name in group_by for column in GROUPINGS[name]]
+    rows = rows.values(*columns).annotate(qty=Sum('qty'), revenue=Sum('revenue')).order_by(*columns)
+    rows = list(rows)
+
+    # names come from the lookup tables, menus and categories in one query each
+    menus = Menu.objects.in_bulk({row['menu_id'] for row in rows if 'menu_id' in row})
+    categories = Category.objects.in_bulk({row['category_id'] for row in rows if 'category_id' in row})
+    names = {
+        'menu_id': ('menu', lambda pk: menus[pk].name),
+        'category_id': ('category', lambda pk: categories[pk].description),
+        'location_id': ('location', lambda pk: locations.get_by_id(pk).name),
+        'status_id': ('status', lambda pk: order_statuses.get_by_id(pk).name),
+    }
+    for row in rows:
+        row['revenue'] = f"{row['revenue']:.2f}"
+        for column, (name, lookup) in names.items():
+            if column in row:
+                try:
+                    row[name] = lookup(row[column])
+                except (KeyError, ObjectDoesNotExist):
+                    row[name] = None
+    return rows
@@ -0,0 +1,101 @@
+from collections import defaultdict
+from datetime import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+def slot_minutes():
+    return getattr(settings, 'STORE_ROLLUP_SLOT_MINUTES', 30)
+
+
+def order_bucket(status_id, location_id, scheduled_for, tz=None, slot=None):
+    """(day, slot, location id, status id) an order's items are counted in"""
+    if scheduled_for is None:
+        return None
+    if timezone.is_aware(scheduled_for):
+        scheduled_for = timezone.localtime(scheduled_for, tz)
+    minutes = scheduled_for.hour * 60 + scheduled_for.minute
+    minutes -= minutes % (slot or slot_minutes())
+    return (scheduled_for.date(), time(minutes // 60, minutes % 60), location_id or 0, status_id or 0)
+
+
+class RollupDeltas:
+    """Quantity and revenue changes per rollup row, applied in one go"""
+
+    def __init__(self):
+        self.deltas = defaultdict(lambda: [0, Decimal(0)])
+
+    def add(self, bucket, menu_id, category_id, qty, price, sign=1):
+        if bucket is None or not qty:
+            return
+        delta = self.deltas[(*bucket, menu_id, category_id or 0)]
+        delta[0] += sign * qty
+        delta[1] += sign * qty * Decimal(price or 0)
+
+    def apply(self):
+        from .models import SalesRollup
+
+        for key, (qty, revenue) in self.deltas.items():
+            if not qty and not revenue:
+                continue
+            day, slot, location_id, status_id, menu_id, category_id = key
+            row = dict(day=day, slot=slot, location_id=location_id, status_id=status_id,
+                       menu_id=menu_id, category_id=category_id)
+            # update in place, and only create the row when it isn't there
+            # yet; a concurrent insert of the same row falls back to updating
+            for attempt in range(2):
+                updated = SalesRollup.objects.filter(**row) \
+                    .update(qty=F('qty') + qty, revenue=F('revenue') + revenue)
+                if updated:
+                    break
+                try:
+                    with transaction.atomic():
+                        SalesRollup.objects.create(qty=qty, revenue=revenue, **row)
+                    break
+                except IntegrityError:
+                    continue
+        self.deltas.clear()
+
+
+def order_items(order_id):
+    from .models import OrderItem
+
+    return OrderItem.objects.filter(order_id=order_id) \
+        .values_list('menu_id', 'menu__category_id', 'qty', 'unit_price')
+
+
+def move_order(order_id, old_bucket, new_bucket):
+    """Moves an order's items to the bucket it now belongs to"""
+    deltas = RollupDeltas()
+    for menu_id, category_id, qty, price in order_items(order_id):
+        deltas.add(old_bucket, menu_id, category_id, qty, price, sign=-1)
+        deltas.add(new_bucket, menu_id, category_id, qty, price)
+    deltas.apply()
+
+
+def rebuild():
+    """Recomputes every rollup row from the orders"""
+    from .models import OrderItem, SalesRollup
+
+    deltas = RollupDeltas()
+    # looked up once rather than for every row
+    tz, slot = timezone.get_current_timezone(), slot_minutes()
+    rows = OrderItem.objects.values_list(
+        'order__status_id', 'order__location_id', 'order__scheduled_for',
+        'menu_id', 'menu__category_id', 'qty', 'unit_price')
+    for status_id, location_id, scheduled_for, menu_id, category_id, qty, price in rows.iterator(chunk_size=5000):
+        deltas.add(order_bucket(status_id, location_id, scheduled_for, tz, slot),
+                   menu_id, category_id, qty, price)
+
+    with transaction.atomic():
+        SalesRollup.objects.all().delete()
+        SalesRollup.objects.bulk_create(
+            [SalesRollup(day=day, slot=slot, location_id=location_id, status_id=status_id,
+                         menu_id=menu_id, category_id=category_id, qty=qty, revenue=revenue)
+             for (day, slot, location_id, status_id, menu_id, category_id), (qty, revenue)
+             in deltas.deltas.items() if qty or revenue],
+            batch_size=1000)
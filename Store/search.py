@@ -0,0 +1,270 @@
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from .catalogue import bump_version, get_version
+from .databases import primary
+
+WORD = re.compile(r'\w+')
+# a word found in the menu's name counts more than one in its category or description
+FIELD_WEIGHTS = {'name': 3.0, 'category': 2.0, 'description': 1.0}
+EXACT, PREFIX, FUZZY = 1.0, 0.8, 0.5
+MIN_SIMILARITY = 0.3
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+def tokenize(text):
+    return WORD.findall(normalize(text))
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MenuIndex:
+    """In-process inverted index over the menu's names, descriptions and
+    category descriptions, for search and typeahead without LIKE scans.
+
+    Query words match indexed words exactly or as a prefix. Words that match
+    nothing that way are matched by trigram similarity, so typos still find
+    something. Every query word has to match, specials rank higher.
+
+    Saves and deletes in this process update the index in place, other
+    processes rebuild theirs when the 'search' version moves, checked at most
+    every STORE_LOOKUP_CHECK_INTERVAL seconds.
+    """
+    version_name = 'search'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._version = None
+        self._checked = 0
+
+    def _reset(self):
+        self.menus = {}
+        self.categories = {}
+        self.postings = {}
+        self.words = []
+        self.trigrams = {}
+        self.ranked = {}
+
+    def _load(self):
+        interval = getattr(settings, 'STORE_LOOKUP_CHECK_INTERVAL', 5)
+        if self._loaded and time.monotonic() - self._checked < interval:
+            return
+        version = get_version(self.version_name)
+        with self._lock:
+            if not self._loaded or version != self._version:
+                self._rebuild(version)
+            self._checked = time.monotonic()
+
+    def _rebuild(self, version):
+        from .models import Category, Menu
+
+        self._reset()
+        with primary():
+            self.categories = dict(Category.objects.values_list('id', 'description'))
+            for menu in Menu.objects.values('id', 'name', 'description', 'category_id', 'is_special'):
+                self._add(menu)
+        self._version = version
+        self._loaded = True
+
+    def invalidate(self):
+        """Rebuilds the index here and in every other process once the
+        transaction commits"""
+        transaction.on_commit(self._invalidate)
+
+    def _invalidate(self):
+        self.clear()
+        bump_version(self.version_name)
+
+    def clear(self):
+        """Drops the index in this process only"""
+        with self._lock:
+            self._loaded = False
+
+    def _changed(self, change):
+        """Applies a change in place once the transaction commits, when this
+        index is current, else leaves it to the next rebuild. Applied any
+        earlier, searches would find rows that may still be rolled back."""
+        transaction.on_commit(lambda: self._apply(change))
+
+    def _apply(self, change):
+        with self._lock:
+            current = self._loaded and get_version(self.version_name) == self._version
+            if current:
+                change()
+            version = bump_version(self.version_name)
+            if current and version == self._version + 1:
+                self._version = version
+            else:
+                self._loaded = False
+
+    # indexing
+
+    def _add(self, menu):
+        fields = {
+            'name': menu['name'],
+            'description': menu['description'],
+            'category': self.categories.get(menu['category_id']),
+        }
+        words = {}
+        for field, text in fields.items():
+            for word in tokenize(text):
+                words[word] = max(words.get(word, 0), FIELD_WEIGHTS[field])
+        self.menus[menu['id']] = dict(menu, words=words, category=fields['category'])
+        for word, weight in words.items():
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = {}
+                bisect.insort(self.words, word)
+                for trigram in trigrams(word):
+                    self.trigrams.setdefault(trigram, set()).add(word)
+            postings[menu['id']] = weight
+            self.ranked.pop(word, None)
+
+    def _remove(self, menu_id):
+        menu = self.menus.pop(menu_id, None)
+        if menu is None:
+            return
+        for word in menu['words']:
+            postings = self.postings[word]
+            postings.pop(menu_id, None)
+            self.ranked.pop(word, None)
+            if postings:
+                continue
+            del self.postings[word]
+            del self.words[bisect.bisect_left(self.words, word)]
+            for trigram in trigrams(word):
+                self.trigrams[trigram].discard(word)
+                if not self.trigrams[trigram]:
+                    del self.trigrams[trigram]
+
+    def menu_saved(self, menu):
+        def change():
+            self._remove(menu.pk)
+            self._add({'id': menu.pk, 'name': menu.name, 'description': menu.description,
+                       'category_id': menu.category_id, 'is_special': menu.is_special})
+        self._changed(change)
+
+    def menu_deleted(self, menu_id):
+        self._changed(lambda: self._remove(menu_id))
+
+    def category_saved(self, category_id, description):
+        def change():
+            self.categories[category_id] = description
+            for menu in [menu for menu in self.menus.values() if menu['category_id'] == category_id]:
+                self._remove(menu['id'])
+                self._add(menu)
+        self._changed(change)
+
+    def category_deleted(self, category_id):
+        def change():
+            # its menus lose their category through SET_NULL
+            self.categories.pop(category_id, None)
+            for menu in [menu for menu in self.menus.values() if menu['category_id'] == category_id]:
+                self._remove(menu['id'])
+                self._add(dict(menu, category_id=None))
+        self._changed(change)
+
+    # querying
+
+    def _matches(self, term):
+        """Indexed word -> how well it matches a query word"""
+        matches = {}
+        start = bisect.bisect_left(self.words, term)
+        for word in self.words[start:]:
+            if not word.startswith(term):
+                break
+            matches[word] = EXACT if word == term else PREFIX
+        if matches or len(term) < 3:
+            return matches
+
+        term_trigrams = trigrams(term)
+        common = Counter()
+        for trigram in term_trigrams:
+            common.update(self.trigrams.get(trigram, ()))
+        for word, shared in common.items():
+            similarity = shared / (len(term_trigrams) + len(word) + 1 - shared)
+            if similarity >= MIN_SIMILARITY:
+                matches[word] = FUZZY * similarity
+        return matches
+
+    def _ranked(self, word, boost):
+        """The menus containing a word, best first"""
+        ranked = self.ranked.get(word)
+        if ranked is None or ranked[0] != boost:
+            menus = self.menus
+            ranked = self.ranked[word] = (boost, sorted(
+                (-weight * (boost if menus[menu_id]['is_special'] else 1), menus[menu_id]['name'], menu_id)
+                for menu_id, weight in self.postings[word].items()))
+        return ranked[1]
+
+    def _top(self, matches, boost, limit):
+        """Best menus for a single query word. The ranked lists of the
+        matching words are merged until there are enough menus, so a short
+        prefix matching thousands of menus costs no more than a long one."""
+        def scaled(ranked, quality):
+            for score, name, menu_id in ranked:
+                yield score * quality, name, menu_id
+
+        results, seen = [], set()
+        for score, name, menu_id in heapq.merge(*(scaled(self._ranked(word, boost), quality)
+                                                  for word, quality in matches.items())):
+            if menu_id not in seen:
+                seen.add(menu_id)
+                results.append((-score, self.menus[menu_id]))
+                if len(results) == limit:
+                    break
+        return results
+
+    def search(self, query, limit=10):
+        """The best matching menus as (score, menu) pairs"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        self._load()
+        boost = getattr(settings, 'STORE_SEARCH_SPECIAL_BOOST', 1.5)
+        with self._lock:
+            matches = [self._matches(term) for term in terms]
+            if not all(matches):
+                return []
+            if len(matches) == 1:
+                return self._top(matches[0], boost, limit)
+
+            # score the menus of the most selective word, then look the other
+            # words up in each of those menus
+            matches.sort(key=lambda words: sum(len(self.postings[word]) for word in words))
+            scores = {}
+            for word, quality in matches[0].items():
+                for menu_id, weight in self.postings[word].items():
+                    scores[menu_id] = max(scores.get(menu_id, 0), quality * weight)
+            ranked = []
+            for menu_id, score in scores.items():
+                menu = self.menus[menu_id]
+                for words in matches[1:]:
+                    best = max((quality * menu['words'][word] for word, quality in words.items()
+                                if word in menu['words']), default=0)
+                    if not best:
+                        break
+                    score += best
+                else:
+                    ranked.append((score * (boost if menu['is_special'] else 1), menu))
+        ranked.sort(key=lambda item: (-item[0], item[1]['name']))
+        return ranked[:limit]
+
+
+menu_index = MenuIndex()
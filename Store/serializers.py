@@ -1,26 +1,159 @@
 from rest_framework import serializers
 from .models import *
+from .metrics import timed
+
+
+class DynamicFieldsMixin:
+    """Limits the output to the comma separated `fields` query parameter"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested = requested_fields(request)
+        if requested is not None:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+
+class TimedSerializerMixin:
+    """Counts the time spent turning instances into data towards the
+    request's serializer metrics"""
+
+    def to_representation(self, instance):
+        with timed('serializer'):
+            return super().to_representation(instance)
+
+
+def requested_fields(request):
+    if request is None or not request.query_params.get('fields'):
+        return None
+    return {name.strip() for name in request.query_params['fields'].split(',')}
+
+
+class ProcessedImageSerializerField(serializers.ImageField):
+    """Links the resized copy once it exists, and the upload until then"""
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        variants = value.field.get_variants(value.instance)
+        if not variants:
+            return super().to_representation(value)
+        url = value.storage.url(variants['default'])
+        request = self.context.get('request', None)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class ImageSrcsetField(serializers.ReadOnlyField):
+    """srcset strings per format, e.g. {'webp': '<url> 320w, <url> 640w'},
+    empty while the variants are pending.
+    """
+
+    def to_representation(self, value):
+        if not value:
+            return {}
+        variants = value.field.get_variants(value.instance)
+        request = self.context.get('request', None)
+        srcset = {}
+        for format, names in variants.get('srcset', {}).items():
+            candidates = []
+            for width, name in sorted(names.items(), key=lambda item: int(item[0])):
+                url = value.storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                candidates.append(f'{url} {width}w')
+            srcset[format] = ', '.join(candidates)
+        return srcset
+
+
+class CategorySerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
+    category_pic = ProcessedImageSerializerField(required=False, allow_null=True)
+    category_pic_srcset = ImageSrcsetField(source='category_pic')
 
-class CategorySerializer(serializers.HyperlinkedModelSerializer):
     class Meta: 
         model = Category
-        fields = ('id', 'url', 'description', 'slug', 'category_pic')
+        fields = ('id', 'url', 'description', 'slug', 'category_pic', 'category_pic_srcset')
+
+
+class MenuCategorySerializer(CategorySerializer):
+    class Meta(CategorySerializer.Meta):
+        fields = ('url', 'description', 'slug', 'category_pic', 'category_pic_srcset')
+
 
+class MenuSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
+    category = MenuCategorySerializer(read_only=True)
+    food_pic = ProcessedImageSerializerField(required=False, allow_null=True)
+    food_pic_srcset = ImageSrcsetField(source='food_pic')
 
-class MenuSerializer(serializers.HyperlinkedModelSerializer):
     class Meta: 
         model = Menu
-        fields = ('id', 'url', 'name', 'description', 'category', 'price', 'food_pic', 'is_special')
-        depth = 1
+        fields = ('id', 'url', 'name', 'description', 'category', 'price', 'food_pic', 'food_pic_srcset',
+            'is_special')
 
 
-class OrderSerializer(serializers.HyperlinkedModelSerializer):
+class OrderSerializer(TimedSerializerMixin, DynamicFieldsMixin, serializers.HyperlinkedModelSerializer):
+    # statuses and payment methods have no endpoint of their own to link to
+    status = serializers.SlugRelatedField(slug_field='name', queryset=OrderStatus.objects.all(),
+        allow_null=True, required=False)
+    payment = serializers.SlugRelatedField(slug_field='name', queryset=PaymentMethod.objects.all(),
+        allow_null=True, required=False)
+
     class Meta: 
-        model = Category
-        fields = ('id', 'url', 'fullname', 'phone_number', 'scheduled_for', 'status', 'payment', 'menu_items')
+        model = Order
+        fields = ('id', 'url', 'fullname', 'phone_number', 'location', 'scheduled_for', 'status', 'payment', 'menu_items',
+            'total', 'item_count')
+
+
+class OrderItemInputSerializer(serializers.Serializer):
+    menu = serializers.IntegerField()
+    qty = serializers.IntegerField(min_value=1, default=1)
+
 
+class PlaceOrderSerializer(serializers.Serializer):
+    """An order with its line items, as accepted by orders/place/"""
+    fullname = serializers.CharField(max_length=50)
+    phone_number = serializers.CharField(max_length=15)
+    scheduled_for = serializers.DateTimeField()
+    location = serializers.IntegerField(required=False)
+    payment = serializers.CharField(max_length=250, required=False)
+    items = OrderItemInputSerializer(many=True, allow_empty=False)
 
-class LocationSerializer(serializers.HyperlinkedModelSerializer):
+
+class LocationSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Location
-        fields = ('id', 'url', 'name')
+        fields = ('id', 'url', 'name', 'slot_minutes', 'slot_capacity', 'opens_at', 'closes_at')
+
+
+class CanteenSettingsSerializer(serializers.ModelSerializer):
+    specials_img = ProcessedImageSerializerField(required=False, allow_null=True)
+    specials_img_srcset = ImageSrcsetField(source='specials_img')
+
+    class Meta:
+        model = CanteenSettings
+        fields = ('specials_img', 'specials_img_srcset', 'opens_at', 'closes_at', 'order_cutoff')
+
+
+class SlotQuerySerializer(serializers.Serializer):
+    date = serializers.DateField(required=False)
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=100)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+
+class MenuSuggestionSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    category = serializers.CharField(allow_null=True)
+    is_special = serializers.BooleanField()
+
+
+class SlotSerializer(serializers.Serializer):
+    starts_at = serializers.DateTimeField()
+    ends_at = serializers.DateTimeField()
+    capacity = serializers.IntegerField(allow_null=True)
+    available = serializers.IntegerField(allow_null=True)
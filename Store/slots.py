@@ -0,0 +1,127 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+def slot_start(location, when):
+    """Start of the location's slot `when` falls in. Slots are counted from
+    the opening time, as in day_slots."""
+    if timezone.is_aware(when):
+        when = timezone.localtime(when)
+    opens = location.opens_at or time(0)
+    origin = opens.hour * 60 + opens.minute
+    minutes = when.hour * 60 + when.minute
+    minutes -= (minutes - origin) % location.slot_minutes
+    # early enough, the slot started the day before
+    start = datetime.combine(when.date(), time(0)) + timedelta(minutes=minutes)
+    return timezone.make_aware(start) if settings.USE_TZ else start
+
+
+def day_slots(location, day):
+    """Starts of every slot between the location's opening and closing time"""
+    opens = datetime.combine(day, location.opens_at or time(0))
+    closes = datetime.combine(day, location.closes_at) if location.closes_at \
+        else datetime.combine(day + timedelta(days=1), time(0))
+    step = timedelta(minutes=location.slot_minutes)
+    start = opens
+    while start + step <= closes:
+        yield timezone.make_aware(start) if settings.USE_TZ else start
+        start += step
+
+
+def is_open(location, starts_at):
+    if timezone.is_aware(starts_at):
+        starts_at = timezone.localtime(starts_at)
+    ends = (starts_at + timedelta(minutes=location.slot_minutes)).time()
+    if location.opens_at and starts_at.time() < location.opens_at:
+        return False
+    # a slot ending at midnight wraps around to 00:00
+    if location.closes_at and (ends > location.closes_at or ends < starts_at.time()):
+        return False
+    return True
+
+
+def reserve(location, starts_at, force=False):
+    """Takes a place in a slot, False when the slot is full.
+
+    The check and the increment are a single conditional update, so
+    concurrent workers can't overbook a slot. The row stays locked until
+    the surrounding transaction ends. `force` ignores the capacity, for
+    orders an admin moves into a slot.
+    """
+    from .models import OrderSlot
+
+    slot = OrderSlot.objects.filter(location_id=location.pk, starts_at=starts_at)
+    limited = slot if force or location.slot_capacity is None \
+        else slot.filter(reserved__lt=location.slot_capacity)
+    for attempt in range(2):
+        if limited.update(reserved=F('reserved') + 1):
+            return True
+        if slot.exists():
+            return False
+        if not force and location.slot_capacity is not None and location.slot_capacity < 1:
+            return False
+        try:
+            with transaction.atomic():
+                OrderSlot.objects.create(location_id=location.pk, starts_at=starts_at, reserved=1)
+            return True
+        except IntegrityError:
+            continue
+    return False
+
+
+def release(location_id, starts_at):
+    from .models import OrderSlot
+
+    OrderSlot.objects.filter(location_id=location_id, starts_at=starts_at, reserved__gt=0) \
+        .update(reserved=F('reserved') - 1)
+
+
+def take_slot(order, location):
+    """Reserves a place for an order in the slot of its scheduled_for.
+
+    When that slot is full and STORE_SLOT_OVERFLOW is 'next', the order is
+    moved to the first later slot of the day with room, with 'reject' it
+    isn't placed. Returns an error message, or None once the order has its
+    slot.
+    """
+    start = slot_start(location, order.scheduled_for)
+    if not is_open(location, start):
+        return f'{location.name} takes no orders at {timezone.localtime(start):%H:%M}.'
+
+    if getattr(settings, 'STORE_SLOT_OVERFLOW', 'next') == 'next':
+        candidates = [slot for slot in day_slots(location, timezone.localtime(start).date())
+                      if slot >= start]
+    else:
+        candidates = [start]
+    for candidate in candidates:
+        if reserve(location, candidate):
+            if candidate != start:
+                order.scheduled_for = candidate
+            order._reserved_slot = (location.pk, candidate)
+            return None
+    return f'No slots left at {location.name} from {timezone.localtime(start):%H:%M}.'
+
+
+def available_slots(location, day):
+    """Capacity left in each of the location's remaining slots on a day"""
+    from .models import OrderSlot
+
+    slots = list(day_slots(location, day))
+    if not slots:
+        return []
+    now = timezone.now()
+    step = timedelta(minutes=location.slot_minutes)
+    reserved = dict(OrderSlot.objects
+        .filter(location_id=location.pk, starts_at__gte=slots[0], starts_at__lte=slots[-1])
+        .values_list('starts_at', 'reserved'))
+    return [{
+        'starts_at': start,
+        'ends_at': start + step,
+        'capacity': location.slot_capacity,
+        'available': None if location.slot_capacity is None
+            else max(location.slot_capacity - reserved.get(start, 0), 0),
+    } for start in slots if start + step > now]
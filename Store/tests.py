@@ -1,3 +1,1379 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+from datetime import datetime, time, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+import redis
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core import signals
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from . import authentication, catalogue, checks, databases, events, images, metrics, reads, rollups, slots, tokens, views
+from .app_settings import Settings
+from .catalogue import get_version, store_cache
+from .lookups import LookupTable
+from .models import *
+from .orders import place_orders
+from .slots import available_slots
+
+# a configured replica's test database stays empty, ReplicaRouterTest reads
+# through a mirror of the primary instead
+primary_reads = override_settings(STORE_REPLICA_DATABASE=None)
+
+
+def bump_elsewhere(*names):
+    """Moves the version counters as another process would, unseen by this
+    one until it checks them again"""
+    stamps = dict(catalogue.stamps)
+    for name in names:
+        catalogue.bump_version(name)
+    catalogue.stamps.update(stamps)
+
+
+def setUpModule():
+    primary_reads.enable()
+
+
+def tearDownModule():
+    primary_reads.disable()
+
+
+def clear_caches():
+    """Empties the in-process caches filled by the tests before"""
+    store_cache().clear()
+    for table in (order_statuses, payment_methods, locations, canteen_settings, revoked_tokens):
+        table.clear()
+    for cache in (authentication.users, authentication.verified_tokens, tokens.recent_refreshes):
+        cache.clear()
+    menu_index.clear()
+    catalogue.stamps.clear()
+    reads.responses.clear()
+
+
+class StoreTestCase(TestCase):
+    """Starts each test without the in-process caches filled by the ones
+    before. Nothing commits in a TestCase, so a test relying on the
+    invalidation that runs on commit wraps its writes in
+    captureOnCommitCallbacks(execute=True)."""
+
+    def setUp(self):
+        clear_caches()
+
+    @contextmanager
+    def captureOnCommitCallbacks(self, *, using=DEFAULT_DB_ALIAS, execute=False):
+        """Django 3.2's TestCase.captureOnCommitCallbacks: the on_commit
+        callbacks registered in the block, run at its end with execute"""
+        callbacks = []
+        start = len(connections[using].run_on_commit)
+        try:
+            yield callbacks
+        finally:
+            run_on_commit = connections[using].run_on_commit[start:]
+            callbacks[:] = [func for sids, func in run_on_commit]
+            if execute:
+                for callback in callbacks:
+                    callback()
+
+
+class QueryBudgetMixin:
+    """Fails a test when a block runs more queries than its budget, on all
+    the test's databases together"""
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        with ExitStack() as stack:
+            contexts = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in self.databases]
+            yield contexts
+        queries = [query['sql'] for context in contexts for query in context.captured_queries]
+        self.assertLessEqual(len(queries), budget,
+            f"{len(queries)} queries executed, budget is {budget}:\n" + '\n'.join(queries))
+
+    def assertListWithinBudget(self, url, budget):
+        # the version counters are read from the database once per
+        # STORE_LOOKUP_CHECK_INTERVAL, not per request
+        self.client.get(url)
+        store_cache().clear()
+        with self.assertMaxQueries(budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+
+class ListQueryBudgetTest(QueryBudgetMixin, StoreTestCase):
+    rows = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(name='Office')
+        status = OrderStatus.objects.create(name='Created')
+        payment = PaymentMethod.objects.create(name='Cash')
+        for i in range(cls.rows):
+            category = Category(description=f'Category {i}')
+            category.save()
+            menu = Menu(name=f'Item {i}', price=10, category=category)
+            menu.save()
+            order = Order.objects.create(fullname=f'Customer {i}', phone_number='0820000000',
+                location=location, status=status, payment=payment,
+                scheduled_for=timezone.now() + timedelta(hours=1))
+            OrderItem.objects.create(order=order, menu=menu, qty=2)
+
+    def test_menus(self):
+        response = self.assertListWithinBudget('/api/v1/menus/', 1)
+        self.assertEqual(len(response.json()), self.rows)
+
+    def test_menu_format_suffix(self):
+        store_cache().clear()
+        response = self.client.get('/api/v1/menus.json')
+        suffixed = response.json()
+        self.assertTrue(suffixed[0]['url'].endswith('.json'))
+        self.assertFalse(self.client.get('/api/v1/menus/').json()[0]['url'].endswith('.json'))
+        self.assertEqual(self.client.get('/api/v1/menus/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        menu = self.client.get(f"/api/v1/menus/{suffixed[0]['id']}/").json()
+        self.assertFalse(menu['category']['url'].endswith('.json'))
+
+    def test_categories(self):
+        self.assertListWithinBudget('/api/v1/categories/', 1)
+
+    def test_locations(self):
+        self.assertListWithinBudget('/api/v1/locations/', 1)
+
+    def test_orders(self):
+        response = self.assertListWithinBudget('/api/v1/orders/', 2)
+        self.assertEqual(response.json()['results'][0]['status'], 'Created')
+
+
+class ConditionalListTest(QueryBudgetMixin, StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(description='Mains')
+        self.menu = Menu.objects.create(name='Stew', price='30.00', category=self.category)
+        self.location = Location.objects.create(name='Office')
+
+    def test_not_modified(self):
+        for url, change in [('/api/v1/menus/', self.menu), ('/api/v1/categories/', self.category),
+                            ('/api/v1/locations/', self.location)]:
+            with self.subTest(url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag, modified = response['ETag'], response['Last-Modified']
+
+                # answered from the version counter, the rows aren't read
+                with self.assertMaxQueries(0):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual((response['ETag'], response.content), (etag, b''))
+                self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=modified).status_code, 304)
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    change.save()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+
+class OrderFilterTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        office, lobby = Location.objects.create(name='Office'), Location.objects.create(name='Lobby')
+        created, ready = OrderStatus.objects.create(name='Created'), OrderStatus.objects.create(name='Ready')
+        cash, card = PaymentMethod.objects.create(name='Cash'), PaymentMethod.objects.create(name='Card')
+        self.noon = timezone.make_aware(datetime(2021, 3, 1, 12))
+        self.orders = [
+            Order.objects.create(fullname=f'Customer {i}', phone_number='0820000000', location=location,
+                status=status, payment=payment, scheduled_for=self.noon + timedelta(hours=i))
+            for i, (location, status, payment) in enumerate([(office, created, cash), (office, ready, card),
+                                                             (lobby, created, card)])]
+        self.lobby = lobby
+
+    def filtered(self, **params):
+        response = self.client.get('/api/v1/orders/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted(self.orders.index(Order.objects.get(pk=order['id'])) for order in response.json()['results'])
+
+    def test_lookups(self):
+        self.assertEqual(self.filtered(location='Office'), [0, 1])
+        self.assertEqual(self.filtered(location=f'Office,{self.lobby.pk}'), [0, 1, 2])
+        self.assertEqual(self.filtered(status='Created'), [0, 2])
+        self.assertEqual(self.filtered(payment='Card'), [1, 2])
+        self.assertEqual(self.filtered(location='Office', status='Created,Ready', payment='Cash'), [0])
+        # an id is taken as it is
+        self.assertEqual(self.filtered(status='0'), [])
+
+    def test_scheduled_for(self):
+        self.assertEqual(self.filtered(scheduled_for_after=(self.noon + timedelta(hours=1)).isoformat()), [1, 2])
+        self.assertEqual(self.filtered(scheduled_for_before=(self.noon + timedelta(hours=1)).isoformat()), [0, 1])
+        self.assertEqual(self.filtered(scheduled_for_after=self.noon.isoformat(),
+                                       scheduled_for_before=self.noon.isoformat()), [0])
+
+    def test_invalid_values(self):
+        response = self.client.get('/api/v1/orders/', {'location': 'Office,Nowhere', 'status': 'Created'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'location': ['"Nowhere" does not exist.']})
+        response = self.client.get('/api/v1/orders/', {'scheduled_for_after': 'tomorrow'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('scheduled_for', response.json())
+        self.client.force_login(User.objects.create_user('finance'))
+        self.assertEqual(self.client.get('/api/v1/exports/orders/', {'payment': 'IOU'}).status_code, 400)
+
+    def test_indexes(self):
+        # the queue filters are served by the indexes from 0002_order_indexes
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Order._meta.db_table)
+        columns = {name: constraint['columns'] for name, constraint in constraints.items() if constraint['index']}
+        self.assertEqual(columns['order_queue_idx'], ['location_id', 'status_id', 'scheduled_for'])
+        self.assertEqual(columns['order_status_time_idx'], ['status_id', 'scheduled_for'])
+        self.assertEqual(columns['order_schedule_idx'], ['scheduled_for', 'id'])
+
+
+class OrderPaginationTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.noon = timezone.make_aware(datetime(2021, 3, 1, 12))
+        # more orders share a scheduled_for than DRF's cursor could offset past
+        Order.objects.bulk_create(
+            Order(fullname=f'Customer {i}', phone_number='0820000000',
+                  scheduled_for=self.noon + timedelta(minutes=max(i - 1300, 0)))
+            for i in range(1315))
+        self.ids = list(Order.objects.order_by('scheduled_for', 'id').values_list('id', flat=True))
+
+    def walk(self, url, link):
+        pages = []
+        # a cursor that never runs out would loop forever
+        while url and len(pages) < 20:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            pages.append([order['id'] for order in response.json()['results']])
+            url = response.json()[link]
+        return pages
+
+    def test_ties(self):
+        pages = self.walk('/api/v1/orders/?fields=id&page_size=100', 'next')
+        self.assertEqual(len(pages), 14)
+        self.assertEqual([pk for page in pages for pk in page], self.ids)
+
+        last = self.client.get('/api/v1/orders/?fields=id&page_size=100').json()
+        for i in range(13):
+            last = self.client.get(last['next']).json()
+        self.assertIsNone(last['next'])
+        back = self.walk(last['previous'], 'previous')
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/v1/orders/', {'cursor': 'nonsense'}).status_code, 404)
+
+    def test_fields(self):
+        response = self.client.get('/api/v1/orders/', {'fields': 'id,status', 'page_size': 2})
+        self.assertEqual(response.json()['results'], [{'id': pk, 'status': None} for pk in self.ids[:2]])
+        order = Order.objects.get(pk=self.ids[0])
+        response = self.client.get(f'/api/v1/orders/{order.pk}/', {'fields': 'fullname,scheduled_for'})
+        self.assertEqual(response.json(), {'fullname': order.fullname,
+                                           'scheduled_for': self.noon.isoformat().replace('+00:00', 'Z')})
+        # without menu_items the items aren't fetched
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/v1/orders/', {'fields': 'id'})
+        self.assertFalse([query for query in queries if OrderItem._meta.db_table in query['sql']])
+
+
+class SalesRollupTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.office = Location.objects.create(name='Office')
+        self.created = OrderStatus.objects.create(name='Created')
+        self.completed = OrderStatus.objects.create(name='Completed')
+        category = Category(description='Main')
+        category.save()
+        self.bunny_chow = Menu(name='Bunny chow', price=40, category=category)
+        self.bunny_chow.save()
+        self.coke = Menu(name='Coke', price=12)
+        self.coke.save()
+
+    def rows(self):
+        return sorted(SalesRollup.objects.values_list(
+            'day', 'slot', 'location_id', 'status_id', 'menu_id', 'category_id', 'qty', 'revenue'))
+
+    def test_incremental_updates_match_rebuild(self):
+        order = Order.objects.create(fullname='Customer', phone_number='0820000000',
+            location=self.office, status=self.created, scheduled_for=timezone.now())
+        item = OrderItem.objects.create(order=order, menu=self.bunny_chow, qty=2)
+        OrderItem.objects.create(order=order, menu=self.coke, qty=3)
+        item.qty = 5
+        item.save()
+        order.status = self.completed
+        order.save()
+        order.scheduled_for += timedelta(hours=2)
+        order.save()
+
+        incremental = [row for row in self.rows() if row[6]]
+        rollups.rebuild()
+        self.assertEqual(incremental, self.rows())
+        self.assertEqual({row[3] for row in incremental}, {self.completed.pk})
+
+        response = self.client.get('/api/v1/reports/sales/?status=Completed')
+        self.assertEqual(response.status_code, 401)
+
+
+class OrderTotalsTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stew = Menu.objects.create(name='Stew', price=Decimal('30.00'))
+        self.pap = Menu.objects.create(name='Pap', price=Decimal('8.50'))
+        self.order = Order.objects.create(fullname='Ann', phone_number='0820000000', scheduled_for=timezone.now())
+
+    def totals(self):
+        self.order.refresh_from_db()
+        return self.order.total, self.order.item_count
+
+    def test_price_snapshot_and_totals(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        stew = OrderItem.objects.create(order=self.order, menu=self.stew, qty=2)
+        pap = OrderItem.objects.create(order=self.order, menu=self.pap)
+        self.assertEqual(self.totals(), (Decimal('68.50'), 3))
+
+        # items keep the price they were ordered at
+        self.stew.price = Decimal('35.00')
+        self.stew.save()
+        stew.qty = 3
+        stew.save()
+        stew.refresh_from_db()
+        self.assertEqual(stew.unit_price, Decimal('30.00'))
+        self.assertEqual(self.totals(), (Decimal('98.50'), 4))
+
+        # saving an order loaded before the items doesn't write old totals back
+        stale.fullname = 'Ann B'
+        stale.save()
+        pap.delete()
+        self.assertEqual(self.totals(), (Decimal('90.00'), 3))
+        self.assertEqual(self.order.fullname, 'Ann B')
+
+        order = Order.objects.create(fullname='Bob', phone_number='0820000000', scheduled_for=timezone.now())
+        self.assertEqual(OrderItem.objects.create(order=order, menu=self.stew).unit_price, Decimal('35.00'))
+
+
+class OrderSlotTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.office = Location.objects.create(name='Office', slot_minutes=15, slot_capacity=2,
+            opens_at=time(11), closes_at=time(14))
+        OrderStatus.objects.create(name='Created')
+        PaymentMethod.objects.create(name='Cash')
+        self.menu = Menu(name='Bunny chow', price=40)
+        self.menu.save()
+        self.noon = timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=1), time(12)))
+
+    def place(self, count, scheduled_for):
+        return place_orders([{'fullname': f'Customer {i}', 'phone_number': '0820000000',
+            'scheduled_for': scheduled_for, 'location': self.office.pk,
+            'items': [{'menu': self.menu.pk, 'qty': 1}]} for i in range(count)])
+
+    def test_overflow_moves_to_next_slot(self):
+        orders = self.place(5, self.noon + timedelta(minutes=5))
+        self.assertEqual([order.scheduled_for - self.noon for order in orders],
+            [timedelta(minutes=5)] * 2 + [timedelta(minutes=15)] * 2 + [timedelta(minutes=30)])
+
+        response = self.client.get(f'/api/v1/locations/{self.office.pk}/slots/?date={self.noon.date()}')
+        available = {slot['starts_at']: slot['available'] for slot in response.json()}
+        self.assertEqual(len(available), 12)
+        self.assertEqual(available['%sT12:15:00Z' % self.noon.date()], 0)
+        self.assertEqual(available['%sT12:30:00Z' % self.noon.date()], 1)
+
+        orders[0].delete()
+        self.assertEqual(OrderSlot.objects.get(starts_at=self.noon).reserved, 1)
+
+    def test_slots_count_from_opening_time(self):
+        self.office.opens_at = time(11, 10)
+        self.office.save()
+        opening = self.noon.replace(hour=11, minute=10)
+        orders = self.place(3, opening + timedelta(minutes=10))
+        self.assertEqual([order.scheduled_for - opening for order in orders],
+            [timedelta(minutes=10)] * 2 + [timedelta(minutes=15)])
+        self.assertEqual(dict(OrderSlot.objects.values_list('starts_at', 'reserved')),
+            {opening: 2, opening + timedelta(minutes=15): 1})
+
+        available = [slot['available'] for slot in available_slots(self.office, opening.date())]
+        self.assertEqual(available[:3], [0, 1, 2])
+
+        # a slot grid that doesn't divide the day goes on past midnight
+        self.office.slot_minutes = 45
+        self.assertEqual(slots.slot_start(self.office, self.noon.replace(hour=0, minute=3)),
+                         self.noon.replace(hour=23, minute=55) - timedelta(days=1))
+
+    @override_settings(STORE_SLOT_OVERFLOW='reject')
+    def test_full_slot_is_rejected(self):
+        self.place(2, self.noon)
+        with self.assertRaises(ValidationError) as context:
+            self.place(1, self.noon)
+        self.assertIn('scheduled_for', context.exception.detail[0])
+        with self.assertRaises(ValidationError):
+            self.place(1, self.noon.replace(hour=16))
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class PlaceOrdersTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.office = Location.objects.create(name='Office', slot_capacity=1)
+        OrderStatus.objects.create(name='Created')
+        PaymentMethod.objects.create(name='Cash')
+        self.stew = Menu.objects.create(name='Stew', price=Decimal('30.00'))
+        self.pap = Menu.objects.create(name='Pap', price=Decimal('8.50'))
+        self.noon = timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=1), time(12)))
+        self.client.force_login(User.objects.create_user('customer'))
+
+    def order(self, *items, **fields):
+        return dict({'fullname': 'Ann', 'phone_number': '0820000000', 'location': self.office.pk,
+                     'scheduled_for': self.noon.isoformat(),
+                     'items': [{'menu': menu.pk, 'qty': qty} for menu, qty in items]}, **fields)
+
+    def place(self, orders):
+        return self.client.post('/api/v1/orders/place/', json.dumps(orders), content_type='application/json')
+
+    def test_batch(self):
+        response = self.place([self.order((self.stew, 1), (self.pap, 2), (self.stew, 1)),
+                               self.order((self.pap, 1), scheduled_for=(self.noon + timedelta(hours=1)).isoformat())])
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([(order['total'], order['item_count']) for order in response.json()],
+                         [('77.00', 4), ('8.50', 1)])
+        first = Order.objects.get(pk=response.json()[0]['id'])
+        self.assertEqual(sorted(first.orderitem_set.values_list('menu__name', 'qty', 'unit_price')),
+                         [('Pap', 2, Decimal('8.50')), ('Stew', 2, Decimal('30.00'))])
+        self.assertEqual(first.status.name, 'Created')
+        self.assertEqual(first.payment.name, 'Cash')
+        self.assertEqual(sum(SalesRollup.objects.values_list('qty', flat=True)), 5)
+
+        response = self.place(self.order((self.stew, 1), scheduled_for=(self.noon + timedelta(hours=2)).isoformat()))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['total'], '30.00')
+
+    def test_item_errors(self):
+        response = self.place([self.order((self.stew, 1)),
+                               dict(self.order((self.stew, 1)), items=[{'menu': 0}, {'menu': -1}],
+                                    location=0, payment='Card')])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), [{}, {
+            'items': ['Menu item -1 does not exist.', 'Menu item 0 does not exist.'],
+            'location': ['Location 0 does not exist.'],
+            'payment': ['Payment method "Card" does not exist.'],
+        }])
+
+        response = self.place(dict(self.order(), items=[]))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('items', response.json())
+        response = self.place(self.order((self.stew, 0)))
+        self.assertEqual(response.json(), {'items': [{'qty': ['Ensure this value is greater than or equal to 1.']}]})
+        self.assertFalse(Order.objects.exists())
+
+    @override_settings(STORE_SLOT_OVERFLOW='reject')
+    def test_failed_order_rolls_back_batch(self):
+        response = self.place([self.order((self.stew, 1)), self.order((self.pap, 1)), self.order((self.pap, 1))])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertEqual([list(error) for error in errors[1:]], [['scheduled_for'], ['scheduled_for']])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertFalse(OrderSlot.objects.filter(reserved__gt=0).exists())
+        self.assertFalse(SalesRollup.objects.exists())
+
+        # the slot is still free
+        self.assertEqual(self.place(self.order((self.pap, 1))).status_code, 201)
+
+
+@override_settings(STORE_METRICS_SAMPLE_RATE=1.0)
+class MetricsTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        Location.objects.create(name='Office')
+
+    def test_request_metrics(self):
+        with self.assertLogs('Store.slow_requests', 'WARNING') as logs, \
+                self.settings(STORE_SLOW_REQUEST_SECONDS=0):
+            self.client.get('/api/v1/locations/')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'location-list')
+        self.assertEqual(record['queries'], len(record['sql']))
+
+        with self.settings(STORE_METRICS_TOKEN='secret'):
+            text = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        self.assertIn('store_request_duration_seconds_count{view="location-list",method="GET",status="200"} 1', text)
+        self.assertIn('store_request_db_queries_count{view="location-list"} 1', text)
+        self.assertIn('store_request_serializer_seconds_bucket{view="location-list",le="+Inf"} 1', text)
+
+    def test_access(self):
+        # the client address doesn't count, behind a proxy it is always the proxy's
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+        with self.settings(STORE_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class ValuesSerializerTest(StoreTestCase):
+    """The values serializers and orjson renderer give the same bytes as
+    the model serializers and JSONRenderer"""
+
+    def setUp(self):
+        super().setUp()
+        office = Location.objects.create(name='Office', slot_capacity=10, opens_at=time(7, 30))
+        Location.objects.create(name='Kantien – “oud”')
+        created = OrderStatus.objects.create(name='Created')
+        PaymentMethod.objects.create(name='Cash')
+        main = Category(description='Main meals')
+        main.save()
+        Category.objects.filter(pk=main.pk).update(category_pic='category_pictures/main.jpg',
+            category_pic_variants={'source': 'category_pictures/main.jpg',
+                'default': 'category_pictures/main_300x200.jpg',
+                'srcset': {'jpeg': {'640': 'category_pictures/main_640w.jpg',
+                                    '320': 'category_pictures/main_320w.jpg'}}})
+        Category(description='Empty').save()
+        bunny_chow = Menu(name='Bunny chow', description='Half loaf, "hot" curry', price=45.5, category=main)
+        bunny_chow.save()
+        Menu.objects.filter(pk=bunny_chow.pk).update(food_pic='food_pictures/bunny.png',
+            food_pic_variants={'source': 'food_pictures/older.png'})
+        coke = Menu(name='Coke', description='Ice cold\u2028Can', price=12, is_special=True)
+        coke.save()
+        first = Order.objects.create(fullname='Zoë', phone_number='0820000000', location=office,
+            status=created, scheduled_for=timezone.now())
+        OrderItem.objects.create(order=first, menu=bunny_chow, qty=2)
+        OrderItem.objects.create(order=first, menu=coke)
+        Order.objects.create(fullname='Sipho', phone_number='0830000000', location=None, status=None,
+            scheduled_for=timezone.now() + timedelta(hours=1))
+        self.client.force_login(User.objects.create_user('staff'))
+
+    def assertSameBytes(self, view, url):
+        store_cache().clear()
+        fast = self.client.get(url)
+        store_cache().clear()
+        with mock.patch.object(view, 'values_serializer_class', None), \
+                mock.patch.object(view, 'renderer_classes', (JSONRenderer, )):
+            reference = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, reference.content)
+
+    def test_menus(self):
+        self.assertSameBytes(views.MenuView, '/api/v1/menus/')
+
+    def test_categories(self):
+        self.assertSameBytes(views.CategoryView, '/api/v1/categories/')
+
+    def test_locations(self):
+        self.assertSameBytes(views.LocationView, '/api/v1/locations/')
+
+    def test_orders(self):
+        self.assertSameBytes(views.OrderView, '/api/v1/orders/')
+        self.assertSameBytes(views.OrderView, '/api/v1/orders/?fields=id,status,menu_items&page_size=1')
+
+
+class LookupTableTest(QueryBudgetMixin, StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.created = OrderStatus.objects.create(name='Created')
+        self.ready = OrderStatus.objects.create(name='Ready')
+
+    def test_load(self):
+        get_version(order_statuses.version_name)
+        # the version counter and the rows
+        with self.assertMaxQueries(2):
+            self.assertEqual(order_statuses.get('Created'), self.created)
+        with self.assertMaxQueries(0):
+            self.assertEqual(order_statuses.get_by_id(self.ready.pk), self.ready)
+            self.assertEqual(set(order_statuses.all()), {self.created, self.ready})
+
+    def test_missing_key(self):
+        with self.assertRaises(OrderStatus.DoesNotExist):
+            order_statuses.get('Cancelled')
+        with self.assertRaises(OrderStatus.DoesNotExist):
+            order_statuses.get_by_id(0)
+
+    def test_refresh_after_bump(self):
+        order_statuses.get('Created')
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderStatus.objects.create(name='Collected')
+        self.assertEqual(order_statuses.get('Collected').name, 'Collected')
+
+        # a change made by another worker shows once the counter is checked again
+        for versions, name in [('database', 'Done'), ('cache', 'Served')]:
+            with self.subTest(versions), self.settings(STORE_VERSIONS=versions):
+                order_statuses.clear()
+                order_statuses.get('Created')
+                OrderStatus.objects.filter(pk=self.ready.pk).update(name=name)
+                bump_elsewhere(order_statuses.version_name)
+                self.assertNotEqual(order_statuses.get_by_id(self.ready.pk).name, name)
+                with self.settings(STORE_LOOKUP_CHECK_INTERVAL=0):
+                    self.assertEqual(order_statuses.get_by_id(self.ready.pk).name, name)
+
+
+class CanteenSettingsTest(QueryBudgetMixin, StoreTestCase):
+    def test_cached_settings(self):
+        # creates the row, then loads it once
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Settings.app_settings().pk, CanteenSettings.SINGLETON_PK)
+        self.client.get('/api/v1/settings/')
+        with self.assertMaxQueries(0):
+            response = self.client.get('/api/v1/settings/')
+        self.assertEqual(response.json()['opens_at'], '07:00:00')
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertEqual(self.client.get('/api/v1/settings/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CanteenSettings(order_cutoff=time(10, 30)).save()
+        self.assertEqual(CanteenSettings.objects.count(), 1)
+        response = self.client.get('/api/v1/settings/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.json()['order_cutoff'], '10:30:00')
+
+    def test_saved_by_another_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            CanteenSettings.load()
+        etag = self.client.get('/api/v1/settings/')['ETag']
+        CanteenSettings.objects.update(order_cutoff=time(11))
+        bump_elsewhere(canteen_settings.version_name)
+        self.assertEqual(self.client.get('/api/v1/settings/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertIsNone(Settings.app_settings().order_cutoff)
+        with self.settings(STORE_LOOKUP_CHECK_INTERVAL=0):
+            response = self.client.get('/api/v1/settings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['order_cutoff'], '11:00:00')
+
+
+class AuthenticationTest(QueryBudgetMixin, StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('customer', password='secret')
+        self.refresh = RefreshToken.for_user(self.user)
+        self.bearer = f'Bearer {self.refresh.access_token}'
+
+    def test_cached_jwt(self):
+        self.client.get('/api/v1/menus/', HTTP_AUTHORIZATION=self.bearer)
+        with self.assertMaxQueries(0):
+            response = self.client.get('/api/v1/menus/', HTTP_AUTHORIZATION=self.bearer)
+        self.assertEqual(response.status_code, 200)
+
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get('/api/v1/menus/', HTTP_AUTHORIZATION=self.bearer).status_code, 401)
+
+    def test_cached_session(self):
+        self.client.force_login(self.user)
+        self.client.get('/api/v1/menus/')
+        with self.assertMaxQueries(0):
+            response = self.client.get('/api/v1/menus/')
+        self.assertEqual(response.wsgi_request.user, self.user)
+
+        self.user.set_password('changed')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertFalse(self.client.get('/api/v1/menus/').wsgi_request.user.is_authenticated)
+
+    def test_anonymous_read(self):
+        self.client.get('/api/v1/menus/')
+        with self.assertMaxQueries(0), \
+                mock.patch.object(authentication.CachedJWTAuthentication, 'authenticate') as authenticate:
+            self.assertEqual(self.client.get('/api/v1/menus/').status_code, 200)
+        authenticate.assert_not_called()
+        self.assertEqual(self.client.post('/api/v1/categories/', {'description': 'Soup'}).status_code, 401)
+
+    def test_refresh_and_revoke(self):
+        refresh = lambda: self.client.post('/api/token/refresh/', {'refresh': str(self.refresh)})
+        first, second = refresh(), refresh()
+        self.assertEqual(first.json()['access'], second.json()['access'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/token/revoke/', {'refresh': str(self.refresh)},
+                                        HTTP_AUTHORIZATION=self.bearer)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/api/v1/menus/', HTTP_AUTHORIZATION=self.bearer).status_code, 401)
+        self.assertEqual(refresh().status_code, 401)
+
+    def test_revoked_by_another_worker(self):
+        menus = lambda: self.client.get('/api/v1/menus/', HTTP_AUTHORIZATION=self.bearer).status_code
+        self.assertEqual(menus(), 200)
+
+        # the other worker has a cache and a copy of the revocations of its own
+        elsewhere = LookupTable(RevokedToken, field_name='jti')
+        for signal in (models.signals.post_save, models.signals.post_delete):
+            self.addCleanup(signal.disconnect, elsewhere._changed, sender=RevokedToken)
+        other_cache = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                   'LOCATION': 'another-worker'}}
+        with override_settings(CACHES=other_cache), mock.patch.object(tokens, 'revoked_tokens', elsewhere), \
+                self.captureOnCommitCallbacks(execute=True):
+            tokens.revoke(AccessToken(self.bearer.split()[1]))
+        self.assertEqual(menus(), 200)
+        with self.settings(STORE_LOOKUP_CHECK_INTERVAL=0):
+            self.assertEqual(menus(), 401)
+
+    def test_version_store_check(self):
+        self.assertEqual(checks.check_versions(None), [])
+        with self.settings(STORE_VERSIONS='cache'):
+            self.assertEqual([error.id for error in checks.check_versions(None)], ['Store.E002'])
+        with self.settings(STORE_VERSIONS='cache', CACHES={'default': {'BACKEND': 'Store.cache_backends.RedisCache',
+                                                                       'LOCATION': 'redis://localhost:6379/0'}}):
+            self.assertEqual(checks.check_versions(None), [])
+
+
+@override_settings(STORE_REPLICA_DATABASE='mirror')
+class ReplicaRouterTest(TransactionTestCase):
+    """Routes reads to a test mirror, a second connection to the primary's
+    test database standing in for a replica that is up to date. Writes
+    have to commit for the mirror to see them."""
+
+    @classmethod
+    def setUpClass(cls):
+        # added once the test databases exist, the runner only sets up and
+        # checks the configured ones
+        connections.databases['mirror'] = {**connections['default'].settings_dict,
+                                           'TEST': {'MIRROR': DEFAULT_DB_ALIAS}}
+        cls.databases = {DEFAULT_DB_ALIAS, 'mirror'}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['mirror'].close()
+        del connections['mirror']
+        del connections.databases['mirror']
+
+    def setUp(self):
+        clear_caches()
+        Category.objects.create(description='Mains')
+        OrderStatus.objects.create(name='Created')
+        PaymentMethod.objects.create(name='Cash')
+        self.location = Location.objects.create(name='Lobby')
+        self.menu = Menu.objects.create(name='Stew', price='30.00')
+        self.client.force_login(User.objects.create_user('customer'))
+
+    def queries(self, alias, *request):
+        with CaptureQueriesContext(connections[alias]) as context:
+            response = self.client.generic(*request, content_type='application/json')
+        return response, len(context)
+
+    def test_reads_and_writes(self):
+        response, replica_queries = self.queries('mirror', 'GET', '/api/v1/categories/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(replica_queries, 0)
+        self.assertEqual([category['description'] for category in response.json()], ['Mains'])
+        # orders and slots are read from the primary
+        self.assertEqual(self.queries('mirror', 'GET', '/api/v1/orders/')[1], 0)
+        self.assertEqual(self.queries('mirror', 'GET', f'/api/v1/locations/{self.location.pk}/slots/')[1], 0)
+
+        noon = timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=1), time(12)))
+        order = {'fullname': 'Ann', 'phone_number': '0820000000', 'location': self.location.pk,
+                 'scheduled_for': noon.isoformat(),
+                 'items': [{'menu': self.menu.pk, 'qty': 1}]}
+        response, replica_queries = self.queries('mirror', 'POST', '/api/v1/orders/place/', json.dumps(order))
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(replica_queries, 0)
+        # read your writes: the client stays on the primary for a while
+        self.assertEqual(self.queries('mirror', 'GET', '/api/v1/categories/')[1], 0)
+
+
+class ConnectionHealthTest(SimpleTestCase):
+    def request(self, connection):
+        middleware = databases.ConnectionHealthMiddleware(lambda request: 'response')
+        with mock.patch.object(databases, 'connections') as handler:
+            handler.all.return_value = [connection]
+            self.assertEqual(middleware(None), 'response')
+
+    @override_settings(STORE_DB_HEALTH_CHECK_IDLE=10)
+    def test_checked_after_idle(self):
+        connection = mock.Mock(in_atomic_block=False)
+        connection.is_usable.return_value = False
+        del connection.store_last_used
+        self.request(connection)
+        connection.close.assert_called_once_with()
+        # in use since, not pinged again
+        connection.is_usable.reset_mock()
+        self.request(connection)
+        connection.is_usable.assert_not_called()
+
+        connection.store_last_used -= 10
+        self.request(connection)
+        connection.is_usable.assert_called_once_with()
+        self.assertEqual(connection.close.call_count, 2)
+
+    @override_settings(STORE_DB_HEALTH_CHECKS=False)
+    def test_disabled(self):
+        connection = mock.Mock(in_atomic_block=False)
+        del connection.store_last_used
+        self.request(connection)
+        connection.is_usable.assert_not_called()
+
+
+class MenuSearchTest(QueryBudgetMixin, StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        mains = Category.objects.create(description='Mains')
+        desserts = Category.objects.create(description='Desserts')
+        Menu.objects.create(name='Beef stew', category=mains, price=45)
+        self.curry = Menu.objects.create(name='Chicken curry', category=mains, price=50, is_special=True)
+        Menu.objects.create(name='Chocolate cake', description='Rich chocolate sponge', category=desserts, price=25)
+
+    def names(self, q):
+        response = self.client.get('/api/v1/menus/typeahead/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [menu['name'] for menu in response.json()]
+
+    def test_typeahead(self):
+        self.assertEqual(self.names('ch'), ['Chicken curry', 'Chocolate cake'])
+        self.assertEqual(self.names('choc cak'), ['Chocolate cake'])
+        self.assertEqual(self.names('dessert'), ['Chocolate cake'])
+        self.assertEqual(self.names('curyy'), ['Chicken curry'])
+        self.assertEqual(self.names('pizza'), [])
+
+        response = self.client.get('/api/v1/menus/search/', {'q': 'stew'})
+        self.assertEqual([menu['name'] for menu in response.json()], ['Beef stew'])
+        self.assertIn('url', response.json()[0])
+        self.assertEqual(self.client.get('/api/v1/menus/search/').status_code, 400)
+
+    def test_incremental_updates(self):
+        self.names('ch')
+        self.curry.name = 'Lamb curry'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.curry.save()
+            Category.objects.get(description='Desserts').delete()
+        with self.assertMaxQueries(0):
+            self.assertEqual(self.names('lamb'), ['Lamb curry'])
+            self.assertEqual(self.names('ch'), ['Chocolate cake'])
+            self.assertEqual(self.names('dessert'), [])
+
+    def test_changes_wait_for_commit(self):
+        self.names('ch')
+        version = get_version('menu')
+        self.curry.name = 'Lamb curry'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.curry.save()
+        self.assertEqual(get_version('menu'), version)
+        self.assertEqual(self.names('lamb'), [])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(get_version('menu'), version + 1)
+        self.assertEqual(self.names('lamb'), ['Lamb curry'])
+
+
+class AsyncReadTest(QueryBudgetMixin, StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.application = reads.read_application(get_asgi_application())
+        self.office = Location.objects.create(name='Office')
+
+    def get(self, path, *headers):
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'scheme': 'http',
+                 'root_path': '', 'server': ('testserver', 80),
+                 'headers': [(b'host', b'testserver'), *headers]}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        # as django's test client does, the test's connection stays open
+        signals.request_started.disconnect(close_old_connections)
+        signals.request_finished.disconnect(close_old_connections)
+        try:
+            async_to_sync(self.application)(scope, receive, send)
+        finally:
+            signals.request_started.connect(close_old_connections)
+            signals.request_finished.connect(close_old_connections)
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        return messages[0]['status'], {name.lower(): value for name, value in messages[0]['headers']}, body
+
+    def test_cached_reads(self):
+        status, headers, body = self.get('/api/v1/locations/')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, self.client.get('/api/v1/locations/').content)
+        with self.assertMaxQueries(0):
+            self.assertEqual(self.get('/api/v1/locations/')[2], body)
+            self.assertEqual(self.get('/api/v1/locations/', (b'if-none-match', headers[b'etag']))[0], 304)
+
+        self.office.name = 'Head office'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.office.save()
+        self.assertIn(b'Head office', self.get('/api/v1/locations/')[2])
+        # credentials always go through django
+        self.assertEqual(self.get('/api/v1/locations/', (b'authorization', b'Bearer nonsense'))[0], 401)
+
+    def test_stamp_checks(self):
+        self.get('/api/v1/locations/')
+        with mock.patch.object(catalogue, 'get_stamp', wraps=catalogue.get_stamp) as get_stamp:
+            self.get('/api/v1/locations/')
+        get_stamp.assert_not_called()
+
+        # checked again off the event loop, which it would block
+        def get_stamp(name):
+            with self.assertRaises(RuntimeError):
+                asyncio.get_running_loop()
+            return stamp(name)
+        stamp = catalogue.get_stamp
+        with self.settings(STORE_LOOKUP_CHECK_INTERVAL=0), \
+                mock.patch.object(catalogue, 'get_stamp', side_effect=get_stamp) as checked:
+            self.get('/api/v1/locations/')
+        checked.assert_called_once_with('location')
+
+        # a change made by another process shows once the stamp is checked again
+        Location.objects.filter(pk=self.office.pk).update(name='Annex')
+        bump_elsewhere('location')
+        self.assertNotIn(b'Annex', self.get('/api/v1/locations/')[2])
+        with self.settings(STORE_LOOKUP_CHECK_INTERVAL=0):
+            self.assertIn(b'Annex', self.get('/api/v1/locations/')[2])
+
+    def test_order_status(self):
+        created = OrderStatus.objects.create(name='Created')
+        order = Order.objects.create(fullname='Ann', phone_number='0820000000', location=self.office,
+            status=created, scheduled_for=timezone.now())
+        status, headers, body = self.get(f'/api/v1/orders/{order.pk}/status/')
+        self.assertEqual(json.loads(body)['status'], 'Created')
+        with self.assertMaxQueries(0):
+            self.assertEqual(self.get(f'/api/v1/orders/{order.pk}/status/')[2], body)
+        self.assertEqual(self.get('/api/v1/orders/0/status/')[0], 404)
+
+
+class EventsTest(StoreTestCase):
+    def test_stream(self):
+        application = events.events_application(None)
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/v1/events/locations/2/'}
+        noon = timezone.make_aware(datetime(2021, 3, 1, 12))
+
+        async def stream():
+            messages, done = [], asyncio.Event()
+
+            async def receive():
+                await done.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+                if message.get('body', b'').startswith(b'event:'):
+                    done.set()
+
+            task = asyncio.ensure_future(application(scope, receive, send))
+            while not messages:
+                await asyncio.sleep(0)
+            for location in (3, 2):
+                events.get_hub().publish(f'location:{location}', events.order_event(1, location, 'Ready', noon))
+            await asyncio.wait_for(task, 5)
+            return messages
+
+        start, event = async_to_sync(stream)()
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        data = {'order': 1, 'location': 2, 'status': 'Ready', 'scheduled_for': '2021-03-01T12:00:00+00:00'}
+        self.assertEqual(event['body'], f'event: status\ndata: {json.dumps(data)}\n\n'.encode())
+        self.assertFalse(events.get_hub()._subscriptions)
+
+    def test_status_change_published(self):
+        office = Location.objects.create(name='Office')
+        created, ready = OrderStatus.objects.create(name='Created'), OrderStatus.objects.create(name='Ready')
+        noon = timezone.make_aware(datetime(2021, 3, 1, 12))
+        order = Order.objects.create(fullname='Ann', phone_number='0820000000', location=office,
+            status=created, scheduled_for=noon)
+
+        with mock.patch.object(events, 'get_hub') as get_hub:
+            publish = get_hub.return_value.publish
+            with self.captureOnCommitCallbacks() as callbacks:
+                order.status = ready
+                order.save()
+            # nothing goes out until the change commits
+            publish.assert_not_called()
+            for callback in callbacks:
+                callback()
+            event = events.order_event(order.pk, office.pk, 'Ready', noon)
+            self.assertEqual(publish.call_args_list, [mock.call(f'order:{order.pk}', event),
+                                                      mock.call(f'location:{office.pk}', event)])
+
+            publish.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                order.fullname = 'Anne'
+                order.save()
+            publish.assert_not_called()
+
+    def test_redis_publish_error_is_logged(self):
+        # nothing listens on the port
+        hub = events.RedisHub('redis://127.0.0.1:1/0')
+        with self.assertLogs('Store.events', 'ERROR'):
+            hub.publish('order:1', {'status': 'Ready'})
+
+    def test_redis_listener_reconnects(self):
+        hub = events.RedisHub('redis://127.0.0.1:1/0')
+        hub._listener = mock.sentinel.thread
+
+        def dropped():
+            yield {'channel': b'store:events:order:1', 'data': b'{"status": "Ready"}'}
+            raise redis.ConnectionError
+
+        failing, connected = mock.Mock(), mock.Mock()
+        failing.psubscribe.side_effect = redis.ConnectionError
+        connected.listen.side_effect = dropped
+        with mock.patch.object(hub._client, 'pubsub', side_effect=[failing, failing, connected, RuntimeError]), \
+                mock.patch.object(events.InMemoryHub, 'publish') as delivered, \
+                mock.patch.object(events.time, 'sleep') as sleep, \
+                self.assertLogs('Store.events', 'WARNING'), self.assertRaises(RuntimeError):
+            hub._listen()
+        delivered.assert_called_once_with('order:1', {'status': 'Ready'})
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [1, 2, 1])
+        self.assertEqual(failing.close.call_count, 2)
+        self.assertIsNone(hub._listener)
+
+
+@override_settings(STORE_EXPORT_CHUNK_SIZE=2, STORE_IMPORT_BATCH_SIZE=2)
+class ExportImportTest(QueryBudgetMixin, StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mains = Category.objects.create(description='Mains')
+        self.stew = Menu.objects.create(name='Stew', price=Decimal('30.00'), category=self.mains)
+        self.pap = Menu.objects.create(name='Pap', price=Decimal('8.50'))
+        completed = OrderStatus.objects.create(name='Completed')
+        for i in range(3):
+            order = Order.objects.create(fullname=f'Customer {i}', phone_number='0820000000', status=completed,
+                scheduled_for=timezone.now())
+            OrderItem.objects.create(order=order, menu=self.stew, qty=2)
+            OrderItem.objects.create(order=order, menu=self.pap)
+        Order.objects.create(fullname='Empty', phone_number='0820000000', scheduled_for=timezone.now())
+        self.client.force_login(User.objects.create_user('finance'))
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_orders(self):
+        self.export('/api/v1/exports/categories/')
+        # a query for the orders and one for their items per page of two
+        with self.assertMaxQueries(6):
+            rows = list(csv.DictReader(io.StringIO(self.export('/api/v1/exports/orders/?format=csv'))))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[0]['item_menu'], 'Stew')
+        self.assertEqual(rows[0]['total'], '68.50')
+        self.assertEqual(rows[-1]['item_menu'], '')
+
+        lines = self.export('/api/v1/exports/orders/?status=Completed').splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['items'][1], {'menu_id': self.pap.pk, 'menu': 'Pap', 'qty': 1,
+                                                            'unit_price': '8.50'})
+        self.assertEqual(self.client.get('/api/v1/exports/refunds/').status_code, 404)
+
+    def test_import_menus(self):
+        body = '\n'.join(json.dumps(record) for record in [
+            {'id': self.stew.pk, 'name': 'Beef stew', 'category': 'Mains', 'price': '35.00'},
+            {'name': 'Chakalaka', 'description': 'Spicy', 'price': '12.00', 'is_special': True},
+            {'name': 'Vetkoek', 'category': 'Breakfast', 'price': '6.00'},
+            {'name': 'Amagwinya', 'price': 'free'},
+            'not json',
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/imports/menus/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual((result['created'], result['updated'], result['failed']), (1, 1, 3))
+        self.assertEqual([error['line'] for error in result['errors']], [3, 4, 5])
+        self.assertIn('category', result['errors'][0]['errors'])
+
+        # bulk writes send no signals, the catalogue and the index are refreshed anyway
+        menus = {menu['name']: menu for menu in self.client.get('/api/v1/menus/').json()}
+        self.assertEqual(menus['Beef stew']['price'], '35.00')
+        self.assertTrue(menus['Chakalaka']['is_special'])
+        self.assertEqual([menu['name'] for menu in self.client.get('/api/v1/menus/typeahead/?q=chak').json()],
+                         ['Chakalaka'])
+        self.assertEqual(self.client.post('/api/v1/imports/menus/', body, content_type='text/plain').status_code, 415)
+
+    def test_import_invalid_utf8(self):
+        not_utf8 = {'non_field_errors': ['The line is not valid UTF-8.']}
+        body = b'\xef\xbb\xbfdescription\nSoups\n\xff\xfe\nSalads\n'
+        response = self.client.post('/api/v1/imports/categories/', body, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual((result['created'], result['failed']), (2, 1))
+        self.assertEqual(result['errors'], [{'line': 3, 'errors': not_utf8}])
+
+        body = b'{"description": "\xe9"}\n{"description": "Pies"}\n'
+        response = self.client.post('/api/v1/imports/categories/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.json()['errors'], [{'line': 1, 'errors': not_utf8}])
+        self.assertTrue(Category.objects.filter(description='Pies').exists())
+
+    def test_command_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            categories, menus = os.path.join(directory, 'categories.csv'), os.path.join(directory, 'menus.ndjson')
+            call_command('export_data', 'categories', output=categories, stderr=io.StringIO())
+            call_command('export_data', 'menus', format='ndjson', output=menus, stderr=io.StringIO())
+            Menu.objects.all().delete()
+            Category.objects.all().delete()
+
+            out = io.StringIO()
+            call_command('import_data', 'categories', categories, stdout=out)
+            call_command('import_data', 'menus', menus, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['1 created, 0 updated, 0 skipped.',
+                                                       '2 created, 0 updated, 0 skipped.'])
+        self.assertEqual(Menu.objects.get(pk=self.stew.pk).category.description, 'Mains')
+
+
+class TemporaryMediaMixin:
+    """Stores the test's uploads in a directory of their own"""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def picture(self, color='red', size=(800, 600), mode='RGB'):
+        output = io.BytesIO()
+        Image.new(mode, size, color).save(output, 'PNG')
+        return SimpleUploadedFile('picture.png', output.getvalue(), content_type='image/png')
+
+    def stored_files(self, instance):
+        instance.refresh_from_db()
+        field = Menu._meta.get_field('food_pic')
+        return field.stored_files(instance.food_pic.name, instance.food_pic_variants)
+
+    def assertStored(self, names, stored=True):
+        for name in names:
+            self.assertEqual(default_storage.exists(name), stored, name)
+
+
+@override_settings(STORE_IMAGE_PROCESSING='sync')
+class ImageTest(TemporaryMediaMixin, StoreTestCase):
+    def menu(self, picture, name='Stew'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Menu.objects.create(name=name, price=30, food_pic=picture)
+
+    def test_variants(self):
+        menu = self.menu(self.picture(color=(255, 0, 0, 0), mode='RGBA'))
+        menu.refresh_from_db()
+        stem = os.path.splitext(menu.food_pic.name)[0]
+        self.assertTrue(stem.startswith('food_pictures/'))
+        # no upscaling past the 800 pixels of the upload
+        self.assertEqual(menu.food_pic_variants, {
+            'source': menu.food_pic.name,
+            'default': f'{stem}_300x200.jpg',
+            'srcset': {
+                'jpeg': {'320': f'{stem}_320w.jpg', '640': f'{stem}_640w.jpg'},
+                'webp': {'320': f'{stem}_320w.webp', '640': f'{stem}_640w.webp'},
+            },
+        })
+        self.assertStored(self.stored_files(menu))
+        with Image.open(default_storage.path(f'{stem}_300x200.jpg')) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (300, 200)))
+            # transparency is painted white
+            self.assertTrue(all(channel > 240 for channel in image.getpixel((0, 0))))
+        with Image.open(default_storage.path(f'{stem}_640w.webp')) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (640, 427)))
+
+        response = self.client.get(f'/api/v1/menus/{menu.pk}/')
+        self.assertTrue(response.json()['food_pic'].endswith(f'{stem}_300x200.jpg'))
+
+    def test_release_shared_files(self):
+        first = self.menu(self.picture())
+        # a record copied from another one shares its upload
+        second = self.menu(first.food_pic.name, name='Pap')
+        shared = self.stored_files(first)
+        self.assertEqual(shared, self.stored_files(second))
+
+        # the upload and its variants stay while the other menu uses them
+        first.food_pic = self.picture(color='blue')
+        with self.captureOnCommitCallbacks(execute=True):
+            first.save()
+        self.assertStored(shared)
+        replaced = self.stored_files(first)
+        self.assertStored(replaced)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertStored(shared, stored=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertStored(replaced, stored=False)
+
+    def test_collect_media(self):
+        menu = self.menu(self.picture())
+        for name in ('food_pictures/orphan.jpg', 'food_pictures/new.jpg'):
+            default_storage.save(name, io.BytesIO(b'orphan'))
+        day_ago = (timezone.now() - timedelta(hours=25)).timestamp()
+        os.utime(default_storage.path('food_pictures/orphan.jpg'), (day_ago, day_ago))
+        referenced = self.stored_files(menu)
+        for name in referenced:
+            os.utime(default_storage.path(name), (day_ago, day_ago))
+
+        out = io.StringIO()
+        call_command('collect_media', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['food_pictures/orphan.jpg', '1 orphaned files found.'])
+        call_command('collect_media', stdout=io.StringIO())
+        self.assertStored(['food_pictures/orphan.jpg'], stored=False)
+        self.assertStored(['food_pictures/new.jpg', *referenced])
+
+
+@override_settings(STORE_IMAGE_PROCESSING='thread')
+class ImageThreadTest(TemporaryMediaMixin, TransactionTestCase):
+    """The variants are rendered by the pool, with the record committed"""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, images, '_executor', None)
+        images._executor = None
+
+    def test_thread_pool(self):
+        threads, process_image = [], images.process_image
+
+        def process(*args):
+            threads.append(threading.current_thread().name)
+            process_image(*args)
+
+        with mock.patch.object(images, 'process_image', side_effect=process):
+            menu = Menu.objects.create(name='Stew', price=30, food_pic=self.picture())
+            images.get_executor().shutdown(wait=True)
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('store-images'))
+        self.assertStored(self.stored_files(menu))
+        self.assertEqual(menu.food_pic_variants['source'], menu.food_pic.name)
+
+        # failures are logged in the worker
+        images._executor = None
+        with mock.patch.object(images, 'process_image', side_effect=OSError), \
+                self.assertLogs('Store.images', 'ERROR'):
+            images.submit(Menu, menu.pk, 'food_pic')
+            images.get_executor().shutdown(wait=True)
+
+
+class MediaTest(TemporaryMediaMixin, StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        default_storage.save('food_pictures/0123456789abcdef0123.txt', io.BytesIO(b'0123456789'))
+        self.url = '/media/food_pictures/0123456789abcdef0123.txt'
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        if response.streaming:
+            response.body = b''.join(response.streaming_content)
+            response.close()
+        return response
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual((response.status_code, response.body), (200, b'0123456789'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get('/media/food_pictures/missing.txt').status_code, 404)
+        self.assertEqual(self.client.get('/media/food_pictures/').status_code, 404)
+        # django refuses paths outside MEDIA_ROOT as a suspicious operation
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 400)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    def test_ranges(self):
+        for header, content_range, body in [
+                ('bytes=2-4', 'bytes 2-4/10', b'234'),
+                ('bytes=7-', 'bytes 7-9/10', b'789'),
+                ('bytes=-3', 'bytes 7-9/10', b'789'),
+                ('bytes=8-100', 'bytes 8-9/10', b'89'),
+                ('bytes=-100', 'bytes 0-9/10', b'0123456789')]:
+            response = self.get(HTTP_RANGE=header)
+            self.assertEqual((response.status_code, response['Content-Range'], response.body),
+                             (206, content_range, body), header)
+            self.assertEqual(response['Content-Length'], str(len(body)))
+
+    def test_unsatisfiable_ranges(self):
+        for header in ('bytes=10-', 'bytes=10-12', 'bytes=5-2', 'bytes=-0'):
+            response = self.get(HTTP_RANGE=header)
+            self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'), header)
+
+    def test_malformed_ranges(self):
+        # the whole file is a valid answer to a range that can't be parsed
+        for header in ('bytes=a-b', 'bytes=-', 'bytes=1-2,4-5', 'items=1-2', 'bytes 1-2', ''):
+            response = self.get(HTTP_RANGE=header)
+            self.assertEqual((response.status_code, response.body), (200, b'0123456789'), header)
+
+    def test_if_range(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag).status_code, 206)
+        response = self.get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, response.body), (200, b'0123456789'))
+        # a matching If-None-Match wins over the range
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-1', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class SeedTest(StoreTestCase):
+    def seed(self, seed=7):
+        call_command('seed', mode='refresh', orders=30, menu_items=30, days=3, seed=seed, force=True,
+                     stdout=io.StringIO())
+        return (list(Menu.objects.order_by('pk').values_list('name', 'category__description', 'price', 'is_special')),
+                list(Order.objects.order_by('pk').values_list('fullname', 'location__name', 'status__name',
+                                                              'scheduled_for', 'total', 'item_count')),
+                list(OrderItem.objects.order_by('pk').values_list('order_id', 'menu_id', 'qty', 'unit_price')))
+
+    def test_deterministic(self):
+        menus, orders, items = first = self.seed()
+        self.assertEqual((len(menus), len(orders)), (30, 30))
+        self.assertEqual(sum(order[5] for order in orders), sum(item[2] for item in items))
+        self.assertEqual(self.seed(), first)
+        self.assertNotEqual(self.seed(seed=8), first)
+
+    def test_keeps_settings(self):
+        CanteenSettings.objects.create(order_cutoff=time(10))
+        RevokedToken.objects.create(jti='revoked', expires_at=timezone.now() + timedelta(days=1))
+        self.seed()
+        self.assertEqual(CanteenSettings.load().order_cutoff, time(10))
+        self.assertTrue(RevokedToken.objects.filter(jti='revoked').exists())
+
+    def test_bumped_after_menus(self):
+        # outside of a transaction each bump happens where it is registered
+        menus_at_bump = []
+        on_commit = catalogue.transaction.on_commit
+
+        def register(func, using=None):
+            menus_at_bump.append(Menu.objects.count())
+            return on_commit(func, using)
+
+        with mock.patch.object(catalogue.transaction, 'on_commit', side_effect=register):
+            self.seed()
+        self.assertEqual(menus_at_bump[-1], 30)
+
+    def test_refused_without_debug(self):
+        User.objects.create_user('customer')
+        with self.assertRaisesMessage(CommandError, '--force'):
+            call_command('seed', mode='clear')
+        self.assertTrue(User.objects.exists())
+
+
+class BenchmarkTest(StoreTestCase):
+    def test_run(self):
+        with self.assertRaisesMessage(CommandError, '--force'):
+            call_command('benchmark', populate=True)
+        self.assertFalse(User.objects.exists())
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'report.json')
+            call_command('benchmark', populate=True, menu_items=30, orders=20, days=2, requests=2, force=True,
+                         output=output, stdout=io.StringIO())
+            with open(output) as f:
+                report = json.load(f)
+        self.assertEqual(report['dataset']['menu'], 30)
+        self.assertIn('place order', report['results'])
+        self.assertEqual({name: result['errors'] for name, result in report['results'].items()},
+                         dict.fromkeys(report['results'], 0))
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import permissions, serializers, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt import serializers as jwt_serializers, views as jwt_views
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken, Token
+
+from .authentication import TTLCache, is_revoked
+from .models import RevokedToken, revoked_tokens
+
+recent_refreshes = TTLCache()
+
+
+def revoke(*tokens):
+    """Refuses the tokens once the revocation commits, in this process
+    right away and in the others within STORE_LOOKUP_CHECK_INTERVAL
+    seconds, when they next check the lookup's version."""
+    RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    RevokedToken.objects.bulk_create([
+        RevokedToken(jti=token[jwt_settings.JTI_CLAIM],
+                     expires_at=datetime.fromtimestamp(token['exp'], timezone.utc))
+        for token in tokens], ignore_conflicts=True)
+    revoked_tokens.invalidate()
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """Refuses revoked refresh tokens. Without token rotation a refresh token
+    refreshed again within STORE_AUTH_REFRESH_REUSE_SECONDS gets the access
+    token it got the first time, so clients refreshing together don't each
+    have one signed."""
+
+    def validate(self, attrs):
+        reuse = not jwt_settings.ROTATE_REFRESH_TOKENS
+        cached = recent_refreshes.get(attrs['refresh']) if reuse else None
+        if cached is None:
+            refresh = RefreshToken(attrs['refresh'])
+            cached = (refresh.get(jwt_settings.JTI_CLAIM), None)
+        jti, data = cached
+        if is_revoked(jti):
+            raise InvalidToken(_('Token is revoked'))
+        if data is None:
+            data = super().validate(attrs)
+            if reuse:
+                recent_refreshes.set(attrs['refresh'], (jti, data),
+                    ttl=getattr(settings, 'STORE_AUTH_REFRESH_REUSE_SECONDS', 30))
+        return data
+
+
+class TokenRefreshView(jwt_views.TokenRefreshView):
+    serializer_class = TokenRefreshSerializer
+
+
+class RevokeTokenSerializer(serializers.Serializer):
+    refresh = serializers.CharField(required=False)
+
+
+class RevokeTokenView(APIView):
+    """Revokes the access token the request is made with, and the refresh
+    token when one is posted. See revoke() for when the other workers
+    refuse them."""
+    permission_classes = (permissions.IsAuthenticated, )
+
+    def post(self, request):
+        serializer = RevokeTokenSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        tokens = [request.auth] if isinstance(request.auth, Token) else []
+        if 'refresh' in serializer.validated_data:
+            raw = serializer.validated_data['refresh']
+            try:
+                tokens.append(RefreshToken(raw))
+            except TokenError as e:
+                raise InvalidToken(e.args[0])
+            recent_refreshes.pop(raw)
+        if tokens:
+            revoke(*tokens)
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -11,5 +11,9 @@ router.register('orders', views.OrderView)
 router.register('locations', views.LocationView)
 
 urlpatterns = [
-    path('', include(router.urls))
+    path('', include(router.urls)),
+    path('reports/sales/', views.SalesReportView.as_view(), name='sales-report'),
+    path('settings/', views.CanteenSettingsView.as_view(), name='canteen-settings'),
+    path('exports/<slug:kind>/', views.ExportView.as_view(), name='export'),
+    path('imports/<slug:kind>/', views.ImportView.as_view(), name='import'),
 ]
\ No newline at end of file
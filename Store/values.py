@@ -0,0 +1,224 @@
+import abc
+
+from rest_framework import serializers
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.reverse import reverse as api_reverse
+
+from .metrics import timed
+from .models import *
+from .renderers import FastJSONRenderer
+from .serializers import requested_fields
+
+PK_PLACEHOLDER = '__pk__'
+
+
+def decimal_field(model, name):
+    field = model._meta.get_field(name)
+    return serializers.DecimalField(max_digits=field.max_digits, decimal_places=field.decimal_places)
+
+
+class ValuesSerializer(abc.ABC):
+    """Builds the representation of a model serializer straight from
+    .values() rows, for list endpoints where the per field work of a
+    HyperlinkedModelSerializer dominates. Every subclass must produce the
+    same output as the serializer it stands in for.
+
+    Scalar conversions go through the matching DRF field, urls are
+    reversed once per response and filled in per row.
+    """
+    columns = ()
+
+    def __init__(self, rows, many=True, context=None):
+        self.rows = rows
+        self.context = context or {}
+
+    @classmethod
+    def values(cls, queryset):
+        # related rows are either joined into the values or fetched in bulk
+        return queryset.prefetch_related(None).values(*cls.columns)
+
+    @property
+    def data(self):
+        with timed('serializer'):
+            self.request = self.context['request']
+            self.prepare()
+            return [self.to_representation(row) for row in self.rows]
+
+    def prepare(self):
+        pass
+
+    @abc.abstractmethod
+    def to_representation(self, row):
+        """The serialized form of one .values() row, a dict of str, int,
+        bool, None, list and dict values as FastJSONRenderer expects"""
+
+    def detail_url(self, view_name):
+        """Returns pk -> absolute url of the detail view"""
+        kwargs = {'pk': PK_PLACEHOLDER}
+        if self.context.get('format'):
+            kwargs['format'] = self.context['format']
+        template = api_reverse(view_name, kwargs=kwargs, request=self.request)
+        prefix, suffix = template.split(PK_PLACEHOLDER)
+        return lambda pk: f'{prefix}{pk}{suffix}'
+
+    def image(self, field, name, variants):
+        """Same as ProcessedImageSerializerField"""
+        if not name:
+            return None
+        variants = variants if (variants or {}).get('source') == name else {}
+        return self.request.build_absolute_uri(field.storage.url(variants.get('default') or name))
+
+    def srcset(self, field, name, variants):
+        """Same as ImageSrcsetField"""
+        if not name or (variants or {}).get('source') != name:
+            return {}
+        srcset = {}
+        for format, names in variants.get('srcset', {}).items():
+            srcset[format] = ', '.join(
+                f'{self.request.build_absolute_uri(field.storage.url(name))} {width}w'
+                for width, name in sorted(names.items(), key=lambda item: int(item[0])))
+        return srcset
+
+
+class CategoryValues(ValuesSerializer):
+    """CategorySerializer"""
+    columns = ('id', 'description', 'slug', 'category_pic', 'category_pic_variants')
+    picture = Category._meta.get_field('category_pic')
+
+    def prepare(self):
+        self.url = self.detail_url('category-detail')
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'url': self.url(row['id']),
+            'description': row['description'],
+            'slug': row['slug'],
+            'category_pic': self.image(self.picture, row['category_pic'], row['category_pic_variants']),
+            'category_pic_srcset': self.srcset(self.picture, row['category_pic'], row['category_pic_variants']),
+        }
+
+
+class MenuValues(ValuesSerializer):
+    """MenuSerializer, with its category nested as in MenuCategorySerializer"""
+    columns = ('id', 'name', 'description', 'price', 'food_pic', 'food_pic_variants', 'is_special',
+               'category_id', 'category__description', 'category__slug', 'category__category_pic',
+               'category__category_pic_variants')
+    picture = Menu._meta.get_field('food_pic')
+    category_picture = Category._meta.get_field('category_pic')
+    price_field = decimal_field(Menu, 'price')
+
+    def prepare(self):
+        self.url = self.detail_url('menu-detail')
+        self.category_url = self.detail_url('category-detail')
+
+    def to_representation(self, row):
+        category = None
+        if row['category_id'] is not None:
+            name, variants = row['category__category_pic'], row['category__category_pic_variants']
+            category = {
+                'url': self.category_url(row['category_id']),
+                'description': row['category__description'],
+                'slug': row['category__slug'],
+                'category_pic': self.image(self.category_picture, name, variants),
+                'category_pic_srcset': self.srcset(self.category_picture, name, variants),
+            }
+        return {
+            'id': row['id'],
+            'url': self.url(row['id']),
+            'name': row['name'],
+            'description': row['description'],
+            'category': category,
+            'price': self.price_field.to_representation(row['price']),
+            'food_pic': self.image(self.picture, row['food_pic'], row['food_pic_variants']),
+            'food_pic_srcset': self.srcset(self.picture, row['food_pic'], row['food_pic_variants']),
+            'is_special': row['is_special'],
+        }
+
+
+class LocationValues(ValuesSerializer):
+    """LocationSerializer"""
+    columns = ('id', 'name', 'slot_minutes', 'slot_capacity', 'opens_at', 'closes_at')
+    time_field = serializers.TimeField()
+
+    def prepare(self):
+        self.url = self.detail_url('location-detail')
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'url': self.url(row['id']),
+            'name': row['name'],
+            'slot_minutes': row['slot_minutes'],
+            'slot_capacity': row['slot_capacity'],
+            'opens_at': self.time_field.to_representation(row['opens_at']),
+            'closes_at': self.time_field.to_representation(row['closes_at']),
+        }
+
+
+class OrderValues(ValuesSerializer):
+    """OrderSerializer, including its `fields` parameter. Status and payment
+    names are joined in, menu items fetched with one query per page.
+    """
+    columns = ('id', 'fullname', 'phone_number', 'location_id', 'scheduled_for', 'status__name',
+               'payment__name', 'total', 'item_count')
+    fields = ('id', 'url', 'fullname', 'phone_number', 'location', 'scheduled_for', 'status', 'payment',
+              'menu_items', 'total', 'item_count')
+    datetime_field = serializers.DateTimeField()
+    total_field = decimal_field(Order, 'total')
+
+    def prepare(self):
+        requested = requested_fields(self.request)
+        self.fields = [name for name in self.fields if requested is None or name in requested]
+        self.url = self.detail_url('order-detail')
+        self.location_url = self.detail_url('location-detail')
+        self.menu_url = self.detail_url('menu-detail')
+        self.rows = list(self.rows)
+        self.menu_items = {}
+        if 'menu_items' in self.fields and self.rows:
+            items = OrderItem.objects.filter(order_id__in=[row['id'] for row in self.rows]) \
+                .values_list('order_id', 'menu_id')
+            for order_id, menu_id in items:
+                self.menu_items.setdefault(order_id, []).append(menu_id)
+
+    def to_representation(self, row):
+        data = {
+            'id': row['id'],
+            'url': self.url(row['id']),
+            'fullname': row['fullname'],
+            'phone_number': row['phone_number'],
+            'location': self.location_url(row['location_id']) if row['location_id'] is not None else None,
+            'scheduled_for': self.datetime_field.to_representation(row['scheduled_for']),
+            'status': row['status__name'],
+            'payment': row['payment__name'],
+            'menu_items': [self.menu_url(pk) for pk in self.menu_items.get(row['id'], ())],
+            'total': self.total_field.to_representation(row['total']),
+            'item_count': row['item_count'],
+        }
+        if len(self.fields) < len(data):
+            return {name: data[name] for name in self.fields}
+        return data
+
+
+class ValuesListMixin:
+    """Lists with `values_serializer_class` and renders with orjson, the
+    viewset's serializer_class still handles everything else. Without a
+    values_serializer_class the list goes through serializer_class too.
+    """
+    values_serializer_class = None
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
+
+    def get_values_serializer(self, queryset):
+        rows = self.values_serializer_class.values(queryset)
+        page = self.paginate_queryset(rows)
+        return self.values_serializer_class(rows if page is None else page,
+            context=self.get_serializer_context()), page is not None
+
+    def list(self, request, *args, **kwargs):
+        if self.values_serializer_class is None:
+            return super().list(request, *args, **kwargs)
+        serializer, paginated = self.get_values_serializer(self.filter_queryset(self.get_queryset()))
+        if paginated:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
@@ -1,28 +1,218 @@
-from django.shortcuts import render
-from rest_framework import viewsets, permissions
+
+from django.conf import settings
+from django.shortcuts import get_object_or_404, render
+from django.http import Http404
+from django.utils import timezone
+from rest_framework import exceptions, serializers, viewsets, permissions, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from .models import *
 from .serializers import *
+from .app_settings import Settings
+from .authentication import AnonymousReadMixin
+from .catalogue import menu_catalogue
+from .conditional import ConditionalGetMixin
+from .databases import ReplicaReadMixin, primary
+from .events import order_event
+from .exports import EXPORTS, CSVRenderer, NDJSONRenderer, export_response
+from .imports import FORMATS, IMPORTS, read_records
+from .orders import place_orders
+from .pagination import OrderCursorPagination
+from .filters import OrderFilter
+from .reports import SalesReportQuerySerializer, sales_report
+from .search import menu_index
+from .slots import available_slots
+from .values import CategoryValues, LocationValues, MenuValues, OrderValues, ValuesListMixin
+from django_filters.rest_framework import DjangoFilterBackend
 # Create your views here.
 
-class CategoryView(viewsets.ModelViewSet):
+class CategoryView(AnonymousReadMixin, ReplicaReadMixin, ConditionalGetMixin, ValuesListMixin, viewsets.ModelViewSet):
+    version_name = 'category'
     queryset = Category.objects.all() 
     serializer_class = CategorySerializer
+    values_serializer_class = CategoryValues
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, )
 
 
-class MenuView(viewsets.ModelViewSet):
-    queryset = Menu.objects.all() 
+class MenuView(AnonymousReadMixin, ReplicaReadMixin, ConditionalGetMixin, ValuesListMixin, viewsets.ModelViewSet):
+    version_name = 'menu'
+    queryset = Menu.objects.select_related('category')
     serializer_class = MenuSerializer
+    values_serializer_class = MenuValues
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, )
 
+    def build_catalogue(self):
+        # cached until the next change to the menu, a lagging replica would keep it stale
+        with primary():
+            queryset = self.filter_queryset(self.get_queryset())
+            if self.values_serializer_class is not None:
+                return self.get_values_serializer(queryset)[0].data
+            return self.get_serializer(queryset, many=True).data
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, self.list_catalogue, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, self.retrieve_catalogue, *args, **kwargs)
+
+    def list_catalogue(self, request, *args, **kwargs):
+        catalogue = menu_catalogue(request, self.build_catalogue, self.format_kwarg)
+        return Response(list(catalogue.values()))
+
+    def retrieve_catalogue(self, request, *args, **kwargs):
+        catalogue = menu_catalogue(request, self.build_catalogue, self.format_kwarg)
+        try:
+            return Response(catalogue[int(kwargs['pk'])])
+        except (KeyError, ValueError):
+            raise Http404
+
+    def search_index(self, request):
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return [menu for score, menu in menu_index.search(query.validated_data['q'], query.validated_data['limit'])]
+
+    @action(detail=False)
+    def search(self, request):
+        """Menus matching ?q= by name, description or category, best first"""
+        ids = [menu['id'] for menu in self.search_index(request)]
+        queryset = self.get_queryset().filter(pk__in=ids)
+        if self.values_serializer_class is not None:
+            rows = self.values_serializer_class(self.values_serializer_class.values(queryset),
+                context=self.get_serializer_context()).data
+        else:
+            rows = self.get_serializer(queryset, many=True).data
+        by_id = {row['id']: row for row in rows}
+        return Response([by_id[pk] for pk in ids if pk in by_id])
+
+    @action(detail=False)
+    def typeahead(self, request):
+        """Suggestions for a partly typed ?q=, straight from the search index"""
+        return Response(MenuSuggestionSerializer(self.search_index(request), many=True).data)
 
-class OrderView(viewsets.ModelViewSet):
-    queryset = Order.objects.all() 
+
+class OrderView(AnonymousReadMixin, ReplicaReadMixin, ValuesListMixin, viewsets.ModelViewSet):
+    # orders are read from the primary, placing one keeps the client there
+    replica_actions = ()
+    queryset = Order.objects.select_related('location', 'status', 'payment') \
+        .prefetch_related('menu_items')
     serializer_class = OrderSerializer
+    values_serializer_class = OrderValues
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, )
+    pagination_class = OrderCursorPagination
+    filter_backends = (DjangoFilterBackend, )
+    filterset_class = OrderFilter
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        requested = requested_fields(self.request)
+        if requested is not None and 'menu_items' not in requested:
+            queryset = queryset.prefetch_related(None)
+        return queryset
+
+    @action(detail=True, url_path='status', url_name='status')
+    def order_status(self, request, pk=None):
+        """The order's current status, in the same shape as its status events"""
+        order = get_object_or_404(Order.objects.values('id', 'location_id', 'status__name', 'scheduled_for'), pk=pk)
+        return Response(order_event(order['id'], order['location_id'], order['status__name'],
+                                    order['scheduled_for']))
+
+    @action(detail=False, methods=['post'])
+    def place(self, request):
+        """Places one order, or a list of orders, together with their items"""
+        many = isinstance(request.data, list)
+        serializer = PlaceOrderSerializer(data=request.data, many=many,
+            context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        orders = serializer.validated_data if many else [serializer.validated_data]
 
+        try:
+            created = place_orders(orders)
+        except serializers.ValidationError as e:
+            if not many:
+                e.detail = e.detail[0]
+            raise
 
-class LocationView(viewsets.ModelViewSet):
+        queryset = self.get_queryset().filter(pk__in=[order.pk for order in created])
+        data = self.get_serializer(queryset, many=True).data
+        return Response(data if many else data[0], status=status.HTTP_201_CREATED)
+
+
+class LocationView(AnonymousReadMixin, ReplicaReadMixin, ConditionalGetMixin, ValuesListMixin, viewsets.ModelViewSet):
+    version_name = 'location'
     queryset = Location.objects.all() 
     serializer_class = LocationSerializer
-    permission_classes = (permissions.IsAuthenticatedOrReadOnly, )
\ No newline at end of file
+    values_serializer_class = LocationValues
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly, )
+
+    @action(detail=True)
+    def slots(self, request, pk=None):
+        """Places left in the location's slots, today or on ?date=YYYY-MM-DD"""
+        location = self.get_object()
+        query = SlotQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        day = query.validated_data.get('date') or timezone.localdate()
+        return Response(SlotSerializer(available_slots(location, day), many=True).data)
+
+
+class SalesReportView(APIView):
+    """Quantities and revenue from the sales rollups, e.g.
+    ?group_by=menu&group_by=slot&start=2021-06-01&status=Created
+    """
+    permission_classes = (permissions.IsAuthenticated, )
+
+    def get(self, request):
+        query = SalesReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(sales_report(**query.validated_data))
+
+
+class CanteenSettingsView(AnonymousReadMixin, ConditionalGetMixin, APIView):
+    """The canteen settings the frontend needs on every page, public and
+    cacheable for STORE_SETTINGS_MAX_AGE seconds"""
+    version_name = canteen_settings.version_name
+    permission_classes = (permissions.AllowAny, )
+
+    def get(self, request):
+        response = self.conditional(request, self.respond)
+        response['Cache-Control'] = f"public, max-age={getattr(settings, 'STORE_SETTINGS_MAX_AGE', 60)}"
+        return response
+
+    def respond(self, request):
+        return Response(CanteenSettingsSerializer(Settings.app_settings(), context={'request': request}).data)
+
+
+class ExportView(APIView):
+    """Streams every category, menu or order as ?format=csv or ?format=ndjson
+    (the default). Orders take the order list's filters, e.g.
+    exports/orders/?format=csv&status=Completed&scheduled_for_after=2021-06-01
+    """
+    permission_classes = (permissions.IsAuthenticated, )
+    renderer_classes = (NDJSONRenderer, CSVRenderer)
+
+    def get(self, request, kind):
+        if kind not in EXPORTS:
+            raise Http404
+        queryset = None
+        if kind == 'orders':
+            filterset = OrderFilter(request.query_params, queryset=Order.objects.all())
+            if not filterset.is_valid():
+                raise serializers.ValidationError(filterset.errors)
+            queryset = filterset.qs
+        return export_response(EXPORTS[kind](queryset), request.accepted_renderer.format, kind)
+
+
+class ImportView(APIView):
+    """Creates and updates categories or menus from a text/csv or
+    application/x-ndjson body in the exports' format. The body is read as
+    it's imported, the response counts what was done and lists the lines
+    that were skipped."""
+    permission_classes = (permissions.IsAuthenticated, )
+
+    def post(self, request, kind):
+        if kind not in IMPORTS:
+            raise Http404
+        file_format = FORMATS.get(request.content_type.partition(';')[0].strip())
+        if file_format is None:
+            raise exceptions.UnsupportedMediaType(request.content_type)
+        return Response(IMPORTS[kind]().run(read_records(request._request, file_format)))
@@ -13,4 +13,11 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'canteen_django.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once django is set up
+from Store.events import events_application
+from Store.exports import exports_application
+from Store.reads import read_application
+
+application = events_application(exports_application(read_application(django_application)))
@@ -46,11 +46,14 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'corsheaders',
-    'Store',
+    'Store.apps.StoreConfig',
     'rest_framework',
+    'django_filters',
 ]
 
 MIDDLEWARE = [
+    'Store.metrics.MetricsMiddleware',
+    'Store.databases.ConnectionHealthMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,6 +65,15 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
 ]
 
+# Every request's latency and size is recorded, queries, database and
+# serializer time for this share of them. Slower requests are logged with
+# their SQL to the Store.slow_requests logger. /metrics is served to staff
+# users, and to scrapers sending "Authorization: Bearer <STORE_METRICS_TOKEN>".
+STORE_METRICS_ENABLED = True
+STORE_METRICS_SAMPLE_RATE = 0.1
+STORE_SLOW_REQUEST_SECONDS = 1.0
+STORE_METRICS_TOKEN = os.environ.get('STORE_METRICS_TOKEN')
+
 CORS_ORIGIN_ALLOW_ALL = True # If this is used then `CORS_ORIGIN_WHITELIST` will not have any effect
 CORS_ALLOW_CREDENTIALS = True
 # CORS_ORIGIN_WHITELIST = [
@@ -95,16 +107,138 @@ WSGI_APPLICATION = 'canteen_django.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Connections are kept open for CONN_MAX_AGE seconds. A request reusing one
+# that sat idle for STORE_DB_HEALTH_CHECK_IDLE seconds pings it first
+# (STORE_DB_HEALTH_CHECKS). Set DB_REPLICA_HOST to read menus, categories
+# and locations from a replica, it gets a test database of its own that
+# only the router test reads from. DB_SQLITE=1 runs on a local SQLite file
+# without a replica.
+
 DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.mysql',
             'NAME': 'aisoluti_canteen',
             'USER': 'root',
             'PASSWORD': '1234',
-            'HOST': '127.0.0.1'
+            'HOST': '127.0.0.1',
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
         }
     }
 
+if os.environ.get('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ['DB_REPLICA_HOST'],
+        'TEST': {'NAME': 'test_aisoluti_canteen_replica'},
+    }
+
+if os.environ.get('DB_SQLITE'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        },
+    }
+
+DATABASE_ROUTERS = ['Store.databases.ReplicaRouter']
+STORE_REPLICA_DATABASE = 'replica'
+# after a write the client reads from the primary for this long
+STORE_REPLICA_PIN_SECONDS = 5
+STORE_DB_HEALTH_CHECKS = True
+STORE_DB_HEALTH_CHECK_IDLE = 10
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# Local memory is per process, set REDIS_URL so every worker shares the
+# menu catalogue.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'Store.cache_backends.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+STORE_CACHE = 'default'
+STORE_CATALOGUE_TIMEOUT = None
+
+# Workers learn that the rows they keep in memory or in the cache changed
+# from version counters, kept in the database ('database') or in the cache
+# when every worker shares it ('cache', refused by a system check for a
+# cache each worker keeps to itself). A worker sees a change made by another
+# one within STORE_LOOKUP_CHECK_INTERVAL seconds.
+STORE_VERSIONS = 'database'
+STORE_LOOKUP_CHECK_INTERVAL = 5
+
+if os.environ.get('REDIS_URL'):
+    STORE_VERSIONS = 'cache'
+
+# Order status events are fanned out in process unless redis is available
+# to share them between workers
+STORE_EVENTS_BACKEND = 'Store.events.InMemoryHub'
+
+if os.environ.get('REDIS_URL'):
+    STORE_EVENTS_BACKEND = 'Store.events.RedisHub'
+    STORE_EVENTS_REDIS_URL = os.environ['REDIS_URL']
+
+
+# Orders for a full time slot move to the next slot with room ('next') or
+# are refused ('reject')
+STORE_SLOT_OVERFLOW = 'next'
+
+
+# Under ASGI, public reads of menus, categories and locations are answered
+# from the responses kept here until their data changes (at most
+# STORE_READ_CACHE_TTL seconds), order statuses for STORE_ORDER_STATUS_TTL.
+STORE_READ_CACHE_SIZE = 1000
+STORE_READ_CACHE_TTL = 300
+STORE_ORDER_STATUS_TTL = 2
+
+
+# api/v1/exports/ and the export_data command read STORE_EXPORT_CHUNK_SIZE
+# rows per query. Imports are written in a transaction per
+# STORE_IMPORT_BATCH_SIZE records and report the first
+# STORE_IMPORT_MAX_ERRORS records they skip.
+STORE_EXPORT_CHUNK_SIZE = 2000
+STORE_IMPORT_BATCH_SIZE = 1000
+STORE_IMPORT_MAX_ERRORS = 100
+
+
+# Menu search scores of specials are multiplied by this
+STORE_SEARCH_SPECIAL_BOOST = 1.5
+
+
+# How long browsers and proxies may reuse api/v1/settings/
+STORE_SETTINGS_MAX_AGE = 60
+
+
+# Verified tokens and users are kept in each process for STORE_AUTH_CACHE_TTL
+# seconds, at most STORE_AUTH_CACHE_SIZE of each. Revocations are stored in
+# the database and checked against a copy kept in each process, so access
+# tokens can live longer than a minute. The worker that revokes a token
+# refuses it at once, the others once they read the version counter again
+# (see STORE_VERSIONS), within STORE_LOOKUP_CHECK_INTERVAL seconds. A refresh
+# token refreshed again within STORE_AUTH_REFRESH_REUSE_SECONDS gets the same
+# access token back.
+STORE_AUTH_CACHE_SIZE = 10000
+STORE_AUTH_CACHE_TTL = 60
+STORE_AUTH_REFRESH_REUSE_SECONDS = 30
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+
+# Uploaded pictures are stored as is and resized by a pool of background
+# threads. 'sync' renders them inside the request instead.
+
+STORE_IMAGE_PROCESSING = 'thread'
+STORE_IMAGE_WORKERS = 2
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -155,6 +289,14 @@ MEDIA_ROOT = '/home/aisoluti/canteen.a-i-solutions.co.za/media/'
 if DEBUG:
     MEDIA_ROOT = os.path.join(BASE_DIR + '/media/')
 
+# Let the front-end server send media files: None streams them from python,
+# 'x-accel-redirect' for nginx (an internal location at STORE_MEDIA_ACCEL_PREFIX
+# aliased to MEDIA_ROOT) or 'x-sendfile' for apache/lighttpd.
+STORE_MEDIA_SENDFILE = None
+STORE_MEDIA_ACCEL_PREFIX = '/protected-media/'
+# content hashed files are cached forever, anything else for this long
+STORE_MEDIA_MAX_AGE = 3600
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -163,13 +305,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.IsAuthenticated',),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
+        'Store.authentication.CachedJWTAuthentication',
+        'Store.authentication.CachedSessionAuthentication',
     )
 }
 
 SIMPLE_JWT = {
-'ACCESS_TOKEN_LIFETIME': timedelta(minutes=1),
+'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
 'REFRESH_TOKEN_LIFETIME': timedelta(days=20),
 'ROTATE_REFRESH_TOKENS': False,
 'BLACKLIST_AFTER_ROTATION': True,
@@ -14,11 +14,13 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from django.urls import path, re_path, include
+from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth import views as auth_views
-from django.conf.urls.static import static
 from django.conf import settings
+from Store.tokens import RevokeTokenView, TokenRefreshView
+from Store.media import serve_media
+from Store.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -26,6 +28,9 @@ urlpatterns = [
     path('api-auth/', include('rest_framework.urls')),
     path('api/token/', TokenObtainPairView.as_view()),
     path('api/token/refresh/', TokenRefreshView.as_view()),
+    path('api/token/revoke/', RevokeTokenView.as_view()),
 
     path('login/', auth_views.LoginView.as_view()),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('metrics', metrics_view),
+    re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), serve_media),
+]